@@ -0,0 +1,131 @@
+"""
+Broadcast throughput against a local stub of the Bot API sendMessage
+endpoint. Every 50th recipient has blocked the bot (403), every 97th is
+throttled once with retry_after=1 (429). The run reports the wall time,
+the request rate the pacer let through and the counters stored in
+broadcasts; --interrupt-after cancels the task mid-way and resumes it
+from the saved progress with a fresh Broadcaster, like a restart.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.broadcast --users 2000 --rate 30 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from src.services.broadcast import Broadcaster
+from src.services.database import DatabaseManager
+
+
+BATCH_SIZE = 50
+MAX_IN_FLIGHT = 10
+AUTHOR_ID = 10 ** 9 + 1
+
+
+def fill_users(db, count):
+    with db._lock:
+        db._connection.executemany(
+            "INSERT INTO users (user_id, username, authorized_at) VALUES (?, NULL, '2025-01-01')",
+            [(user_id,) for user_id in range(1, count + 1)],
+        )
+        db._connection.commit()
+
+
+def send_message_handler(latency, throttle, hits):
+    throttled = set()
+
+    async def handle(request):
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        hits["requests"] += 1
+        await asyncio.sleep(latency)
+        if chat_id % 50 == 0:
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                status=403,
+            )
+        if throttle and chat_id % 97 == 0 and chat_id not in throttled:
+            throttled.add(chat_id)
+            hits["429"] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 1}},
+                status=429,
+            )
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "x"},
+            }
+        )
+
+    return handle
+
+
+async def run(db, args):
+    hits = {"requests": 0, "429": 0}
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", send_message_handler(args.latency, not args.no_429, hits))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    bot = Bot("1:stub", session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")))
+
+    try:
+        broadcaster = Broadcaster(db, rate=args.rate, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT)
+        started = time.perf_counter()
+        broadcast_id = await broadcaster.start(bot, "hello", AUTHOR_ID)
+        if args.interrupt_after:
+            await asyncio.sleep(args.interrupt_after)
+            await broadcaster.shutdown()
+            row = db.get_broadcast(broadcast_id)
+            print(f"interrupted after user {row['last_user_id']}, sent {row['sent']}")
+            broadcaster = Broadcaster(db, rate=args.rate, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT)
+            await broadcaster.resume(bot)
+        await broadcaster._tasks[broadcast_id]
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    row = db.get_broadcast(broadcast_id)
+    print(
+        f"users={args.users} rate={args.rate}/s latency={args.latency * 1000:.0f} ms: "
+        f"{elapsed:.2f} s, {hits['requests'] / elapsed:.1f} requests/s"
+    )
+    print(
+        f"status={row['status']} sent={row['sent']} failed={row['failed']} blocked={row['blocked']} "
+        f"429s={hits['429']} requests={hits['requests']}"
+    )
+    print(f"recipients of the next broadcast: {len(db.get_broadcast_recipients(0, args.users))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--interrupt-after", type=float, default=0.0)
+    parser.add_argument("--no-429", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(os.path.join(directory, "broadcast.sqlite3"))
+        try:
+            fill_users(db, args.users)
+            asyncio.run(run(db, args))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
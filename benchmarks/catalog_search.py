@@ -0,0 +1,96 @@
+"""
+Timings for the catalog search index on a synthetic catalog of 50k entries
+with Russian names and Latin values.
+
+Run from the repository root:
+
+    python -m benchmarks.catalog_search
+"""
+import gc
+import random
+import time
+import tracemalloc
+
+from src.services.catalog_search import CatalogSearchIndex
+
+
+ENTRIES = 50_000
+RU_WORDS = (
+    "спектакли театр москва концерт экскурсия пригород корабли аквапарк аренда другое блог туры "
+    "карелия дети рассылка сторис канал пост клип регионы зарубежье питер казань сочи"
+).split()
+EN_WORDS = (
+    "spektakl teatr msk concert excursion prigorod korabli akvapark arenda other blog tury "
+    "kareliya deti rassilka stories kanal post clip regions foreign spb kazan sochi"
+).split()
+PREFIX_QUERIES = ["спект", "моск", "kareliya", "akvap", "пост клип", "rass", "12345"]
+TYPO_QUERIES = ["спектакди", "масква", "karelia", "akvapakr", "экскурся", "расылка"]
+
+
+def synthetic_catalog(size, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for entry_id in range(1, size + 1):
+        words = rng.sample(range(len(RU_WORDS)), rng.randint(1, 3))
+        name = " ".join(RU_WORDS[word].capitalize() for word in words) + f" {entry_id}"
+        value = "_".join(EN_WORDS[word] for word in words) + f"_{entry_id}"
+        entries.append((entry_id, name, value))
+    return entries
+
+
+def build_index(entries):
+    index = CatalogSearchIndex()
+    for entry_id, name, value in entries:
+        index.add(entry_id, name, value)
+    return index
+
+
+def per_query(search, queries, repeat=3):
+    """Best of several passes, seconds per query"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for query in queries:
+            search(query)
+        best = min(best, time.perf_counter() - started)
+    return best / len(queries)
+
+
+def main() -> None:
+    entries = synthetic_catalog(ENTRIES)
+
+    gc.collect()
+    tracemalloc.start()
+    index = build_index(entries)
+    memory = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    # Timed again without tracemalloc, which slows allocation down
+    del index
+    started = time.perf_counter()
+    index = build_index(entries)
+    build = time.perf_counter() - started
+
+    def substring_scan(query):
+        query = query.casefold()
+        return [entry for entry in entries if query in entry[1].casefold() or query in entry[2].casefold()]
+
+    print(f"build:                      {build * 1e3:6.0f} ms, ~{memory:.0f} MiB")
+    print(f"naive substring scan:       {per_query(substring_scan, PREFIX_QUERIES) * 1e3:6.1f} ms/query")
+    prefix = per_query(lambda query: index.search(query, limit=20), PREFIX_QUERIES)
+    print(f"prefix query (limit 20):    {prefix * 1e3:6.1f} ms/query")
+    typo = per_query(lambda query: index.search(query, limit=20), TYPO_QUERIES)
+    print(f"typo query (limit 20):      {typo * 1e3:6.1f} ms/query")
+
+    started = time.perf_counter()
+    for entry_id, name, value in entries[:1000]:
+        index.remove(entry_id)
+    for entry_id, name, value in entries[:1000]:
+        index.add(entry_id, name, value)
+    print(f"incremental remove + add:   {(time.perf_counter() - started) / 2000 * 1e6:6.0f} us/op")
+
+    for query in TYPO_QUERIES:
+        print(f"{query!r} -> {[entries[entry_id - 1][1] for entry_id in index.search(query, limit=3)]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Tail latency of the shortener with and without hedging, against two local
+stub servers. The primary (clc.li API) answers in 20-60 ms, except 3% of
+requests that take 1 s; the backup (YOURLS API) answers in 80-120 ms.
+400 requests are sent, 20 at a time, each for a different link.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.hedged_shortener
+"""
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from aiohttp import web
+
+from src.services.shorteners import ClcShortener, HedgedShortener, ShortenerStats, YourlsShortener
+
+
+REQUESTS = 400
+CONCURRENCY = 20
+_links = itertools.count()
+
+
+def primary_handler(rng):
+    async def handle(request):
+        await asyncio.sleep(1.0 if rng.random() < 0.03 else rng.uniform(0.02, 0.06))
+        return web.json_response({"error": 0, "shorturl": "https://clc.example/1"})
+
+    return handle
+
+
+def backup_handler(rng):
+    async def handle(request):
+        await asyncio.sleep(rng.uniform(0.08, 0.12))
+        return web.json_response({"status": "success", "shorturl": "https://yourls.example/1"})
+
+    return handle
+
+
+async def start_stub(handler):
+    """Serves handler on a free local port; returns the runner and the URL"""
+    app = web.Application()
+    app.router.add_post("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+async def latencies(shortener, requests):
+    results = []
+
+    async def one():
+        # A new link every time: identical links would be coalesced into one call
+        started = time.perf_counter()
+        assert await shortener.shorten(f"https://example.com/event-{next(_links)}")
+        results.append(time.perf_counter() - started)
+
+    for _ in range(0, requests, CONCURRENCY):
+        await asyncio.gather(*(one() for _ in range(CONCURRENCY)))
+    return sorted(results)
+
+
+def percentiles(samples):
+    return "/".join(f"{samples[int(len(samples) * share)] * 1e3:.0f}" for share in (0.5, 0.95, 0.99))
+
+
+async def run() -> None:
+    rng = random.Random(3)
+    primary_runner, primary_url = await start_stub(primary_handler(rng))
+    backup_runner, backup_url = await start_stub(backup_handler(rng))
+    plain = HedgedShortener(ClcShortener("key", primary_url), None, initial_hedge_delay=1.5)
+    hedged = HedgedShortener(
+        ClcShortener("key", primary_url), YourlsShortener(backup_url, "signature"), initial_hedge_delay=1.5
+    )
+    try:
+        print(f"primary only: p50/p95/p99 = {percentiles(await latencies(plain, REQUESTS))} ms")
+        # Fill the p95 window before measuring
+        await latencies(hedged, 100)
+        hedged.stats = ShortenerStats()
+        samples = await latencies(hedged, REQUESTS)
+        print(
+            f"hedged:       p50/p95/p99 = {percentiles(samples)} ms, "
+            f"hedge rate {hedged.stats.hedge_rate:.1%}, hedge delay {hedged.hedge_delay() * 1e3:.0f} ms"
+        )
+    finally:
+        await plain.close()
+        await hedged.close()
+        await primary_runner.cleanup()
+        await backup_runner.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+"""
+History storage before and after URL interning: file size after VACUUM,
+the one-time migration and get_history latency on a synthetic history
+(50 users, 20k base URLs).
+
+Run from the repository root with the bot's environment (.env); the
+default is the 1M rows quoted in the change, --rows makes a quicker run:
+
+    python -m benchmarks.history_layout --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from src.services.database import DatabaseManager
+
+
+USERS = 50
+BASE_URLS = 20_000
+SOURCES = ["vk", "tg", "ok", "dzen", "email", "site"]
+MEDIUMS = ["post", "stories", "clip", "mailing", "banner"]
+CAMPAIGNS = ["spb", "msk", "regions", "foreign", "spring_sale", "autumn"]
+LEGACY_HISTORY_TABLE = """
+CREATE TABLE history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    base_url TEXT NOT NULL,
+    utm_url TEXT NOT NULL,
+    short_url TEXT NOT NULL,
+    created_at TEXT NOT NULL
+)
+"""
+
+
+def legacy_rows(count, seed=1):
+    rng = random.Random(seed)
+    for row_id in range(1, count + 1):
+        slug = f"event-{rng.randrange(BASE_URLS)}"
+        base_url = f"https://www.gorbilet.com/actions/{slug}/"
+        utm_url = (
+            f"{base_url}?utm_source={rng.choice(SOURCES)}&utm_medium={rng.choice(MEDIUMS)}"
+            f"&utm_campaign={rng.choice(CAMPAIGNS)}&utm_content={slug}"
+        )
+        yield row_id, rng.randrange(1, USERS + 1), base_url, utm_url, f"https://clck.ru/{row_id:x}", "2024-01-01T00:00:00"
+
+
+def build_legacy(path, count):
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_HISTORY_TABLE)
+    connection.executemany("INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)", legacy_rows(count))
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def vacuumed_size(path):
+    connection = sqlite3.connect(path)
+    connection.execute("VACUUM")
+    connection.close()
+    return os.path.getsize(path) / 2 ** 20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.sqlite3")
+        build_legacy(path, args.rows)
+        print(f"legacy layout, {args.rows} rows: {os.path.getsize(path) / 2 ** 20:.0f} MiB")
+
+        started = time.perf_counter()
+        db = DatabaseManager(path)
+        print(f"migration (all steps):     {time.perf_counter() - started:.1f} s")
+
+        calls = 2000
+        started = time.perf_counter()
+        for index in range(calls):
+            db.get_history(index % USERS + 1, limit=20)
+        print(f"get_history(limit=20):     {(time.perf_counter() - started) / calls * 1e3:.2f} ms/call")
+        db.close()
+        print(f"interned layout:           {vacuumed_size(path):.0f} MiB with the search index")
+        connection = sqlite3.connect(path)
+        connection.execute("DROP TABLE history_search")
+        connection.close()
+        print(f"                           {vacuumed_size(path):.0f} MiB without it")
+
+
+if __name__ == "__main__":
+    main()
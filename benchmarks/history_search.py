@@ -0,0 +1,58 @@
+"""
+/find latency on a synthetic history (50 users, 20k base URLs): the
+one-time migration that backfills the search index, then the median and
+worst time of a results page for terms from very common ("gorbilet",
+every row) to selective (one event) and absent.
+
+Run from the repository root with the bot's environment (.env); the
+default is the 1M rows quoted in the change, --rows makes a quicker run:
+
+    python -m benchmarks.history_search --rows 1000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.history_layout import USERS, build_legacy
+from src.services.database import DatabaseManager
+
+
+PAGE_SIZE = 10
+PAGES = 3
+TERMS = ("gorbilet", "vk", "spb vk", "spring_sale tg", "event-1234", "nothing")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.sqlite3")
+        build_legacy(path, args.rows)
+
+        started = time.perf_counter()
+        db = DatabaseManager(path)
+        print(f"{args.rows} rows, migration with index backfill: {time.perf_counter() - started:.1f} s")
+
+        for terms in TERMS:
+            timings = []
+            found = 0
+            for user_id in range(1, USERS + 1):
+                for page in range(PAGES):
+                    started = time.perf_counter()
+                    # One extra row tells the handler whether there is a next page
+                    rows = db.search_history(user_id, terms, PAGE_SIZE + 1, page * PAGE_SIZE)
+                    timings.append(time.perf_counter() - started)
+                    found += len(rows[:PAGE_SIZE])
+            print(
+                f"  {terms!r:18} median {statistics.median(timings) * 1e3:7.2f} ms/page, "
+                f"max {max(timings) * 1e3:7.2f} ms, {found / (USERS * PAGES):.1f} results/page"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
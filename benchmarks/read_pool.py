@@ -0,0 +1,139 @@
+"""
+Reads through the read-only connection pool versus the previous layout,
+where every read went through the single writer connection under its lock.
+
+Two runs, each with 8 reader threads (get_history + is_user_authorized) and
+one writer thread:
+
+* throughput: the writer adds a history row every 2 ms, the table reports
+  reads per second for pool sizes 1, 2, 4 and 8;
+* latency: every write holds the writer lock for 20 ms (a slow commit or a
+  long maintenance batch), the table reports read p50/p99.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.read_pool
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from src.services.database import DatabaseManager
+
+
+USERS = 200
+READERS = 8
+POOL_SIZES = (1, 2, 4, 8)
+
+
+def fill(path, rows):
+    db = DatabaseManager(path)
+    for user_id in range(USERS):
+        db.authorize_user(user_id, f"user{user_id}")
+    for row in range(rows):
+        base_url = f"https://www.gorbilet.com/actions/event-{row}/"
+        db.add_history(
+            row % USERS,
+            base_url,
+            f"{base_url}?utm_source=vk&utm_medium=post&utm_campaign=spb&utm_content=event-{row}",
+            f"https://clc.li/{row:x}",
+        )
+    db.close()
+
+
+def read_through_writer(db):
+    """The reads of the previous version: the writer connection under its lock"""
+
+    def _fetchall(query, params):
+        with db._lock:
+            return db._connection.execute(query, tuple(params)).fetchall()
+
+    def _exists(query, params):
+        with db._lock:
+            return db._connection.execute(query, tuple(params)).fetchone() is not None
+
+    db._fetchall = _fetchall
+    db._exists = _exists
+
+
+def add_rows(db, stop, hold):
+    written = 0
+    while not stop.is_set():
+        if hold:
+            with db._lock:
+                db._connection.execute(
+                    "INSERT OR REPLACE INTO app_settings (key, value) VALUES ('benchmark', ?)", (str(written),)
+                )
+                time.sleep(hold)
+                db._connection.commit()
+            time.sleep(0.005)
+        else:
+            db.add_history(
+                written % USERS,
+                f"https://example.com/w{written}",
+                f"https://example.com/w{written}?utm_source=vk",
+                f"https://clc.li/w{written}",
+            )
+            time.sleep(0.002)
+        written += 1
+    return written
+
+
+def measure(path, pool_size, seconds, hold, legacy=False):
+    db = DatabaseManager(path, read_pool_size=pool_size)
+    if legacy:
+        read_through_writer(db)
+    stop = threading.Event()
+    latencies = [[] for _ in range(READERS)]
+    writes = []
+
+    def read(index):
+        rng = random.Random(index)
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.is_user_authorized(rng.randrange(2 * USERS))
+            db.get_history(rng.randrange(USERS), 10 if hold else 50)
+            latencies[index].append(time.perf_counter() - started)
+            if hold:
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=read, args=(index,)) for index in range(READERS)]
+    threads.append(threading.Thread(target=lambda: writes.append(add_rows(db, stop, hold))))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    db.close()
+
+    samples = sorted(latency for per_thread in latencies for latency in per_thread)
+    label = "single lock (old)" if legacy else f"pool={pool_size}"
+    percentile = lambda q: samples[int(len(samples) * q)] * 1000
+    print(
+        f"  {label:18} {2 * len(samples) / seconds:8.0f} reads/s  "
+        f"p50={percentile(0.5):6.2f} ms  p99={percentile(0.99):7.2f} ms  {writes[0] / seconds:5.0f} writes/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=30_000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "read_pool.sqlite3")
+        fill(path, args.rows)
+        for title, hold in (("throughput, a write every 2 ms", 0.0), ("latency, writes hold the lock 20 ms", 0.02)):
+            print(f"{title}, {READERS} readers:")
+            measure(path, 1, args.seconds, hold, legacy=True)
+            for pool_size in POOL_SIZES:
+                measure(path, pool_size, args.seconds, hold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Throughput and latency of the embedded redirect server. 2000 links are
+created through SelfHostedShortener, then every code is requested by 32
+concurrent clients twice: first with an empty LRU cache (each lookup goes
+to SQLite) and then with the cache warm. Client and server share one
+process and one event loop, so the client is part of the cost and the
+figures are a lower bound.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.redirects
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from src.services.click_counter import ClickCounter
+from src.services.database import DatabaseManager
+from src.services.redirect_server import build_redirect_app
+from src.services.self_shortener import SelfHostedShortener
+
+
+LINKS = 2000
+CLIENTS = 32
+
+
+async def request_all(base_url, codes):
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+
+        async def client(chunk):
+            for code in chunk:
+                started = time.perf_counter()
+                async with session.get(f"{base_url}/{code}", allow_redirects=False) as response:
+                    assert response.status == 302
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(codes[index::CLIENTS]) for index in range(CLIENTS)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(codes) / elapsed, latencies
+
+
+async def run(db):
+    counter = ClickCounter(db, flush_interval=60)
+    shortener = SelfHostedShortener(db, "http://127.0.0.1", cache_size=10_000)
+    app = build_redirect_app(shortener, counter)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    try:
+        started = time.perf_counter()
+        codes = []
+        for index in range(LINKS):
+            short_url = await shortener.shorten(f"https://www.gorbilet.com/actions/event-{index}/?utm_source=vk")
+            codes.append(short_url.rsplit("/", 1)[1])
+        print(f"shorten: {(time.perf_counter() - started) / LINKS * 1e3:.2f} ms/link")
+
+        shortener.cache._items.clear()
+        for label in ("cold cache (SQLite)", "warm cache (LRU)"):
+            rate, latencies = await request_all(base_url, codes)
+            print(
+                f"{label:20} {rate:6.0f} redirects/s  p50={latencies[len(latencies) // 2] * 1e3:5.2f} ms  "
+                f"p99={latencies[int(len(latencies) * 0.99)] * 1e3:5.2f} ms"
+            )
+        print(f"clicks recorded: {await counter.flush()}")
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(os.path.join(directory, "redirects.sqlite3"))
+        try:
+            asyncio.run(run(db))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Per-user locking of whole updates against locking only the session section.
+Each user taps twice at once; a tap changes the session and then waits 5 ms
+for the network (Telegram and the shortener).
+
+Run from the repository root:
+
+    python -m benchmarks.session_locks
+"""
+import asyncio
+import time
+
+from src.utils.keyed_lock import KeyedLock
+
+
+NETWORK_SECONDS = 0.005
+REPEAT = 15
+
+
+async def whole_update(locks, state, user_id):
+    async with locks.hold(user_id):
+        state[user_id] = state.get(user_id, 0) + 1
+        await asyncio.sleep(NETWORK_SECONDS)
+
+
+async def session_section(locks, state, user_id):
+    async with locks.hold(user_id):
+        state[user_id] = state.get(user_id, 0) + 1
+    await asyncio.sleep(NETWORK_SECONDS)
+
+
+async def burst(tap, users):
+    """Best of REPEAT bursts, seconds"""
+    locks, state = KeyedLock(), {}
+    best = float("inf")
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        await asyncio.gather(*(tap(locks, state, user_id) for user_id in range(users) for _ in range(2)))
+        best = min(best, time.perf_counter() - started)
+    assert len(locks) == 0
+    return best
+
+
+async def run() -> None:
+    for users in (100, 1000, 4000):
+        whole = await burst(whole_update, users)
+        section = await burst(session_section, users)
+        print(f"{users:>5} users x 2 taps: whole update {whole * 1e3:6.1f} ms, session section {section * 1e3:6.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,159 @@
+"""
+Graceful shutdown under load. The real src.bot.main() runs in a child
+process against a local stub of the Bot API: one getUpdates answer brings
+a message from every authorized user, and each reply (sendMessage) takes
+--latency seconds. SIGTERM is sent once all replies are in flight. The
+harness reports how long the process took to exit, how many replies were
+delivered, what main() logged about the shutdown, whether the -wal file
+was left behind, and how long a restart takes to poll again.
+
+Run from the repository root with the bot's environment (.env); the
+database and archive go to a temporary directory:
+
+    python -m benchmarks.shutdown --users 20 --latency 2 --timeout 10
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+
+LOG_MARKERS = ("Shutting down", "Shutdown finished", "startup took", "Traceback", "Error")
+
+
+def stub_api(users, latency, state):
+    async def get_me(request):
+        return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}})
+
+    async def get_updates(request):
+        if state["first_poll"] is None:
+            state["first_poll"] = time.monotonic()
+        if state["delivered"]:
+            await asyncio.sleep(1)
+            return web.json_response({"ok": True, "result": []})
+        state["delivered"] = True
+        updates = [
+            {
+                "update_id": user_id,
+                "message": {
+                    "message_id": user_id,
+                    "date": 0,
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+                    "text": "Посмотреть историю",
+                },
+            }
+            for user_id in range(1, users + 1)
+        ]
+        return web.json_response({"ok": True, "result": updates})
+
+    async def send_message(request):
+        data = await request.post()
+        state["started"] += 1
+        await asyncio.sleep(latency)
+        state["done"] += 1
+        chat = {"id": int(data["chat_id"]), "type": "private"}
+        return web.json_response({"ok": True, "result": {"message_id": 1, "date": 0, "chat": chat, "text": "x"}})
+
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/getMe", get_me)
+    app.router.add_route("*", "/bot{token}/getUpdates", get_updates)
+    app.router.add_route("*", "/bot{token}/sendMessage", send_message)
+    return app
+
+
+async def spawn(args, api_url, env):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.shutdown", "--bot", api_url, "--users", str(args.users),
+        env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+
+
+async def drive(args, directory):
+    state = {"delivered": False, "started": 0, "done": 0, "first_poll": None}
+    runner = web.AppRunner(stub_api(args.users, args.latency, state))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    api_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    database_path = os.path.join(directory, "state.sqlite3")
+    env = dict(
+        os.environ,
+        DATABASE_PATH=database_path,
+        HISTORY_ARCHIVE_DIR=os.path.join(directory, "archive"),
+        SHUTDOWN_TIMEOUT_SECONDS=str(args.timeout),
+    )
+
+    try:
+        process = await spawn(args, api_url, env)
+        while state["started"] < args.users:
+            await asyncio.sleep(0.01)
+        started = time.monotonic()
+        process.send_signal(signal.SIGTERM)
+        output = (await process.communicate())[0].decode()
+        print(
+            f"users={args.users} reply latency={args.latency} s timeout={args.timeout} s: "
+            f"exit after {time.monotonic() - started:.2f} s (code {process.returncode}), "
+            f"replies delivered {state['done']}/{args.users}"
+        )
+        for line in output.splitlines():
+            if any(marker in line for marker in LOG_MARKERS):
+                print(f"    {line[-150:]}")
+        print(f"    -wal left after exit: {os.path.exists(database_path + '-wal')}")
+
+        state["first_poll"] = None
+        started = time.monotonic()
+        process = await spawn(args, api_url, env)
+        while state["first_poll"] is None:
+            await asyncio.sleep(0.01)
+        print(f"    restart: first getUpdates {time.monotonic() - started:.2f} s after spawn")
+        process.send_signal(signal.SIGTERM)
+        await process.communicate()
+    finally:
+        await runner.cleanup()
+
+
+def run_bot(api_url, users):
+    """Child process: the real main() with its Bot pointed at the stub API"""
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import src.bot as bot_module
+    from src.config import settings
+    from src.services.database import DatabaseManager
+
+    db = DatabaseManager(settings.database_path)
+    for user_id in range(1, users + 1):
+        if not db.is_user_authorized(user_id):
+            db.authorize_user(user_id, f"user{user_id}")
+    db.close()
+
+    bot_class = bot_module.Bot
+    bot_module.Bot = lambda token: bot_class(
+        token, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    )
+    asyncio.run(bot_module.main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--bot", metavar="API_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bot:
+        run_bot(args.bot, args.users)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(drive(args, directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+How many provider calls request coalescing saves. Arrivals are spread over
+one provider latency; half the URLs list their UTM parameters in another
+order, which canonical_url folds into the same key.
+
+Run from the repository root with the bot's environment (BOT_TOKEN and the
+rest of .env), since the shortener module reads the settings:
+
+    python -m benchmarks.single_flight
+"""
+import asyncio
+import random
+import time
+
+from src.services.shorteners import HedgedShortener, ShortenerProvider
+
+
+class StubProvider(ShortenerProvider):
+    name = "stub"
+
+    def __init__(self, latency: float, fail: bool = False) -> None:
+        super().__init__()
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    async def shorten(self, long_url: str) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError("provider down")
+        return f"https://s.example/{self.calls}"
+
+
+async def stress(rng, requests, distinct, latency):
+    provider = StubProvider(latency)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=1.0)
+
+    async def one(index):
+        link = rng.randrange(distinct)
+        if index % 2:
+            url = f"https://Ex.com/a/{link}?utm_source=vk&utm_medium=post"
+        else:
+            url = f"https://ex.com/a/{link}?utm_medium=post&utm_source=vk"
+        await asyncio.sleep(rng.random() * latency)
+        return await shortener.shorten(url)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    saved = requests - provider.calls
+    print(
+        f"{requests} requests over {distinct} links, provider {latency * 1e3:.0f} ms: "
+        f"{provider.calls} provider calls, {saved} saved ({saved / requests:.0%}) in {elapsed:.2f} s; "
+        f"all answered: {all(results)}, keys left: {len(shortener.single_flight)}"
+    )
+
+
+async def failures():
+    provider = StubProvider(0.05, fail=True)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=1.0)
+    url = "https://ex.com/x?utm_source=a"
+    results = await asyncio.gather(*(shortener.shorten(url) for _ in range(20)))
+    print(f"failing call: {provider.calls} provider call, {results.count(None)} of 20 waiters got no link")
+    provider.fail = False
+    print(f"next attempt: {await shortener.shorten(url)}, {provider.calls} provider calls in total")
+
+
+async def cancellations():
+    provider = StubProvider(0.2)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=1.0)
+    first = asyncio.ensure_future(shortener.shorten("https://ex.com/c"))
+    second = asyncio.ensure_future(shortener.shorten("https://ex.com/c"))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    print(f"one of two waiters cancelled: the other got {await second}, {provider.cancelled} provider cancellations")
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(shortener.shorten("https://ex.com/d"), shortener.shorten("https://ex.com/d")), 0.05
+        )
+    except asyncio.TimeoutError:
+        pass
+    await asyncio.sleep(0)
+    print(
+        f"every waiter cancelled: {provider.cancelled} provider cancellation, "
+        f"{len(shortener.single_flight)} keys left"
+    )
+
+
+async def run() -> None:
+    rng = random.Random(1)
+    await stress(rng, 1000, 50, 0.3)
+    await stress(rng, 1000, 1000, 0.3)
+    await stress(rng, 200, 5, 0.5)
+    await failures()
+    await cancellations()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
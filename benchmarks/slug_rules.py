@@ -0,0 +1,79 @@
+"""
+Timings for slug extraction: the old single-regex function against the
+per-host rule table, without a cache and with a warm LRU cache.
+
+Run from the repository root:
+
+    python -m benchmarks.slug_rules
+"""
+import random
+import re
+import time
+from urllib.parse import urlparse
+
+from src.utils.slug_rules import SLUG_CACHE_SIZE, SlugRules
+
+
+BATCH = 100_000
+HOSTS = ["gorbilet.com", "www.gorbilet.com", "spb.gorbilet.com", "teatr.example.ru", "kids.example.org", "other.net"]
+TABLE = {
+    "example.ru": [{"path": r"/shows/(?P<slug>[^/]+)"}],
+    "example.org": [{"query": "event"}, {"segment": 0}],
+    "*": [{"path": r"/actions/([^/]+)"}, {"segment": -1}],
+}
+_ACTION_PATTERN = re.compile(r"/actions/([^/]+)")
+
+
+def old_extract_action_slug(url):
+    parsed = urlparse(url)
+    match = _ACTION_PATTERN.search(parsed.path)
+    if match:
+        return match.group(1)
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    return segments[-1] if segments else "event"
+
+
+def url_batch(distinct_events, seed=1):
+    """BATCH URLs over 6 hosts and 4 URL shapes"""
+    rng = random.Random(seed)
+    shapes = [
+        "https://{host}/actions/event-{event}/",
+        "https://{host}/shows/event-{event}/tickets?x=1",
+        "https://{host}/page?event=ev{event}&utm_source=x",
+        "https://{host}/",
+    ]
+    return [
+        rng.choice(shapes).format(host=rng.choice(HOSTS), event=rng.randrange(distinct_events))
+        for _ in range(BATCH)
+    ]
+
+
+def timed(extract, urls, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for url in urls:
+            extract(url)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report(label, seconds):
+    print(f"{label:<48} {seconds * 1e3:5.0f} ms ({seconds / BATCH * 1e6:.2f} us/url)")
+
+
+def main() -> None:
+    urls = url_batch(5_000)
+    unique = len(set(urls))
+    report("old extract_action_slug", timed(old_extract_action_slug, urls))
+    report("rules, no cache", timed(SlugRules(TABLE, cache_size=0).extract, urls))
+    report(f"rules, warm cache ({unique} unique URLs)", timed(SlugRules(TABLE).extract, urls))
+
+    urls = url_batch(20_000)
+    unique = len(set(urls))
+    report(f"rules, {SLUG_CACHE_SIZE} cache, {unique} unique URLs", timed(SlugRules(TABLE).extract, urls))
+    report(f"rules, 131072 cache, {unique} unique URLs", timed(SlugRules(TABLE, cache_size=131072).extract, urls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Database startup cost. On an up-to-date database the migration runner reads
+PRAGMA user_version and stops. The schema setup it replaced ran its checks
+on every start: CREATE TABLE IF NOT EXISTS for every table, PRAGMA
+table_info probes for added columns, and lookups for the search index, the
+auto_vacuum mode and the default password. Both are timed on the same
+synthetic history (benchmarks.history_layout, 1M rows by default), after
+the one-time upgrade from the legacy layout.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.startup --rows 1000000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.history_layout import build_legacy
+from src.services.database import DatabaseManager
+from src.services.migrations import run_migrations
+
+
+CALLS = 2000
+PREVIOUS_CHECKS = (
+    "PRAGMA auto_vacuum",
+    "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, authorized_at TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS banned_users (user_id INTEGER PRIMARY KEY, banned_at TEXT NOT NULL, reason TEXT)",
+    "CREATE TABLE IF NOT EXISTS auth_attempts (user_id INTEGER PRIMARY KEY, attempts INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS app_settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, url TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_urls_hash ON urls(hash)",
+    "CREATE TABLE IF NOT EXISTS utm_values (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)",
+    "COMMIT",
+    "PRAGMA table_info(users)",
+    "PRAGMA table_info(banned_users)",
+    "PRAGMA table_info(history)",
+    "PRAGMA table_info(history)",
+    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_search'",
+    "SELECT value FROM app_settings WHERE key = 'bot_password'",
+)
+
+
+def previous_setup(connection):
+    """The statements the removed schema setup ran on an up-to-date database"""
+    for statement in PREVIOUS_CHECKS:
+        if statement == "COMMIT":
+            connection.commit()
+        else:
+            connection.execute(statement).fetchall()
+
+
+def per_call_ms(function, calls=CALLS):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.sqlite3")
+        build_legacy(path, args.rows)
+        started = time.perf_counter()
+        DatabaseManager(path).close()
+        print(f"first upgrade of {args.rows} legacy rows: {time.perf_counter() - started:.1f} s")
+
+        connection = sqlite3.connect(path)
+        print(f"schema checks of the previous setup: {per_call_ms(lambda: previous_setup(connection)):.3f} ms")
+        print(f"migration runner, nothing to apply:  {per_call_ms(lambda: run_migrations(None, connection)):.3f} ms")
+        connection.close()
+        open_close = per_call_ms(lambda: DatabaseManager(path).close(), calls=200)
+        print(f"DatabaseManager open + close:        {open_close:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Storage work per update on the SQLite and in-memory engines. One update is
+what a link generation costs the storage: the access middleware's ban and
+authorization checks, add_history and the history page read back. 3000
+updates run over 200 users, then /find is timed on the resulting history.
+
+Run from the repository root with the bot's environment (.env):
+
+    python -m benchmarks.storage_engines
+"""
+import os
+import statistics
+import tempfile
+import time
+
+from src.services.database import DatabaseManager
+from src.services.storage import InMemoryStorage
+
+
+USERS = 200
+UPDATES = 3000
+SEARCHES = 200
+
+
+def handle_update(storage, index):
+    user_id = index % USERS
+    storage.is_user_banned(user_id)
+    storage.is_user_authorized(user_id)
+    base_url = f"https://www.gorbilet.com/actions/event-{index}/"
+    storage.add_history(
+        user_id,
+        base_url,
+        f"{base_url}?utm_source=vk&utm_medium=post&utm_campaign=spb&utm_content=event-{index}",
+        f"https://clc.li/{index:x}",
+    )
+    storage.get_history(user_id, 20)
+
+
+def measure(label, storage):
+    for user_id in range(USERS):
+        storage.authorize_user(user_id, f"user{user_id}")
+    latencies = []
+    for index in range(UPDATES):
+        started = time.perf_counter()
+        handle_update(storage, index)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    started = time.perf_counter()
+    for index in range(SEARCHES):
+        storage.search_history(index % USERS, "event-1", 11, 0)
+    search = (time.perf_counter() - started) / SEARCHES
+    print(
+        f"{label:7} per update p50={latencies[UPDATES // 2] * 1e6:5.0f} us  "
+        f"p99={latencies[int(UPDATES * 0.99)] * 1e6:5.0f} us  mean={statistics.mean(latencies) * 1e6:5.0f} us;  "
+        f"/find page {search * 1e3:.2f} ms"
+    )
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(os.path.join(directory, "storage.sqlite3"))
+        try:
+            measure("sqlite", db)
+        finally:
+            db.close()
+    measure("memory", InMemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Timings of the UTM builder before and after the single-parse rewrite. The
+previous build_utm_url, build_utm_url_advanced, extract_utm_params and
+remove_utm_params are copied below unchanged from the version that
+preceded it; the new side is the parse_url/build_from_parsed path the
+public functions now go through. The previous build_utm_url is plain
+string concatenation and stays faster; the two links printed at the end
+show what it produced for a base URL with a fragment and a UTM tag.
+
+Run from the repository root:
+
+    python -m benchmarks.utm_builder
+"""
+import timeit
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+from src.services import utm_builder as current
+
+
+BASE_URL = "https://www.gorbilet.com/actions/hamlet/?city=spb&utm_source=old#tickets"
+UTM_PARAMS = {
+    "utm_source": "vk",
+    "utm_medium": "post",
+    "utm_campaign": "spring sale",
+    "utm_content": "hamlet",
+}
+BATCH = [dict(UTM_PARAMS, utm_content=f"hamlet-{index}") for index in range(100)]
+
+
+# --- Previous implementation -------------------------------------------------
+
+def build_utm_url(base_url: str, utm_source: str, utm_medium: str, utm_campaign: str, utm_content: str = None) -> str:
+    """
+    Формирует ссылку с добавленными UTM-параметрами.
+    Если в базовой ссылке уже есть параметры, добавляет новые через '&'.
+    """
+    separator = '&' if '?' in base_url else '?'
+    # Избежать двойного разделителя, если ссылка уже заканчивается на '?' или '&'
+    if base_url.endswith('?') or base_url.endswith('&'):
+        separator = ''
+
+    # Формируем базовые UTM-параметры
+    utm_params = f"utm_source={utm_source}&utm_medium={utm_medium}&utm_campaign={utm_campaign}"
+
+    # Добавляем utm_content, если он передан
+    if utm_content:
+        utm_params += f"&utm_content={utm_content}"
+
+    return f"{base_url}{separator}{utm_params}"
+
+
+def build_utm_url_advanced(base_url: str, utm_params: dict) -> str:
+    """
+    Расширенная версия для формирования ссылки с UTM-параметрами.
+    Принимает словарь с UTM-параметрами.
+    """
+    parsed = urlparse(base_url)
+    query_params = dict(parse_qsl(parsed.query))
+
+    # Добавляем или обновляем UTM-параметры
+    for key, value in utm_params.items():
+        if value:  # Добавляем только если значение не пустое
+            query_params[key] = value
+
+    new_query = urlencode(query_params, doseq=True)
+
+    return urlunparse((
+        parsed.scheme,
+        parsed.netloc,
+        parsed.path,
+        parsed.params,
+        new_query,
+        parsed.fragment
+    ))
+
+
+def extract_utm_params(url: str) -> dict:
+    """
+    Извлекает UTM-параметры из ссылки.
+    """
+    parsed = urlparse(url)
+    query_params = dict(parse_qsl(parsed.query))
+
+    utm_params = {}
+    for key in ['utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term']:
+        if key in query_params:
+            utm_params[key] = query_params[key]
+
+    return utm_params
+
+
+def remove_utm_params(url: str) -> str:
+    """
+    Удаляет все UTM-параметры из ссылки.
+    """
+    parsed = urlparse(url)
+    query_params = dict(parse_qsl(parsed.query))
+
+    # Удаляем UTM-параметры
+    utm_keys = ['utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term']
+    for key in utm_keys:
+        query_params.pop(key, None)
+
+    new_query = urlencode(query_params, doseq=True)
+
+    return urlunparse((
+        parsed.scheme,
+        parsed.netloc,
+        parsed.path,
+        parsed.params,
+        new_query,
+        parsed.fragment
+    ))
+
+
+# --- Measurements ------------------------------------------------------------
+
+def _best(statement, number):
+    """Best of five runs, seconds per call"""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number
+
+
+def _retag_previous(url):
+    # Read the UTM tags of a link and rebuild it with new ones: three parses
+    tags = extract_utm_params(url)
+    return build_utm_url_advanced(remove_utm_params(url), dict(tags, utm_medium="stories"))
+
+
+def _retag_current(url):
+    parsed = current.parse_url(url)
+    return current.build_from_parsed(parsed, dict(parsed.utm, utm_medium="stories"))
+
+
+def main() -> None:
+    values = list(UTM_PARAMS.values())
+    tagged = current.build_utm_url(BASE_URL, *values)
+    cases = [
+        (
+            "build_utm_url",
+            1e6, "us", 100_000,
+            lambda: build_utm_url(BASE_URL, *values),
+            lambda: current.build_from_parsed(current.parse_url(BASE_URL), UTM_PARAMS),
+        ),
+        (
+            "build_utm_url_advanced",
+            1e6, "us", 100_000,
+            lambda: build_utm_url_advanced(BASE_URL, UTM_PARAMS),
+            lambda: current.build_utm_url_advanced(BASE_URL, UTM_PARAMS),
+        ),
+        (
+            "100 links from one base URL",
+            1e3, "ms", 1_000,
+            lambda: [build_utm_url_advanced(BASE_URL, params) for params in BATCH],
+            lambda: current.build_utm_urls(BASE_URL, BATCH),
+        ),
+        (
+            "extract_utm_params",
+            1e6, "us", 100_000,
+            lambda: extract_utm_params(tagged),
+            lambda: dict(current.parse_url(tagged).utm),
+        ),
+        (
+            "remove_utm_params",
+            1e6, "us", 100_000,
+            lambda: remove_utm_params(tagged),
+            lambda: current.build_from_parsed(current.parse_url(tagged), {}),
+        ),
+        (
+            "re-tag (extract + remove + build)",
+            1e6, "us", 100_000,
+            lambda: _retag_previous(tagged),
+            lambda: _retag_current(tagged),
+        ),
+    ]
+
+    print(f"{'':34} {'previous':>10} {'current':>10}")
+    for label, scale, unit, number, previous, new in cases:
+        before = _best(previous, number) * scale
+        after = _best(new, number) * scale
+        print(f"{label:34} {before:7.2f} {unit} {after:7.2f} {unit}   x{before / after:.1f}")
+
+    print()
+    print("previous build_utm_url:", build_utm_url(BASE_URL, *values))
+    print("current build_utm_url: ", tagged)
+
+
+if __name__ == "__main__":
+    main()
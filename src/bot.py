@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 
 from aiogram import Bot, Dispatcher
 
@@ -7,22 +8,149 @@ from src.config import settings
 from src.core.logging_config import setup_logging
 from src.handlers import register_handlers
 from src.middlewares.access_control import AccessControlMiddleware
+from src.middlewares.deadline import DeadlineMiddleware
+from src.middlewares.in_flight import InFlightTracker
+from src.middlewares.profiling import SlowUpdateProfilerMiddleware
+from src.services.container import Services, build_services
+from src.services.database import build_storage
+from src.services.health import loop_lag_monitor, poll_tracker, start_health_server
+from src.services.profiler import update_profiler
+from src.services.redirect_server import start_redirect_server
+from src.services.utm_manager import utm_manager
+from src.utils.deadline import deadline_stats
+from src.utils.slug_rules import slug_rules
+
+
+def _apply_runtime_settings(services: Services) -> None:
+    # Параметры из меню «Параметры работы» применяются к сервисам сразу при изменении
+    runtime_settings = services.runtime_settings
+    broadcaster, shortener, retry_queue = services.broadcaster, services.shortener, services.shorten_retry_queue
+    runtime_settings.subscribe("broadcast_rate_per_second", broadcaster.pacer.set_rate)
+    runtime_settings.subscribe(
+        "broadcast_max_in_flight", lambda value: setattr(broadcaster, "max_in_flight", value)
+    )
+    runtime_settings.subscribe(
+        "shortener_hedging_enabled", lambda value: setattr(shortener, "hedging_enabled", value)
+    )
+    runtime_settings.subscribe(
+        "shortener_hedge_delay_seconds", lambda value: setattr(shortener, "initial_hedge_delay", value)
+    )
+    runtime_settings.subscribe(
+        "shorten_retry_max_attempts", lambda value: setattr(retry_queue, "max_attempts", value)
+    )
+    runtime_settings.subscribe(
+        "profiler_threshold_ms", lambda value: setattr(update_profiler, "threshold_seconds", value / 1000)
+    )
+    runtime_settings.subscribe(
+        "profiler_sample_rate", lambda value: setattr(update_profiler, "sample_rate", value)
+    )
 
 
 async def main() -> None:
+    started = time.monotonic()
     setup_logging()
     logger = logging.getLogger(__name__)
     logger.info("Starting bot...")
 
+    services = build_services(build_storage(settings.storage_backend))
+
     bot = Bot(token=settings.bot_token)
+    bot.session.middleware(poll_tracker)
     dp = Dispatcher()
-    access_middleware = AccessControlMiddleware()
+    # Обработчики получают сервисы именованными аргументами: storage, broadcaster, …
+    dp.workflow_data.update(services._asdict())
+    in_flight = InFlightTracker()
+    dp.update.outer_middleware.register(in_flight)
+    access_middleware = AccessControlMiddleware(services.storage)
     dp.message.middleware.register(access_middleware)
     dp.callback_query.middleware.register(access_middleware)
+    if settings.profiler_enabled:
+        profiler_middleware = SlowUpdateProfilerMiddleware(update_profiler)
+        dp.message.middleware.register(profiler_middleware)
+        dp.callback_query.middleware.register(profiler_middleware)
+    deadline_middleware = DeadlineMiddleware(settings.update_deadline_seconds, deadline_stats)
+    dp.message.middleware.register(deadline_middleware)
+    dp.callback_query.middleware.register(deadline_middleware)
     register_handlers(dp)
+    _apply_runtime_settings(services)
+
+    maintenance_task = asyncio.create_task(services.history_maintenance.run_forever())
+    catalog_watch_task = asyncio.create_task(
+        utm_manager.watch(settings.catalog_reload_interval_seconds)
+    )
+    slug_rules.load(settings.slug_rules_path)
+    slug_rules_watch_task = asyncio.create_task(
+        slug_rules.watch(settings.catalog_reload_interval_seconds)
+    )
+    retry_queue_task = asyncio.create_task(services.shorten_retry_queue.run_forever(bot))
+    await services.broadcaster.resume(bot)
+    loop_lag_task = asyncio.create_task(loop_lag_monitor.run_forever())
+    health_runner = None
+    if settings.health_server_enabled:
+        health_runner = await start_health_server(
+            services.health_service, settings.health_host, settings.health_port
+        )
+    redirect_runner = None
+    click_flush_task = None
+    if settings.redirect_server_enabled:
+        redirect_runner = await start_redirect_server(
+            services.self_shortener, services.click_counter, settings.redirect_host, settings.redirect_port
+        )
+        click_flush_task = asyncio.create_task(services.click_counter.run_forever())
+
+    logger.info("Bot is polling (startup took %.2fs)...", time.monotonic() - started)
+    try:
+        # Сессию бота закрываем сами: обработчики, которые ещё работают, должны успеть ответить
+        await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        # start_polling возвращается по SIGTERM/SIGINT, новые апдейты уже не запрашиваются
+        stopping = time.monotonic()
+        logger.info(
+            "Shutting down, waiting up to %.0fs for %s in-flight updates",
+            settings.shutdown_timeout_seconds,
+            len(in_flight),
+        )
+        in_flight.close()
+        services.health_service.shutting_down = True
+        background_tasks = [maintenance_task, catalog_watch_task, slug_rules_watch_task, retry_queue_task]
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await services.broadcaster.shutdown()
+        if redirect_runner is not None:
+            await redirect_runner.cleanup()
+
+        abandoned = await in_flight.drain(settings.shutdown_timeout_seconds)
+        for description in abandoned:
+            logger.warning("Abandoned at shutdown: %s", description)
+
+        if click_flush_task is not None:
+            click_flush_task.cancel()
+            try:
+                await services.click_counter.flush()
+            except Exception:
+                logger.exception("Final click counter flush failed")
+        try:
+            queue_stats = await services.shorten_retry_queue.stats()
+            if queue_stats["depth"]:
+                logger.warning(
+                    "%s shorten jobs left in the retry queue, they will run after restart",
+                    queue_stats["depth"],
+                )
+        except Exception:
+            logger.exception("Could not read retry queue state at shutdown")
 
-    logger.info("Bot is polling...")
-    await dp.start_polling(bot)
+        loop_lag_task.cancel()
+        if health_runner is not None:
+            await health_runner.cleanup()
+        await services.shortener.close()
+        await bot.session.close()
+        services.storage.close()
+        logger.info(
+            "Shutdown finished in %.2fs, abandoned updates: %s",
+            time.monotonic() - stopping,
+            len(abandoned),
+        )
 
 
 if __name__ == "__main__":
@@ -1,16 +1,76 @@
-from pydantic import Field
+from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+# Резервы генерации на запись в базу и ответ (2.5 с) плюс хотя бы секунда сокращателю
+MIN_GENERATION_DEADLINE_SECONDS = 3.5
+
 
 class Settings(BaseSettings):
     bot_token: str
     clc_api_key: str
     bot_access_password: str = Field(alias="BOT_ACCESS_PASSWORD")
     database_path: str = Field(default="data/bot_state.sqlite3")
+    database_read_pool_size: int = Field(default=4)
+    storage_backend: str = Field(default="sqlite")
+    # Перенос старой истории в архив (HISTORY_ARCHIVE_DIR) с удалением из базы.
+    # 0 — выключен; включается явно, например HISTORY_RETENTION_DAYS=180
+    history_retention_days: int = Field(default=0)
+    history_archive_dir: str = Field(default="data/archive")
+    maintenance_interval_seconds: int = Field(default=3600)
+    utm_data_path: str = Field(default="data/utm_data.json")
+    catalog_reload_interval_seconds: float = Field(default=2.0)
+    slug_rules_path: str = Field(default="data/slug_rules.json")
+    clc_api_endpoint: str = Field(default="https://clc.li/api/url/add")
+    shortener_primary: str = Field(default="clc")
+    shortener_backup: str = Field(default="")
+    shortener_hedging_enabled: bool = Field(default=True)
+    shortener_hedge_delay_seconds: float = Field(default=1.5)
+    yourls_api_url: str = Field(default="")
+    yourls_signature: str = Field(default="")
+    short_link_base_url: str = Field(default="http://localhost:8080")
+    short_link_cache_size: int = Field(default=10000)
+    redirect_server_enabled: bool = Field(default=False)
+    redirect_host: str = Field(default="0.0.0.0")
+    redirect_port: int = Field(default=8080)
+    click_flush_interval_seconds: float = Field(default=5.0)
+    shorten_retry_base_delay_seconds: float = Field(default=30.0)
+    shorten_retry_max_delay_seconds: float = Field(default=1800.0)
+    shorten_retry_max_attempts: int = Field(default=10)
+    shorten_retry_poll_seconds: float = Field(default=5.0)
+    profiler_enabled: bool = Field(default=False)
+    profiler_threshold_ms: float = Field(default=1000.0)
+    profiler_sample_rate: float = Field(default=0.1)
+    profiler_max_reports: int = Field(default=50)
+    profiler_dump_path: str = Field(default="")
+    health_server_enabled: bool = Field(default=False)
+    health_host: str = Field(default="0.0.0.0")
+    health_port: int = Field(default=8081)
+    loop_lag_interval_seconds: float = Field(default=0.5)
+    readiness_poll_max_age_seconds: float = Field(default=60.0)
+    readiness_db_timeout_seconds: float = Field(default=2.0)
+    broadcast_rate_per_second: float = Field(default=25.0)
+    broadcast_batch_size: int = Field(default=50)
+    broadcast_max_in_flight: int = Field(default=10)
+    shutdown_timeout_seconds: float = Field(default=10.0)
+    update_deadline_seconds: float = Field(default=0.0)
+    generation_deadline_seconds: float = Field(default=10.0)
+    matrix_concurrency: int = Field(default=4)
+    matrix_max_combinations: int = Field(default=300)
+    matrix_cache_size: int = Field(default=4096)
+
+    @field_validator("generation_deadline_seconds")
+    @classmethod
+    def check_generation_deadline(cls, value: float) -> float:
+        # Ноль выключает бюджет; меньший бюджет целиком уходит на резервы и сокращатель получает 0 с
+        if value != 0 and value < MIN_GENERATION_DEADLINE_SECONDS:
+            raise ValueError(
+                f"generation_deadline_seconds must be 0 (no deadline) or at least {MIN_GENERATION_DEADLINE_SECONDS}"
+            )
+        return value
 
     class Config:
         env_file = ".env"
@@ -1,11 +1,17 @@
 from aiogram import Dispatcher
 
+from .catalog import router as catalog_router
 from .commands import router as commands_router
+from .matrix import router as matrix_router
+from .search import router as search_router
 from .utm_generation import router as utm_generation_router
 from .utm_management import router as utm_management_router
 
 
 def register_handlers(dp: Dispatcher) -> None:
     dp.include_router(commands_router)
+    dp.include_router(catalog_router)
+    dp.include_router(search_router)
     dp.include_router(utm_management_router)
+    dp.include_router(matrix_router)
     dp.include_router(utm_generation_router)
@@ -0,0 +1,133 @@
+from typing import Optional
+
+from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+
+from src.keyboards.utm_keyboards import CATALOG_KINDS, build_catalog_keyboard
+from src.services.utm_manager import CATEGORY_MAP, CatalogEntry, utm_manager
+from src.state.user_state import catalog_filters
+
+
+router = Router()
+
+# Какие категории допустимы для каждого вида клавиатуры
+KIND_CATEGORY_PREFIXES = {
+    "src": ("source",),
+    "med": ("medium_",),
+    "camp": ("campaign_",),
+    "del": ("",),
+}
+CANCEL_WORDS = {"отмена", "cancel", "выход", "stop"}
+
+
+def _active_query(user_id: int, kind: str, category_key: str) -> Optional[str]:
+    state = catalog_filters.get(user_id)
+    if state and state.get("kind") == kind and state.get("category") == category_key:
+        return state.get("query")
+    return None
+
+
+def catalog_keyboard(user_id: int, kind: str, category_key: str, page: int = 0) -> types.InlineKeyboardMarkup:
+    query = _active_query(user_id, kind, category_key)
+    return build_catalog_keyboard(kind, category_key, utm_manager.get_page(category_key, page, query))
+
+
+def resolve_entry(callback_data: str, kind: str) -> Optional[CatalogEntry]:
+    """Находит метку по id из callback_data; None — клавиатура устарела или id чужой категории"""
+    entry_id = callback_data.split(":", 1)[1]
+    if not entry_id.isdigit():
+        return None
+    entry = utm_manager.index.get(int(entry_id))
+    if entry is None or not entry.category.startswith(KIND_CATEGORY_PREFIXES[kind]):
+        return None
+    return entry
+
+
+def _parse_target(data: str) -> Optional[tuple[str, str]]:
+    parts = data.split(":")
+    if len(parts) < 3 or parts[1] not in CATALOG_KINDS or parts[2] not in CATEGORY_MAP:
+        return None
+    return parts[1], parts[2]
+
+
+@router.callback_query(F.data == "cat:noop")
+async def ignore_page_counter(callback: types.CallbackQuery) -> None:
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("cat:"))
+async def paginate_catalog(callback: types.CallbackQuery) -> None:
+    target = _parse_target(callback.data)
+    page_text = callback.data.rsplit(":", 1)[1]
+    if target is None or not page_text.isdigit():
+        await callback.answer("Клавиатура устарела.", show_alert=True)
+        return
+
+    kind, category_key = target
+    await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(
+            reply_markup=catalog_keyboard(callback.from_user.id, kind, category_key, int(page_text))
+        )
+    except TelegramBadRequest:
+        pass
+
+
+@router.callback_query(F.data.startswith("catf:"))
+async def start_catalog_filter(callback: types.CallbackQuery) -> None:
+    target = _parse_target(callback.data)
+    if target is None:
+        await callback.answer("Клавиатура устарела.", show_alert=True)
+        return
+
+    kind, category_key = target
+    catalog_filters[callback.from_user.id] = {"kind": kind, "category": category_key, "query": None, "awaiting": "1"}
+    await callback.answer()
+    await callback.message.answer("🔍 Введите часть названия или значения метки. Чтобы отменить, напишите «Отмена».")
+
+
+@router.callback_query(F.data.startswith("catf_clear:"))
+async def clear_catalog_filter(callback: types.CallbackQuery) -> None:
+    target = _parse_target(callback.data)
+    if target is None:
+        await callback.answer("Клавиатура устарела.", show_alert=True)
+        return
+
+    kind, category_key = target
+    catalog_filters.pop(callback.from_user.id, None)
+    await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(
+            reply_markup=catalog_keyboard(callback.from_user.id, kind, category_key)
+        )
+    except TelegramBadRequest:
+        pass
+
+
+@router.message(lambda msg: catalog_filters.get(msg.from_user.id, {}).get("awaiting"))
+async def handle_catalog_filter(message: types.Message) -> None:
+    user_id = message.from_user.id
+    state = catalog_filters[user_id]
+    query = (message.text or "").strip()
+
+    if not query or query.lower() in CANCEL_WORDS:
+        catalog_filters.pop(user_id, None)
+        await message.answer("Поиск по меткам отменён.")
+        return
+
+    state.update({"query": query, "awaiting": None})
+    kind, category_key = state["kind"], state["category"]
+    page = utm_manager.get_page(category_key, 0, query)
+    if not page.total:
+        # Ждём новый запрос до ответа, а не после: «Отмена», пришедшая, пока бот
+        # отвечает, не должна быть перезаписана
+        state["awaiting"] = "1"
+        await message.answer(
+            f"По запросу «{query}» меток не найдено. Попробуйте ещё раз:",
+        )
+        return
+
+    await message.answer(
+        f"🔍 Найдено меток по запросу «{query}»: {page.total}",
+        reply_markup=build_catalog_keyboard(kind, category_key, page),
+    )
@@ -1,3 +1,8 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
@@ -6,17 +11,36 @@ from aiogram.filters import Command
 from aiogram.exceptions import TelegramBadRequest
 
 from src.keyboards.main_menu import build_main_menu_keyboard
-from src.keyboards.settings import build_settings_keyboard
-from src.services.database import database
+from src.keyboards.settings import (
+    build_broadcast_confirm_keyboard,
+    build_broadcast_stop_keyboard,
+    build_settings_keyboard,
+    build_tunables_keyboard,
+    build_users_page_keyboard,
+)
+from src.services.app_settings import TUNABLES_BY_KEY, RuntimeSettings, format_value, parse_value
+from src.services.broadcast import Broadcaster
+from src.services.click_counter import ClickCounter
+from src.services.history_archive import history_archive
+from src.services.maintenance import HistoryMaintenance
+from src.services.profiler import update_profiler
+from src.services.retry_queue import ShortenRetryQueue
+from src.services.self_shortener import SelfHostedShortener
+from src.services.storage import USER_LISTS, Storage
+from src.services.utm_builder import extract_utm_params
 from src.state.user_state import (
+    broadcast_drafts,
+    pending_broadcast_users,
     pending_password_change_users,
     pending_password_users,
+    pending_setting_edits,
     pending_user_deletion,
 )
 
 
 router = Router()
 MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+USERS_PAGE_SIZE = 20
 
 
 def _format_timestamp(value: str | None) -> str:
@@ -43,17 +67,17 @@ def _format_username(username: str | None) -> str:
 
 
 @router.message(Command("start"), flags={"auth_required": False})
-async def cmd_start(message: types.Message) -> None:
+async def cmd_start(message: types.Message, storage: Storage) -> None:
     user_id = message.from_user.id
 
-    if database.is_user_banned(user_id):
+    if storage.is_user_banned(user_id):
         pending_password_users.discard(user_id)
         await message.answer("⛔️ Доступ к боту запрещён.")
         return
 
-    if database.is_user_authorized(user_id):
+    if storage.is_user_authorized(user_id):
         pending_password_users.discard(user_id)
-        database.authorize_user(user_id, message.from_user.username)
+        storage.authorize_user(user_id, message.from_user.username)
         await message.answer(
             "👋 С возвращением! Выберите действие на клавиатуре.",
             reply_markup=build_main_menu_keyboard(),
@@ -69,7 +93,9 @@ async def cmd_start(message: types.Message) -> None:
 
 
 @router.message(lambda msg: msg.from_user.id in pending_password_users, flags={"auth_required": False})
-async def handle_password(message: types.Message) -> None:
+async def handle_password(
+    message: types.Message, storage: Storage, runtime_settings: RuntimeSettings
+) -> None:
     user_id = message.from_user.id
     if not message.text:
         await message.answer("Пароль нужно отправить текстом.")
@@ -77,10 +103,8 @@ async def handle_password(message: types.Message) -> None:
 
     password = message.text.strip()
 
-    current_password = database.get_bot_password()
-
-    if password == current_password:
-        database.authorize_user(user_id, message.from_user.username)
+    if runtime_settings.check_password(password):
+        storage.authorize_user(user_id, message.from_user.username)
         pending_password_users.discard(user_id)
         await message.answer(
             "✅ Пароль принят! Теперь вы можете пользоваться ботом.",
@@ -88,11 +112,11 @@ async def handle_password(message: types.Message) -> None:
         )
         return
 
-    attempts = database.increment_auth_attempts(user_id)
+    attempts = storage.increment_auth_attempts(user_id)
     remaining = max(0, 3 - attempts)
 
     if attempts >= 3:
-        database.ban_user(user_id, message.from_user.username, reason="invalid_password")
+        storage.ban_user(user_id, message.from_user.username, reason="invalid_password")
         pending_password_users.discard(user_id)
         await message.answer("❌ Пароль неверный. Лимит попыток исчерпан, вы заблокированы.")
         return
@@ -102,7 +126,7 @@ async def handle_password(message: types.Message) -> None:
 
 
 @router.message(lambda msg: msg.from_user.id in pending_password_change_users)
-async def handle_new_bot_password(message: types.Message) -> None:
+async def handle_new_bot_password(message: types.Message, runtime_settings: RuntimeSettings) -> None:
     user_id = message.from_user.id
     if not message.text:
         await message.answer("Пароль должен быть текстом. Попробуйте ещё раз.")
@@ -120,7 +144,7 @@ async def handle_new_bot_password(message: types.Message) -> None:
         )
         return
 
-    database.update_bot_password(new_password)
+    await runtime_settings.update_bot_password(new_password)
     pending_password_change_users.discard(user_id)
     await message.answer(
         "🔐 Пароль обновлён. Сообщите команде о новых данных для доступа.",
@@ -129,7 +153,7 @@ async def handle_new_bot_password(message: types.Message) -> None:
 
 
 @router.message(lambda msg: msg.from_user.id in pending_user_deletion)
-async def handle_user_deletion(message: types.Message) -> None:
+async def handle_user_deletion(message: types.Message, history_maintenance: HistoryMaintenance) -> None:
     user_id = message.from_user.id
     if not message.text:
         await message.answer("ID пользователя должен быть числом. Попробуйте снова.")
@@ -146,8 +170,8 @@ async def handle_user_deletion(message: types.Message) -> None:
         return
 
     target_user_id = int(user_id_text)
-    deleted = database.delete_user(target_user_id)
     pending_user_deletion.discard(user_id)
+    deleted = await asyncio.to_thread(history_maintenance.delete_user, target_user_id)
 
     if deleted:
         await message.answer(f"✅ Пользователь {target_user_id} удалён из базы.")
@@ -155,11 +179,58 @@ async def handle_user_deletion(message: types.Message) -> None:
         await message.answer("Пользователь с таким ID не найден среди активных или заблокированных.")
 
 
+@router.message(lambda msg: msg.from_user.id in pending_broadcast_users)
+async def handle_broadcast_text(message: types.Message) -> None:
+    user_id = message.from_user.id
+    if not message.text:
+        await message.answer("Текст рассылки должен быть обычным сообщением. Попробуйте ещё раз.")
+        return
+    if message.text.strip().casefold() == "отмена":
+        pending_broadcast_users.discard(user_id)
+        await message.answer("Рассылка отменена.", reply_markup=build_main_menu_keyboard())
+        return
+
+    pending_broadcast_users.discard(user_id)
+    broadcast_drafts[user_id] = message.text
+    await message.answer(
+        f"📢 Так увидят сообщение пользователи:\n\n{message.text}",
+        reply_markup=build_broadcast_confirm_keyboard(),
+    )
+
+
+@router.message(lambda msg: msg.from_user.id in pending_setting_edits)
+async def handle_setting_value(message: types.Message, runtime_settings: RuntimeSettings) -> None:
+    user_id = message.from_user.id
+    setting = TUNABLES_BY_KEY[pending_setting_edits[user_id]]
+    if not message.text:
+        await message.answer("Значение нужно отправить текстом.")
+        return
+    if message.text.strip().casefold() == "отмена":
+        pending_setting_edits.pop(user_id, None)
+        await message.answer("Изменение отменено.", reply_markup=build_main_menu_keyboard())
+        return
+
+    try:
+        value = parse_value(setting, message.text)
+    except ValueError as exc:
+        await message.answer(f"❌ Не удалось применить: {exc}. Попробуйте ещё раз или напишите «Отмена».")
+        return
+
+    pending_setting_edits.pop(user_id, None)
+    await runtime_settings.set(setting.key, value)
+    await message.answer(
+        f"✅ {setting.label}: {format_value(value)}. Изменение уже действует.",
+        reply_markup=build_main_menu_keyboard(),
+    )
+
+
 @router.message(F.text == "Настройки")
 async def show_settings(message: types.Message) -> None:
     user_id = message.from_user.id
     pending_password_change_users.discard(user_id)
     pending_user_deletion.discard(user_id)
+    pending_broadcast_users.discard(user_id)
+    pending_setting_edits.pop(user_id, None)
     await message.answer(
         "⚙️ Настройки. Выберите действие:",
         reply_markup=build_settings_keyboard(),
@@ -178,45 +249,110 @@ async def start_password_change(callback: types.CallbackQuery) -> None:
         )
 
 
-@router.callback_query(F.data == "settings:view_users")
-async def show_users(callback: types.CallbackQuery) -> None:
-    await callback.answer()
-    active_users = database.list_authorized_users()
-    banned_users = database.list_banned_users()
+def _user_line(kind: str, row) -> str:
+    username = _format_username(row["username"])
+    if kind == "active":
+        return f"• ID {row['user_id']} | {username} | доступ с {_format_timestamp(row['authorized_at'])}"
+    reason = (row["reason"] or "—")[:100]
+    return (
+        f"• ID {row['user_id']} | {username} | блокирован {_format_timestamp(row['banned_at'])} "
+        f"| причина: {reason}"
+    )
 
-    lines: list[str] = ["👥 Пользователи бота"]
 
-    if active_users:
-        lines.append("")
-        lines.append("Активные:")
-        for row in active_users[:50]:
-            username = _format_username(row["username"])
-            timestamp = _format_timestamp(row["authorized_at"])
-            lines.append(f"• ID {row['user_id']} | {username} | доступ с {timestamp}")
-        if len(active_users) > 50:
-            lines.append("… показаны последние 50 записей")
+def _encode_user_cursor(kind: str, row) -> str:
+    # Время хранится как ISO-строка с двоеточиями, поэтому user_id идёт первым
+    time_column = USER_LISTS[kind][1]
+    return f"{row['user_id']}:{row[time_column]}"
+
+
+async def _render_users_page(
+    storage: Storage, kind: str, cursor: tuple[str, int] | None = None, backwards: bool = False
+) -> tuple[str, types.InlineKeyboardMarkup]:
+    total = await asyncio.to_thread(storage.count_users, kind)
+    # Одна лишняя строка показывает, есть ли ещё страница в направлении листания
+    rows = await asyncio.to_thread(storage.get_users_page, kind, USERS_PAGE_SIZE + 1, cursor, backwards)
+    has_more = len(rows) > USERS_PAGE_SIZE
+    if backwards:
+        rows = rows[-USERS_PAGE_SIZE:] if has_more else rows
+        has_prev, has_next = has_more, True
     else:
-        lines.append("")
-        lines.append("Активные: —")
+        rows = rows[:USERS_PAGE_SIZE]
+        has_prev, has_next = cursor is not None, has_more
 
-    if banned_users:
+    title = "Активные" if kind == "active" else "Заблокированные"
+    lines = [f"👥 {title} пользователи: {total}"]
+    if rows:
         lines.append("")
-        lines.append("Заблокированные:")
-        for row in banned_users[:50]:
-            username = _format_username(row["username"])
-            timestamp = _format_timestamp(row["banned_at"])
-            reason = row["reason"] or "—"
-            lines.append(
-                f"• ID {row['user_id']} | {username} | блокирован {timestamp} | причина: {reason}"
-            )
-        if len(banned_users) > 50:
-            lines.append("… показаны последние 50 записей")
+        lines.extend(_user_line(kind, row) for row in rows)
     else:
-        lines.append("")
-        lines.append("Заблокированные: —")
+        lines.append("—")
+
+    keyboard = build_users_page_keyboard(
+        kind,
+        _encode_user_cursor(kind, rows[0]) if rows else None,
+        _encode_user_cursor(kind, rows[-1]) if rows else None,
+        has_prev,
+        has_next,
+    )
+    return "\n".join(lines), keyboard
+
 
+@router.callback_query(F.data == "settings:view_users")
+async def show_users(callback: types.CallbackQuery, storage: Storage) -> None:
+    await callback.answer()
+    text, keyboard = await _render_users_page(storage, "active")
     if callback.message:
-        await callback.message.answer("\n".join(lines))
+        await callback.message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("users:"))
+async def paginate_users(callback: types.CallbackQuery, storage: Storage) -> None:
+    parts = callback.data.split(":", 4)
+    if len(parts) < 4 or parts[1] not in USER_LISTS or parts[2] not in {"n", "p"}:
+        await callback.answer("Список устарел, откройте его заново.", show_alert=True)
+        return
+
+    kind, direction = parts[1], parts[2]
+    cursor = None
+    if len(parts) == 5 and parts[3].isdigit():
+        cursor = (parts[4], int(parts[3]))
+    await callback.answer()
+    text, keyboard = await _render_users_page(storage, kind, cursor, backwards=direction == "p")
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        pass
+
+
+def _write_users_csv(storage: Storage, path: str) -> int:
+    written = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(["status", "user_id", "username", "since", "reason"])
+        # Строки читаются порциями по индексу, в памяти одновременно только одна порция
+        for kind in USER_LISTS:
+            time_column = USER_LISTS[kind][1]
+            for row in storage.iter_users(kind):
+                reason = row["reason"] if kind == "banned" else ""
+                writer.writerow([kind, row["user_id"], row["username"] or "", row[time_column], reason])
+                written += 1
+    return written
+
+
+@router.callback_query(F.data == "users_file")
+async def download_users(callback: types.CallbackQuery, storage: Storage) -> None:
+    await callback.answer("Готовлю файл…")
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        total = await asyncio.to_thread(_write_users_csv, storage, path)
+        await callback.message.answer_document(
+            types.FSInputFile(path, filename="bot_users.csv"),
+            caption=f"👥 Все пользователи бота: {total}",
+        )
+    finally:
+        os.unlink(path)
 
 
 @router.callback_query(F.data == "settings:delete_user")
@@ -231,11 +367,118 @@ async def prompt_user_deletion(callback: types.CallbackQuery) -> None:
         )
 
 
+@router.callback_query(F.data == "settings:broadcast")
+async def prompt_broadcast(callback: types.CallbackQuery, storage: Storage, broadcaster: Broadcaster) -> None:
+    user_id = callback.from_user.id
+    await callback.answer()
+    running_id = broadcaster.running()
+    if running_id is not None:
+        row = await asyncio.to_thread(storage.get_broadcast, running_id)
+        await callback.message.answer(
+            f"📢 Сейчас идёт рассылка #{running_id}: доставлено {row['sent']}, "
+            f"ошибок {row['failed']}, заблокировали бота {row['blocked']}.",
+            reply_markup=build_broadcast_stop_keyboard(running_id),
+        )
+        return
+
+    pending_password_change_users.discard(user_id)
+    pending_user_deletion.discard(user_id)
+    pending_broadcast_users.add(user_id)
+    await callback.message.answer(
+        "📢 Отправьте текст рассылки для всех пользователей бота. Чтобы отменить, напишите «Отмена»."
+    )
+
+
+@router.callback_query(F.data == "broadcast:confirm")
+async def confirm_broadcast(callback: types.CallbackQuery, broadcaster: Broadcaster) -> None:
+    user_id = callback.from_user.id
+    text = broadcast_drafts.pop(user_id, None)
+    if text is None:
+        await callback.answer("Черновик рассылки не найден, начните заново.", show_alert=True)
+        return
+    if broadcaster.running() is not None:
+        await callback.answer("Другая рассылка ещё не закончилась.", show_alert=True)
+        return
+
+    broadcast_id = await broadcaster.start(callback.bot, text, user_id)
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=build_broadcast_stop_keyboard(broadcast_id))
+    await callback.message.answer(f"🚀 Рассылка #{broadcast_id} запущена. Пришлю итог, когда она закончится.")
+
+
+@router.callback_query(F.data == "broadcast:cancel")
+async def cancel_broadcast_draft(callback: types.CallbackQuery) -> None:
+    broadcast_drafts.pop(callback.from_user.id, None)
+    await callback.answer("Рассылка отменена.")
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest:
+        pass
+
+
+@router.callback_query(F.data.startswith("broadcast:stop:"))
+async def stop_broadcast(callback: types.CallbackQuery, broadcaster: Broadcaster) -> None:
+    broadcast_id = callback.data.rsplit(":", 1)[1]
+    if not broadcast_id.isdigit():
+        await callback.answer()
+        return
+    broadcaster.cancel(int(broadcast_id))
+    await callback.answer("Рассылка остановится после текущей порции.")
+
+
+def _tunables_keyboard(runtime_settings: RuntimeSettings) -> types.InlineKeyboardMarkup:
+    return build_tunables_keyboard(
+        [(setting.key, setting.label, format_value(value)) for setting, value in runtime_settings.items()]
+    )
+
+
+@router.callback_query(F.data == "settings:tunables")
+async def show_tunables(callback: types.CallbackQuery, runtime_settings: RuntimeSettings) -> None:
+    await callback.answer()
+    await callback.message.answer(
+        "🎛 Параметры работы. Нажмите на параметр, чтобы изменить его: "
+        "новое значение применяется сразу, без перезапуска.",
+        reply_markup=_tunables_keyboard(runtime_settings),
+    )
+
+
+@router.callback_query(F.data.startswith("tune:"))
+async def edit_tunable(callback: types.CallbackQuery, runtime_settings: RuntimeSettings) -> None:
+    user_id = callback.from_user.id
+    setting = TUNABLES_BY_KEY.get(callback.data.split(":", 1)[1])
+    if setting is None:
+        await callback.answer("Такого параметра больше нет.", show_alert=True)
+        return
+
+    if setting.kind is bool:
+        value = not runtime_settings.get(setting.key)
+        await runtime_settings.set(setting.key, value)
+        await callback.answer(f"{setting.label}: {format_value(value)}")
+        try:
+            await callback.message.edit_reply_markup(reply_markup=_tunables_keyboard(runtime_settings))
+        except TelegramBadRequest:
+            pass
+        return
+
+    pending_password_change_users.discard(user_id)
+    pending_user_deletion.discard(user_id)
+    pending_broadcast_users.discard(user_id)
+    pending_setting_edits[user_id] = setting.key
+    bounds = f" от {setting.minimum:g} до {setting.maximum:g}" if setting.maximum is not None else ""
+    await callback.answer()
+    await callback.message.answer(
+        f"✏️ {setting.label}. Сейчас: {format_value(runtime_settings.get(setting.key))}.\n"
+        f"Отправьте новое значение{bounds}. Чтобы отменить, напишите «Отмена»."
+    )
+
+
 @router.callback_query(F.data == "settings:exit")
 async def close_settings(callback: types.CallbackQuery) -> None:
     user_id = callback.from_user.id
     pending_password_change_users.discard(user_id)
     pending_user_deletion.discard(user_id)
+    pending_broadcast_users.discard(user_id)
+    pending_setting_edits.pop(user_id, None)
     await callback.answer("Настройки закрыты.")
     if callback.message:
         try:
@@ -248,21 +491,100 @@ async def close_settings(callback: types.CallbackQuery) -> None:
 async def prompt_for_link(message: types.Message) -> None:
     await message.answer(
         "✍️ Пришлите ссылку, для которой нужно собрать UTM-метки. "
-        "Она должна начинаться с http:// или https://"
+        "Она должна начинаться с http:// или https://\n\n"
+        "Нужно сразу много сочетаний меток для одной ссылки — команда /matrix."
     )
 
 
 @router.message(F.text == "Посмотреть историю")
-async def show_history(message: types.Message) -> None:
+async def show_history(
+    message: types.Message,
+    storage: Storage,
+    self_shortener: SelfHostedShortener,
+    click_counter: ClickCounter,
+) -> None:
     user_id = message.from_user.id
 
-    history = database.get_history(user_id, limit=20)
+    history = storage.get_history(user_id, limit=20)
     if not history:
         await message.answer("Пока нет сохранённых ссылок. Сначала сгенерируйте UTM.")
         return
 
+    link_ids = {short: self_shortener.link_id_for(short) for _, _, short in history}
+    stored_clicks = storage.get_link_clicks([link_id for link_id in link_ids.values() if link_id is not None])
+
     text_lines = ["🧾 Последние сохранённые ссылки:"]
     for index, (original, _, short) in enumerate(history, start=1):
-        text_lines.append(f"{index}. {short} — исходная: {original}")
+        line = f"{index}. {short} — исходная: {original}"
+        link_id = link_ids[short]
+        if link_id is not None:
+            clicks = stored_clicks.get(link_id, 0) + click_counter.pending(link_id)
+            line += f" | переходов: {clicks}"
+        text_lines.append(line)
+
+    await message.answer("\n".join(text_lines))
+
 
+@router.message(Command("clicks"))
+async def show_campaign_clicks(message: types.Message, storage: Storage) -> None:
+    totals: dict[str, int] = {}
+    for row in storage.list_clicked_links():
+        campaign = extract_utm_params(row["target_url"]).get("utm_campaign") or "—"
+        totals[campaign] = totals.get(campaign, 0) + int(row["clicks"])
+
+    if not totals:
+        await message.answer("Переходов по коротким ссылкам пока нет.")
+        return
+
+    text_lines = ["📈 Переходы по кампаниям (utm_campaign):"]
+    for campaign, clicks in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        text_lines.append(f"• {campaign}: {clicks}")
     await message.answer("\n".join(text_lines))
+
+
+@router.message(Command("queue"))
+async def show_retry_queue(message: types.Message, shorten_retry_queue: ShortenRetryQueue) -> None:
+    stats = await shorten_retry_queue.stats()
+    if not stats["depth"]:
+        await message.answer("✅ Очередь повторного сокращения пуста.")
+        return
+    minutes = int(stats["oldest_age_seconds"] // 60)
+    await message.answer(
+        f"⏳ В очереди на сокращение: {stats['depth']}\n"
+        f"Самое старое задание ждёт: {minutes} мин."
+    )
+
+
+@router.message(Command("slow"))
+async def send_slow_updates(message: types.Message) -> None:
+    if not update_profiler.reports:
+        await message.answer("Медленных апдейтов не было (или профилирование выключено).")
+        return
+    payload = update_profiler.render_reports().encode("utf-8")
+    await message.answer_document(
+        types.BufferedInputFile(payload, filename="slow_updates.txt"),
+        caption=f"🐢 Последние медленные апдейты: {len(update_profiler.reports)}",
+    )
+
+
+def _build_history_csv(storage: Storage, user_id: int) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["created_at", "base_url", "utm_url", "short_url"])
+    # Сначала архивные записи, затем актуальные — порядок от старых к новым
+    for source in (history_archive.iter_records(user_id), storage.iter_history_records(user_id)):
+        for record in source:
+            writer.writerow(
+                [record["created_at"], record["base_url"], record["utm_url"], record["short_url"]]
+            )
+    return buffer.getvalue().encode("utf-8-sig")
+
+
+@router.message(Command("export"))
+async def export_history(message: types.Message, storage: Storage) -> None:
+    user_id = message.from_user.id
+    payload = await asyncio.to_thread(_build_history_csv, storage, user_id)
+    await message.answer_document(
+        types.BufferedInputFile(payload, filename="utm_history.csv"),
+        caption="📦 Полная история ссылок, включая архив.",
+    )
@@ -0,0 +1,225 @@
+import logging
+import math
+from typing import Any, Dict, Optional
+
+from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command
+
+from src.config import settings
+from src.handlers.catalog import CANCEL_WORDS, resolve_entry
+from src.handlers.utm_generation import CAMPAIGN_GROUPS_MAP, MEDIUM_GROUPS_MAP
+from src.keyboards.utm_keyboards import build_matrix_keyboard
+from src.services.matrix import MatrixGenerator, build_combinations, build_matrix_csv
+from src.services.utm_manager import utm_manager
+from src.state.user_state import matrix_sessions
+
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+# Шаг матрицы -> (вид клавиатуры каталога для resolve_entry, категории-вкладки, подпись)
+MATRIX_STEPS = {
+    "source": ("src", ("source",), "utm_source"),
+    "medium": ("med", tuple(MEDIUM_GROUPS_MAP.values()), "utm_medium"),
+    "campaign": ("camp", tuple(CAMPAIGN_GROUPS_MAP.values()), "utm_campaign"),
+}
+STEP_ORDER = ("source", "medium", "campaign")
+
+
+def _new_session() -> Dict[str, Any]:
+    return {
+        "base_url": None,
+        "step": STEP_ORDER[0],
+        "category": MATRIX_STEPS[STEP_ORDER[0]][1][0],
+        "page": 0,
+        "selected": {step: [] for step in STEP_ORDER},
+    }
+
+
+def _combinations_count(session: Dict[str, Any]) -> int:
+    return math.prod(len(session["selected"][step]) for step in STEP_ORDER)
+
+
+def _step_text(session: Dict[str, Any]) -> str:
+    lines = ["🧮 Матрица ссылок", f"Ссылка: {session['base_url']}"]
+    for step in STEP_ORDER:
+        values = session["selected"][step]
+        if values:
+            lines.append(f"{MATRIX_STEPS[step][2]}: {', '.join(values)}")
+    lines.append("")
+    lines.append(f"Отметьте нужные {MATRIX_STEPS[session['step']][2]} (можно несколько):")
+    return "\n".join(lines)
+
+
+def _step_keyboard(session: Dict[str, Any]) -> types.InlineKeyboardMarkup:
+    step = session["step"]
+    page = utm_manager.get_page(session["category"], session["page"])
+    session["page"] = page.page
+    selected = session["selected"][step]
+    if step == STEP_ORDER[-1]:
+        next_label = f"🧮 Сгенерировать ({_combinations_count(session)})"
+    else:
+        next_label = f"Далее ➡️ ({len(selected)})"
+    return build_matrix_keyboard(page, session["category"], MATRIX_STEPS[step][1], selected, next_label)
+
+
+async def _refresh_keyboard(callback: types.CallbackQuery, session: Dict[str, Any]) -> None:
+    try:
+        await callback.message.edit_reply_markup(reply_markup=_step_keyboard(session))
+    except TelegramBadRequest:
+        pass
+
+
+async def _session_or_alert(callback: types.CallbackQuery) -> Optional[Dict[str, Any]]:
+    session = matrix_sessions.get(callback.from_user.id)
+    if session is None or session["base_url"] is None:
+        await callback.answer("Матрица устарела, начните заново: /matrix", show_alert=True)
+        return None
+    return session
+
+
+@router.message(Command("matrix"))
+async def start_matrix(message: types.Message) -> None:
+    matrix_sessions[message.from_user.id] = _new_session()
+    await message.answer(
+        "🧮 Матрица ссылок: одна базовая ссылка, несколько источников, типов трафика и кампаний. "
+        "Бот соберёт все сочетания и пришлёт их одним CSV.\n\n"
+        "Пришлите базовую ссылку (http:// или https://). Чтобы отменить, напишите «Отмена»."
+    )
+
+
+@router.message(
+    lambda msg: msg.from_user.id in matrix_sessions and matrix_sessions[msg.from_user.id]["base_url"] is None
+)
+async def handle_matrix_base_url(message: types.Message) -> None:
+    user_id = message.from_user.id
+    text = (message.text or "").strip()
+
+    if not text or text.lower() in CANCEL_WORDS:
+        matrix_sessions.pop(user_id, None)
+        await message.answer("Матрица отменена.")
+        return
+    if not text.startswith(("http://", "https://")):
+        await message.answer("Ссылка должна начинаться с http:// или https://. Попробуйте ещё раз:")
+        return
+
+    session = matrix_sessions[user_id]
+    session["base_url"] = text
+    logger.info("Matrix base URL from user %s: %s", user_id, text)
+    await message.answer(_step_text(session), reply_markup=_step_keyboard(session))
+
+
+@router.callback_query(F.data.startswith("mx:"))
+async def toggle_matrix_entry(callback: types.CallbackQuery) -> None:
+    session = await _session_or_alert(callback)
+    if session is None:
+        return
+    step = session["step"]
+    entry = resolve_entry(callback.data, MATRIX_STEPS[step][0])
+    if entry is None:
+        await callback.answer("Метка не найдена: каталог изменился.", show_alert=True)
+        return
+
+    selected = session["selected"][step]
+    if entry.value in selected:
+        selected.remove(entry.value)
+    else:
+        selected.append(entry.value)
+    await callback.answer()
+    await _refresh_keyboard(callback, session)
+
+
+@router.callback_query(F.data.startswith("mxcat:"))
+async def switch_matrix_tab(callback: types.CallbackQuery) -> None:
+    session = await _session_or_alert(callback)
+    if session is None:
+        return
+    category_key = callback.data.split(":", 1)[1]
+    if category_key not in MATRIX_STEPS[session["step"]][1]:
+        await callback.answer("Клавиатура устарела.", show_alert=True)
+        return
+
+    session["category"] = category_key
+    session["page"] = 0
+    await callback.answer()
+    await _refresh_keyboard(callback, session)
+
+
+@router.callback_query(F.data.startswith("mxpage:"))
+async def paginate_matrix(callback: types.CallbackQuery) -> None:
+    session = await _session_or_alert(callback)
+    if session is None:
+        return
+    page_text = callback.data.split(":", 1)[1]
+    if not page_text.isdigit():
+        await callback.answer("Клавиатура устарела.", show_alert=True)
+        return
+
+    session["page"] = int(page_text)
+    await callback.answer()
+    await _refresh_keyboard(callback, session)
+
+
+@router.callback_query(F.data == "mx_cancel")
+async def cancel_matrix(callback: types.CallbackQuery) -> None:
+    matrix_sessions.pop(callback.from_user.id, None)
+    await callback.answer("Матрица отменена.")
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest:
+        pass
+
+
+@router.callback_query(F.data == "mx_next")
+async def advance_matrix(callback: types.CallbackQuery, matrix_generator: MatrixGenerator) -> None:
+    session = await _session_or_alert(callback)
+    if session is None:
+        return
+    step = session["step"]
+    if not session["selected"][step]:
+        await callback.answer("Отметьте хотя бы одну метку.", show_alert=True)
+        return
+
+    if step != STEP_ORDER[-1]:
+        session["step"] = STEP_ORDER[STEP_ORDER.index(step) + 1]
+        session["category"] = MATRIX_STEPS[session["step"]][1][0]
+        session["page"] = 0
+        await callback.answer()
+        await callback.message.edit_text(_step_text(session), reply_markup=_step_keyboard(session))
+        return
+
+    total = _combinations_count(session)
+    if total > settings.matrix_max_combinations:
+        await callback.answer(
+            f"Слишком много сочетаний: {total}, можно не больше {settings.matrix_max_combinations}.",
+            show_alert=True,
+        )
+        return
+    await generate_matrix(callback, session, matrix_generator)
+
+
+async def generate_matrix(
+    callback: types.CallbackQuery, session: Dict[str, Any], matrix_generator: MatrixGenerator
+) -> None:
+    user_id = callback.from_user.id
+    matrix_sessions.pop(user_id, None)
+    selected = session["selected"]
+    combinations = build_combinations(
+        session["base_url"], selected["source"], selected["medium"], selected["campaign"]
+    )
+
+    await callback.answer()
+    await callback.message.edit_text(f"⏳ Собираю {len(combinations)} ссылок…")
+    result = await matrix_generator.generate(user_id, session["base_url"], combinations)
+
+    caption = (
+        f"🧮 Матрица готова: {len(result.rows)} ссылок, "
+        f"новых сокращений {result.provider_calls}, из кеша {result.cached}"
+    )
+    if result.failed:
+        caption += f"\n⚠️ Не удалось сократить: {result.failed}, в CSV для них только UTM-ссылка."
+    await callback.message.answer_document(
+        types.BufferedInputFile(build_matrix_csv(result.rows), filename="utm_matrix.csv"),
+        caption=caption,
+    )
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from aiogram import F, Router, types
+from aiogram.filters import Command, CommandObject
+
+from src.keyboards.search import build_search_pagination_keyboard
+from src.services.storage import Storage
+from src.services.utm_builder import extract_utm_params
+from src.state.user_state import search_queries
+
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+SEARCH_PAGE_SIZE = 10
+
+
+async def _render_page(
+    storage: Storage, user_id: int, query: str, page: int
+) -> tuple[str, types.InlineKeyboardMarkup | None]:
+    # Запрашиваем на одну запись больше, чтобы понять, есть ли следующая страница
+    records = await asyncio.to_thread(
+        storage.search_history, user_id, query, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE
+    )
+    has_next = len(records) > SEARCH_PAGE_SIZE
+    records = records[:SEARCH_PAGE_SIZE]
+
+    if not records:
+        if page == 0:
+            return f"🔍 По запросу «{query}» ничего не найдено.", None
+        return "🔍 Больше результатов нет.", build_search_pagination_keyboard(page, False)
+
+    lines = [f"🔍 Результаты по запросу «{query}» (стр. {page + 1}):"]
+    for index, record in enumerate(records, start=page * SEARCH_PAGE_SIZE + 1):
+        utm_params = extract_utm_params(record["utm_url"])
+        created = record["created_at"][:10]
+        tags = " / ".join(
+            utm_params[key] for key in ("utm_source", "utm_medium", "utm_campaign") if key in utm_params
+        )
+        lines.append(f"{index}. {record['short_url']} — {record['base_url']}\n   {created} | {tags or '—'}")
+    return "\n".join(lines), build_search_pagination_keyboard(page, has_next)
+
+
+@router.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject, storage: Storage) -> None:
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "Укажите, что искать: /find <слова>\n"
+            "Например: /find гамлет vk или /find hamlet spb"
+        )
+        return
+
+    search_queries[message.from_user.id] = query
+    text, keyboard = await _render_page(storage, message.from_user.id, query, 0)
+    await message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
+
+
+@router.callback_query(F.data.startswith("find:"))
+async def paginate_find(callback: types.CallbackQuery, storage: Storage) -> None:
+    query = search_queries.get(callback.from_user.id)
+    page_text = callback.data.split(":", 1)[1]
+    if not query or not page_text.isdigit():
+        await callback.answer("Поиск устарел. Повторите команду /find.", show_alert=True)
+        return
+
+    await callback.answer()
+    text, keyboard = await _render_page(storage, callback.from_user.id, query, int(page_text))
+    if callback.message:
+        await callback.message.edit_text(text, reply_markup=keyboard, disable_web_page_preview=True)
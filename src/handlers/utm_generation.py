@@ -1,30 +1,41 @@
+import asyncio
 import datetime
 import logging
-from typing import Optional, Sequence, Tuple
+from typing import Any, Optional, Sequence, Tuple
 
 from aiogram import F, Router, types
-from aiogram.types import InlineKeyboardButton
 
 from src.config import settings
+from src.handlers.catalog import catalog_keyboard, resolve_entry
 from src.keyboards.utm_keyboards import (
     build_campaign_groups_keyboard,
-    build_campaign_keyboard,
     build_date_choice_keyboard,
     build_medium_groups_keyboard,
-    build_medium_keyboard,
-    build_sources_keyboard,
+    build_result_keyboard,
 )
-from src.services.clc_shortener import shorten_url
+from src.services.retry_queue import ShortenRetryQueue
+from src.services.shorteners import ShortenerProvider
+from src.services.storage import Storage
 from src.services.utm_builder import build_utm_url
 from src.services.utm_manager import utm_manager
-from src.services.database import database
-from src.state.user_state import user_data
-from src.utils.utm import build_utm_content_with_date, extract_action_slug
+from src.state.user_state import UserSessionData, catalog_filters, session_locks, user_data
+from src.utils.deadline import DeadlineExceeded, within_deadline
+from src.utils.utm import (
+    build_utm_content_with_date,
+    extract_action_slug,
+    format_generation_result,
+)
 
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Сколько секунд бюджета апдейта оставлять на ответ пользователю и на запись в базу.
+# Сам ответ бюджетом не ограничен: пользователь получает его, даже если время вышло
+REPLY_RESERVE_SECONDS = 1.5
+WRITE_RESERVE_SECONDS = 1.0
+GENERATION_FLAGS = {"deadline": settings.generation_deadline_seconds}
+
 
 def get_utm_sources() -> Sequence[Tuple[str, str]]:
     return utm_manager.get_category_data("source")
@@ -77,14 +88,19 @@ async def handle_base_url(message: types.Message) -> None:
 
     await message.answer(
         "Выберите источник трафика (utm_source):",
-        reply_markup=build_sources_keyboard(sources),
+        reply_markup=catalog_keyboard(user_id, "src", "source"),
     )
 
 
 @router.callback_query(F.data.startswith("src:"))
 async def select_source(callback: types.CallbackQuery) -> None:
     user_id = callback.from_user.id
-    source_val = callback.data.split(":", 1)[1]
+    entry = resolve_entry(callback.data, "src")
+    if entry is None:
+        await callback.answer("Метка не найдена: каталог изменился, начните заново.", show_alert=True)
+        return
+    source_val = entry.value
+    catalog_filters.pop(user_id, None)
 
     user_data.setdefault(user_id, {})
     user_data[user_id]["utm_source"] = source_val
@@ -112,14 +128,19 @@ async def select_medium_group(callback: types.CallbackQuery) -> None:
     await callback.message.edit_text(f"Вы выбрали группу: {group_val}")
     await callback.message.answer(
         "Теперь выберите конкретную utm_medium:",
-        reply_markup=build_medium_keyboard(mediums),
+        reply_markup=catalog_keyboard(user_id, "med", MEDIUM_GROUPS_MAP[group_val]),
     )
 
 
 @router.callback_query(F.data.startswith("med:"))
 async def select_medium(callback: types.CallbackQuery) -> None:
     user_id = callback.from_user.id
-    medium_val = callback.data.split(":", 1)[1]
+    entry = resolve_entry(callback.data, "med")
+    if entry is None:
+        await callback.answer("Метка не найдена: каталог изменился, выберите заново.", show_alert=True)
+        return
+    medium_val = entry.value
+    catalog_filters.pop(user_id, None)
 
     user_data.setdefault(user_id, {})
     user_data[user_id]["utm_medium"] = medium_val
@@ -146,14 +167,19 @@ async def select_campaign_group(callback: types.CallbackQuery) -> None:
     await callback.message.edit_text(f"Вы выбрали группу кампаний: {group_val}")
     await callback.message.answer(
         "Теперь выберите конкретную кампанию (utm_campaign):",
-        reply_markup=build_campaign_keyboard(campaigns),
+        reply_markup=catalog_keyboard(user_id, "camp", CAMPAIGN_GROUPS_MAP[group_val]),
     )
 
 
 @router.callback_query(F.data.startswith("camp:"))
 async def select_campaign(callback: types.CallbackQuery) -> None:
     user_id = callback.from_user.id
-    campaign_val = callback.data.split(":", 1)[1]
+    entry = resolve_entry(callback.data, "camp")
+    if entry is None:
+        await callback.answer("Метка не найдена: каталог изменился, выберите заново.", show_alert=True)
+        return
+    campaign_val = entry.value
+    catalog_filters.pop(user_id, None)
 
     user_data.setdefault(user_id, {})
     user_data[user_id]["utm_campaign"] = campaign_val
@@ -167,48 +193,56 @@ async def select_campaign(callback: types.CallbackQuery) -> None:
     )
 
 
-@router.callback_query(F.data.startswith("adddate:"))
-async def add_date_choice(callback: types.CallbackQuery) -> None:
-    user_id = callback.from_user.id
-    choice = callback.data.split(":", 1)[1]
+DATE_CHOICE_OFFSETS = {"today": 0, "tomorrow": 1, "dayafter": 2}
 
-    user_data.setdefault(user_id, {})
 
-    if choice == "today":
-        today = datetime.date.today().isoformat()
-        user_data[user_id]["date_for_utm"] = today
-        await callback.answer()
-        await generate_short_link(user_id, callback=callback)
-        return
+async def _update_session(user_id: int, **changes: Any) -> UserSessionData:
+    """
+    Меняет сессию пользователя и возвращает её снимок. Ссылка строится по снимку,
+    поэтому повторное нажатие, пришедшее во время сокращения, не подменит параметры.
+    """
+    async with session_locks.hold(user_id):
+        session = user_data.setdefault(user_id, {})
+        for key, value in changes.items():
+            if value is None:
+                session.pop(key, None)
+            else:
+                session[key] = value
+        return dict(session)
 
-    if choice == "tomorrow":
-        tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
-        user_data[user_id]["date_for_utm"] = tomorrow
-        await callback.answer()
-        await generate_short_link(user_id, callback=callback)
-        return
 
-    if choice == "dayafter":
-        day_after_tomorrow = (datetime.date.today() + datetime.timedelta(days=2)).isoformat()
-        user_data[user_id]["date_for_utm"] = day_after_tomorrow
-        await callback.answer()
-        await generate_short_link(user_id, callback=callback)
-        return
+@router.callback_query(F.data.startswith("adddate:"), flags=GENERATION_FLAGS)
+async def add_date_choice(
+    callback: types.CallbackQuery,
+    storage: Storage,
+    shortener: ShortenerProvider,
+    shorten_retry_queue: ShortenRetryQueue,
+) -> None:
+    user_id = callback.from_user.id
+    choice = callback.data.split(":", 1)[1]
 
-    if choice == "none":
-        user_data[user_id].pop("date_for_utm", None)
-        user_data[user_id].pop("awaiting_date", None)
+    if choice in DATE_CHOICE_OFFSETS:
+        date_for_utm = (datetime.date.today() + datetime.timedelta(days=DATE_CHOICE_OFFSETS[choice])).isoformat()
+        session = await _update_session(user_id, date_for_utm=date_for_utm)
+    elif choice == "none":
+        session = await _update_session(user_id, date_for_utm=None, awaiting_date=None)
+    else:
+        await _update_session(user_id, awaiting_date=True)
         await callback.answer()
-        await generate_short_link(user_id, callback=callback)
+        await callback.message.answer("Введите дату в формате YYYY-MM-DD (например: 2025-10-10)")
         return
 
-    user_data[user_id]["awaiting_date"] = True
     await callback.answer()
-    await callback.message.answer("Введите дату в формате YYYY-MM-DD (например: 2025-10-10)")
+    await generate_short_link(user_id, session, storage, shortener, shorten_retry_queue, callback=callback)
 
 
-@router.message(lambda msg: user_data.get(msg.from_user.id, {}).get("awaiting_date"))
-async def handle_manual_date(message: types.Message) -> None:
+@router.message(lambda msg: user_data.get(msg.from_user.id, {}).get("awaiting_date"), flags=GENERATION_FLAGS)
+async def handle_manual_date(
+    message: types.Message,
+    storage: Storage,
+    shortener: ShortenerProvider,
+    shorten_retry_queue: ShortenRetryQueue,
+) -> None:
     user_id = message.from_user.id
     date_str = message.text.strip()
 
@@ -220,63 +254,76 @@ async def handle_manual_date(message: types.Message) -> None:
         )
         return
 
-    user_data[user_id]["date_for_utm"] = date_str
-    user_data[user_id]["awaiting_date"] = False
-    await generate_short_link(user_id, message=message)
+    session = await _update_session(user_id, date_for_utm=date_str, awaiting_date=False)
+    await generate_short_link(user_id, session, storage, shortener, shorten_retry_queue, message=message)
 
 
 async def generate_short_link(
     user_id: int,
+    session: UserSessionData,
+    storage: Storage,
+    shortener: ShortenerProvider,
+    shorten_retry_queue: ShortenRetryQueue,
     message: Optional[types.Message] = None,
     callback: Optional[types.CallbackQuery] = None,
 ) -> None:
-    base_url = user_data[user_id].get("base_url", "")
-    utm_source = user_data[user_id].get("utm_source")
-    utm_medium = user_data[user_id].get("utm_medium")
-    utm_campaign = user_data[user_id].get("utm_campaign")
-    date_for_utm = user_data[user_id].get("date_for_utm", "").strip()
+    base_url = session.get("base_url", "")
+    utm_source = session.get("utm_source")
+    utm_medium = session.get("utm_medium")
+    utm_campaign = session.get("utm_campaign")
+    date_for_utm = (session.get("date_for_utm") or "").strip()
 
     base_slug = extract_action_slug(base_url)
     utm_content = build_utm_content_with_date(base_slug, date_for_utm)
     full_url = build_utm_url(base_url, utm_source, utm_medium, utm_campaign, utm_content)
 
     logger.info("Full UTM URL for user %s: %s", user_id, full_url)
-    logger.info("Sending to CLC: %s", full_url)
+    logger.info("Sending to shortener %s: %s", shortener.name, full_url)
 
     try:
-        short_url = await shorten_url(full_url, settings.clc_api_key)
-    except Exception as exc:  # pragma: no cover - network failure path
-        logger.exception("CLC shorten exception for user %s: %s", user_id, exc)
-        await _reply(
-            message,
-            callback,
-            "❌ Ошибка при обращении к сервису сокращения. Попробуйте позже.",
+        short_url = await within_deadline(
+            shortener.shorten(full_url), "shortener", reserve=WRITE_RESERVE_SECONDS + REPLY_RESERVE_SECONDS
         )
-        return
+    except DeadlineExceeded:
+        logger.warning("Shortener did not answer within the deadline for user %s", user_id)
+        short_url = None
+    except Exception as exc:  # pragma: no cover - network failure path
+        logger.exception("Shortener exception for user %s: %s", user_id, exc)
+        short_url = None
 
     if short_url is None:
-        logger.error("CLC shorten returned None for user %s, url=%s", user_id, full_url)
+        logger.error("Shortener returned None for user %s, url=%s", user_id, full_url)
+        chat_id = message.chat.id if message else callback.message.chat.id
+        try:
+            await within_deadline(
+                asyncio.shield(shorten_retry_queue.enqueue(user_id, chat_id, base_url, full_url)),
+                "retry_queue",
+                reserve=REPLY_RESERVE_SECONDS,
+            )
+        except DeadlineExceeded:
+            # Запись защищена от отмены и доедет сама, ответ важнее
+            logger.warning("Retry job for user %s was not stored within the deadline", user_id)
         await _reply(
             message,
             callback,
-            "❌ Не удалось сократить ссылку. Попробуйте позже.",
+            "⏳ Сервис сокращения сейчас недоступен. Ссылка с UTM уже готова:\n\n"
+            f"{full_url}\n\n"
+            "Короткую ссылку пришлю автоматически, как только сервис ответит.",
         )
         return
 
-    database.add_history(user_id, base_url, full_url, short_url)
-
-    lines = ["✅ Результаты генерации ссылок:", f"🔗 Исходная:\n{base_url}"]
-    lines.append("\n🧩 С UTM:\n" + full_url)
-    lines.append("✂️ Сокращённая:\n" + short_url)
-    result_text = "\n\n".join(lines)
-
-    webapp_button = InlineKeyboardButton(
-        text="Открыть API GorBilet",
-        web_app=types.WebAppInfo(url="https://api.gorbilet.com/v2/admin/"),
-    )
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[[webapp_button]])
+    try:
+        await within_deadline(
+            asyncio.shield(asyncio.to_thread(storage.add_history, user_id, base_url, full_url, short_url)),
+            "history",
+            reserve=REPLY_RESERVE_SECONDS,
+        )
+    except DeadlineExceeded:
+        # Как и задача повтора, запись в историю не отменяется, ссылка не потеряется
+        logger.warning("History write for user %s did not finish within the deadline", user_id)
 
-    await _reply(message, callback, result_text, keyboard)
+    result_text = format_generation_result(base_url, full_url, short_url)
+    await _reply(message, callback, result_text, build_result_keyboard())
 
 
 async def _reply(
@@ -3,19 +3,28 @@ import re
 from aiogram import F, Router, types
 from aiogram.filters import Command
 
-from src.keyboards.utm_keyboards import (
-    build_categories_keyboard,
-    build_category_management_keyboard,
-)
+from src.handlers.catalog import catalog_keyboard, resolve_entry
+from src.keyboards.utm_keyboards import build_categories_keyboard
 from src.services.utm_manager import utm_manager
-from src.state.user_state import utm_editing_data
+from src.state.user_state import catalog_filters, session_locks, utm_editing_data
 
 
 router = Router()
 
+# Сколько меток перечисляется в тексте сообщения; остальные доступны на страницах клавиатуры
+ITEMS_TEXT_LIMIT = 50
+
+
+def _format_items(items) -> str:
+    lines = [f"• {name} ({value})" for name, value in items[:ITEMS_TEXT_LIMIT]]
+    if len(items) > ITEMS_TEXT_LIMIT:
+        lines.append(f"… и ещё {len(items) - ITEMS_TEXT_LIMIT}")
+    return "\n".join(lines)
+
 
 def _reset_add_state(user_id: int) -> None:
     utm_editing_data.pop(user_id, None)
+    catalog_filters.pop(user_id, None)
 
 
 def _is_add_active(user_id: int) -> bool:
@@ -87,9 +96,7 @@ async def select_add_category(callback: types.CallbackQuery) -> None:
     existing_items = utm_manager.get_category_data(category_simple_key)
 
     if existing_items:
-        items_text = "\n\n📋 Существующие метки:\n" + "\n".join(
-            f"• {name} ({value})" for name, value in existing_items
-        )
+        items_text = "\n\n📋 Существующие метки:\n" + _format_items(existing_items)
     else:
         items_text = "\n\n📭 В этой категории пока нет меток"
 
@@ -97,7 +104,7 @@ async def select_add_category(callback: types.CallbackQuery) -> None:
         f"Выбрана категория: {category_name}\n"
         f"Теперь введите название новой метки (например: 'Новый источник'){items_text}\n\n"
         "Или нажмите кнопку ниже чтобы посмотреть все метки:",
-        reply_markup=build_category_management_keyboard(category_key, existing_items),
+        reply_markup=catalog_keyboard(user_id, "del", category_simple_key),
     )
 
 
@@ -136,9 +143,14 @@ async def handle_utm_value(message: types.Message) -> None:
         )
         return
 
-    user_state = utm_editing_data[user_id]
-    category_key = user_state["category"]
-    name = user_state["name"]
+    # Состояние сбрасывается до ответов: повторная отправка значения, пришедшая,
+    # пока бот отвечает, не добавит метку второй раз
+    async with session_locks.hold(user_id):
+        user_state = utm_editing_data.get(user_id, {})
+        category_key, name = user_state.get("category"), user_state.get("name")
+        utm_editing_data[user_id] = {"step": None, "category": None}
+    if category_key is None or name is None:
+        return
 
     category_simple_key = category_key.split("_", 1)[1]
     success = utm_manager.add_item(category_simple_key, name, value)
@@ -156,11 +168,11 @@ async def handle_utm_value(message: types.Message) -> None:
         )
 
         existing_items = utm_manager.get_category_data(category_simple_key)
-        items_text = "\n".join(f"• {item_name} ({item_value})" for item_name, item_value in existing_items)
+        items_text = _format_items(existing_items)
 
         await message.answer(
             f"📋 Обновленный список меток в категории:\n{items_text}",
-            reply_markup=build_category_management_keyboard(category_key, existing_items),
+            reply_markup=catalog_keyboard(user_id, "del", category_simple_key),
         )
     else:
         await message.answer(
@@ -168,60 +180,46 @@ async def handle_utm_value(message: types.Message) -> None:
             "Попробуйте другое значение."
         )
 
-    utm_editing_data[user_id] = {"step": None, "category": None}
-
 
 @router.callback_query(F.data.startswith("view_category:"))
 async def view_category_items(callback: types.CallbackQuery) -> None:
     category_key = callback.data.split(":", 1)[1]
-    category_simple_key = category_key.split("_", 1)[1]
-
     categories = utm_manager.get_all_categories()
-    category_name = categories[category_key][0]
-    existing_items = utm_manager.get_category_data(category_simple_key)
-
-    if existing_items:
-        items_text = "\n".join(f"• {name} ({value})" for name, value in existing_items)
-        text = f"📋 Все метки в категории '{category_name}':\n\n{items_text}"
-    else:
-        text = f"📭 В категории '{category_name}' пока нет меток"
-
-    await callback.message.edit_text(
-        text,
-        reply_markup=build_category_management_keyboard(category_key, existing_items),
-    )
+    if category_key not in categories:
+        await callback.answer("Категория не найдена.", show_alert=True)
+        return
+    await _show_category(callback, category_key)
 
 
 @router.callback_query(F.data.startswith("delete_item:"))
 async def delete_utm_item(callback: types.CallbackQuery) -> None:
-    parts = callback.data.split(":")
-    if len(parts) < 3:
-        await callback.answer("❌ Ошибка!")
+    entry = resolve_entry(callback.data, "del")
+    if entry is None:
+        await callback.answer("❌ Метка не найдена: возможно, она уже удалена.", show_alert=True)
         return
 
-    _, category_key, value = parts
-    category_simple_key = category_key.split("_", 1)[1]
-
-    success = utm_manager.delete_item(category_simple_key, value)
+    success = utm_manager.delete_item(entry.category, entry.value)
     if not success:
         await callback.answer("❌ Ошибка при удалении!")
         return
 
     await callback.answer("✅ Метка удалена!")
+    await _show_category(callback, f"utm_{entry.category}")
 
-    categories = utm_manager.get_all_categories()
-    category_name = categories[category_key][0]
+
+async def _show_category(callback: types.CallbackQuery, category_key: str) -> None:
+    category_simple_key = category_key.split("_", 1)[1]
+    category_name = utm_manager.get_all_categories()[category_key][0]
     existing_items = utm_manager.get_category_data(category_simple_key)
 
     if existing_items:
-        items_text = "\n".join(f"• {name} ({value})" for name, value in existing_items)
-        text = f"📋 Все метки в категории '{category_name}':\n\n{items_text}"
+        text = f"📋 Все метки в категории '{category_name}':\n\n{_format_items(existing_items)}"
     else:
         text = f"📭 В категории '{category_name}' пока нет меток"
 
     await callback.message.edit_text(
         text,
-        reply_markup=build_category_management_keyboard(category_key, existing_items),
+        reply_markup=catalog_keyboard(callback.from_user.id, "del", category_simple_key),
     )
 
 
@@ -0,0 +1,15 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+
+def build_search_pagination_keyboard(page: int, has_next: bool) -> InlineKeyboardMarkup | None:
+    if page == 0 and not has_next:
+        return None
+
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.add(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"find:{page - 1}"))
+    if has_next:
+        builder.add(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"find:{page + 1}"))
+    builder.adjust(2)
+    return builder.as_markup()
@@ -1,3 +1,5 @@
+from typing import Sequence, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -22,6 +24,18 @@ def build_settings_keyboard() -> InlineKeyboardMarkup:
             callback_data="settings:delete_user",
         )
     )
+    builder.add(
+        InlineKeyboardButton(
+            text="📢 Рассылка",
+            callback_data="settings:broadcast",
+        )
+    )
+    builder.add(
+        InlineKeyboardButton(
+            text="🎛 Параметры работы",
+            callback_data="settings:tunables",
+        )
+    )
     builder.add(
         InlineKeyboardButton(
             text="⬅️ Выйти",
@@ -30,3 +44,47 @@ def build_settings_keyboard() -> InlineKeyboardMarkup:
     )
     builder.adjust(1)
     return builder.as_markup()
+
+
+def build_users_page_keyboard(
+    kind: str,
+    first_cursor: str | None,
+    last_cursor: str | None,
+    has_prev: bool,
+    has_next: bool,
+) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    navigation = []
+    if has_prev and first_cursor:
+        navigation.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"users:{kind}:p:{first_cursor}"))
+    if has_next and last_cursor:
+        navigation.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"users:{kind}:n:{last_cursor}"))
+    if navigation:
+        builder.row(*navigation)
+    other_kind, other_text = ("banned", "⛔️ Заблокированные") if kind == "active" else ("active", "✅ Активные")
+    builder.row(InlineKeyboardButton(text=other_text, callback_data=f"users:{other_kind}:n:"))
+    builder.row(InlineKeyboardButton(text="📄 Скачать всех файлом", callback_data="users_file"))
+    return builder.as_markup()
+
+
+def build_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✅ Отправить всем", callback_data="broadcast:confirm")
+    builder.button(text="❌ Отмена", callback_data="broadcast:cancel")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def build_broadcast_stop_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⏹ Остановить рассылку", callback_data=f"broadcast:stop:{broadcast_id}")
+    return builder.as_markup()
+
+
+def build_tunables_keyboard(items: Sequence[Tuple[str, str, str]]) -> InlineKeyboardMarkup:
+    """items: (ключ, подпись, текущее значение)"""
+    builder = InlineKeyboardBuilder()
+    for key, label, value in items:
+        builder.button(text=f"{label}: {value}", callback_data=f"tune:{key}")
+    builder.adjust(1)
+    return builder.as_markup()
@@ -1,8 +1,19 @@
-from typing import Iterable, Sequence, Tuple
+from typing import Collection, Sequence
 
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.services.utm_manager import CatalogPage
+
+
+# Вид клавиатуры каталога -> (префикс callback выбора, подпись кнопки, кнопок в ряду)
+CATALOG_KINDS = {
+    "src": ("src", "{name}", 3),
+    "med": ("med", "{name}", 2),
+    "camp": ("camp", "{name}", 2),
+    "del": ("delete_item", "❌ Удалить {name}", 1),
+}
+
 
 def build_categories_keyboard(categories: dict) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -13,47 +24,6 @@ def build_categories_keyboard(categories: dict) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def build_category_management_keyboard(category_key: str, items: Sequence[Tuple[str, str]]) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    builder.add(
-        InlineKeyboardButton(
-            text="👁️ Посмотреть все метки",
-            callback_data=f"view_category:{category_key}",
-        )
-    )
-
-    for name, value in items:
-        builder.add(
-            InlineKeyboardButton(
-                text=f"❌ Удалить {name}",
-                callback_data=f"delete_item:{category_key}:{value}",
-            )
-        )
-
-    builder.add(
-        InlineKeyboardButton(
-            text="⬅️ Назад к категориям",
-            callback_data="back_to_categories",
-        )
-    )
-    builder.add(
-        InlineKeyboardButton(
-            text="❌ Выйти",
-            callback_data="exit_add",
-        )
-    )
-    builder.adjust(1)
-    return builder.as_markup()
-
-
-def build_sources_keyboard(sources: Iterable[Tuple[str, str]]) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for name, value in sources:
-        builder.add(InlineKeyboardButton(text=name, callback_data=f"src:{value}"))
-    builder.adjust(3)
-    return builder.as_markup()
-
-
 def build_medium_groups_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="📣 СММ (публикации)", callback_data="medgrp:publications")
@@ -64,15 +34,6 @@ def build_medium_groups_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def build_medium_keyboard(items: Iterable[Tuple[str, str]]) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for name, value in items:
-        builder.add(InlineKeyboardButton(text=name, callback_data=f"med:{value}"))
-    builder.add(InlineKeyboardButton(text="⬅ Назад", callback_data="back:medium"))
-    builder.adjust(2)
-    return builder.as_markup()
-
-
 def build_campaign_groups_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="📍 Санкт-Петербург", callback_data="campgrp:spb")
@@ -84,15 +45,6 @@ def build_campaign_groups_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def build_campaign_keyboard(items: Iterable[Tuple[str, str]]) -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for name, value in items:
-        builder.add(InlineKeyboardButton(text=name, callback_data=f"camp:{value}"))
-    builder.add(InlineKeyboardButton(text="⬅ Назад", callback_data="back:campaign"))
-    builder.adjust(2)
-    return builder.as_markup()
-
-
 def build_date_choice_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="📅 Сегодня", callback_data="adddate:today")
@@ -102,3 +54,133 @@ def build_date_choice_keyboard() -> InlineKeyboardMarkup:
     builder.button(text="❌ Не добавлять дату", callback_data="adddate:none")
     builder.adjust(2)
     return builder.as_markup()
+
+
+def build_result_keyboard() -> InlineKeyboardMarkup:
+    webapp_button = InlineKeyboardButton(
+        text="Открыть API GorBilet",
+        web_app=WebAppInfo(url="https://api.gorbilet.com/v2/admin/"),
+    )
+    return InlineKeyboardMarkup(inline_keyboard=[[webapp_button]])
+
+
+def build_catalog_keyboard(kind: str, category_key: str, page: CatalogPage) -> InlineKeyboardMarkup:
+    """
+    Страница меток каталога. В callback_data уходят только числовые id из
+    индекса каталога, поэтому длина не зависит от значений меток.
+    """
+    prefix, label, columns = CATALOG_KINDS[kind]
+    rows = []
+    for start in range(0, len(page.entries), columns):
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    text=label.format(name=entry.name),
+                    callback_data=f"{prefix}:{entry.entry_id}",
+                )
+                for entry in page.entries[start:start + columns]
+            ]
+        )
+
+    if page.pages > 1:
+        navigation = []
+        if page.page > 0:
+            navigation.append(
+                InlineKeyboardButton(text="⬅️", callback_data=f"cat:{kind}:{category_key}:{page.page - 1}")
+            )
+        navigation.append(
+            InlineKeyboardButton(text=f"{page.page + 1}/{page.pages}", callback_data="cat:noop")
+        )
+        if page.page + 1 < page.pages:
+            navigation.append(
+                InlineKeyboardButton(text="➡️", callback_data=f"cat:{kind}:{category_key}:{page.page + 1}")
+            )
+        rows.append(navigation)
+
+    if page.query:
+        rows.append(
+            [
+                InlineKeyboardButton(text="🔍 Другой поиск", callback_data=f"catf:{kind}:{category_key}"),
+                InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data=f"catf_clear:{kind}:{category_key}"),
+            ]
+        )
+    elif page.pages > 1:
+        rows.append([InlineKeyboardButton(text="🔍 Поиск", callback_data=f"catf:{kind}:{category_key}")])
+
+    if kind == "med":
+        rows.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back:medium")])
+    elif kind == "camp":
+        rows.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back:campaign")])
+    elif kind == "del":
+        rows.append(
+            [InlineKeyboardButton(text="👁️ Посмотреть все метки", callback_data=f"view_category:utm_{category_key}")]
+        )
+        rows.append([InlineKeyboardButton(text="⬅️ Назад к категориям", callback_data="back_to_categories")])
+        rows.append([InlineKeyboardButton(text="❌ Выйти", callback_data="exit_add")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+# Вкладки групп в клавиатуре матрицы: ключ категории -> подпись
+MATRIX_TAB_LABELS = {
+    "source": "Источники",
+    "medium_publications": "📣 Публикации",
+    "medium_mailings": "📧 Рассылка",
+    "medium_stories": "📱 Истории",
+    "medium_channels": "📡 Каналы",
+    "campaign_spb": "📍 СПб",
+    "campaign_msk": "🏙 Москва",
+    "campaign_tr": "✈️ Турист",
+    "campaign_regions": "🌍 Регионы",
+    "campaign_foreign": "🌐 Зарубежье",
+}
+
+
+def build_matrix_keyboard(
+    page: CatalogPage,
+    category_key: str,
+    categories: Sequence[str],
+    selected: Collection[str],
+    next_label: str,
+) -> InlineKeyboardMarkup:
+    """
+    Клавиатура множественного выбора для матрицы: нажатие на метку ставит
+    или снимает ✅, вкладки переключают группы шага.
+    """
+    rows = []
+    if len(categories) > 1:
+        tabs = [
+            InlineKeyboardButton(
+                text=f"• {MATRIX_TAB_LABELS[key]}" if key == category_key else MATRIX_TAB_LABELS[key],
+                callback_data=f"mxcat:{key}",
+            )
+            for key in categories
+        ]
+        rows.extend(tabs[start:start + 3] for start in range(0, len(tabs), 3))
+
+    for start in range(0, len(page.entries), 2):
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    text=f"✅ {entry.name}" if entry.value in selected else entry.name,
+                    callback_data=f"mx:{entry.entry_id}",
+                )
+                for entry in page.entries[start:start + 2]
+            ]
+        )
+
+    if page.pages > 1:
+        navigation = []
+        if page.page > 0:
+            navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"mxpage:{page.page - 1}"))
+        navigation.append(InlineKeyboardButton(text=f"{page.page + 1}/{page.pages}", callback_data="cat:noop"))
+        if page.page + 1 < page.pages:
+            navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"mxpage:{page.page + 1}"))
+        rows.append(navigation)
+
+    rows.append(
+        [
+            InlineKeyboardButton(text=next_label, callback_data="mx_next"),
+            InlineKeyboardButton(text="❌ Отмена", callback_data="mx_cancel"),
+        ]
+    )
+    return InlineKeyboardMarkup(inline_keyboard=rows)
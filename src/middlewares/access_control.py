@@ -3,12 +3,13 @@ from typing import Any, Awaitable, Callable, Dict
 from aiogram import BaseMiddleware
 from aiogram.types import CallbackQuery, Message, TelegramObject
 
-from src.services.database import database
+from src.services.storage import Storage
 
 
 class AccessControlMiddleware(BaseMiddleware):
-    def __init__(self) -> None:
+    def __init__(self, storage: Storage) -> None:
         super().__init__()
+        self.storage = storage
 
     async def __call__(
         self,
@@ -22,7 +23,7 @@ class AccessControlMiddleware(BaseMiddleware):
 
         user_id = from_user.id
 
-        if database.is_user_banned(user_id):
+        if self.storage.is_user_banned(user_id):
             await self._notify_banned(event)
             return None
 
@@ -32,7 +33,7 @@ class AccessControlMiddleware(BaseMiddleware):
         if not flags.get("auth_required", True):
             return await handler(event, data)
 
-        if not database.is_user_authorized(user_id):
+        if not self.storage.is_user_authorized(user_id):
             await self._prompt_for_password(event)
             return None
 
@@ -0,0 +1,47 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from src.utils.deadline import DeadlineExceeded, DeadlineStats, deadline_scope
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineMiddleware(BaseMiddleware):
+    """
+    Выдаёт апдейту бюджет времени: флаг обработчика deadline (секунды) или
+    default_seconds. Этапы внутри обработчика расходуют его через
+    within_deadline. Ноль — без бюджета.
+    """
+
+    def __init__(self, default_seconds: float, stats: DeadlineStats) -> None:
+        super().__init__()
+        self.default_seconds = default_seconds
+        self.stats = stats
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        flags = getattr(handler_object, "flags", {})
+        seconds = flags.get("deadline", self.default_seconds)
+        if not seconds:
+            return await handler(event, data)
+
+        callback = getattr(handler_object, "callback", None)
+        handler_name = getattr(callback, "__qualname__", "unknown")
+        with deadline_scope(seconds) as deadline:
+            try:
+                return await handler(event, data)
+            except DeadlineExceeded as exc:
+                # Обработчик не предусмотрел запасной ответ для этого этапа
+                logger.warning("Deadline of %.1fs exceeded in %s at %s stage", seconds, handler_name, exc.stage)
+                return None
+            finally:
+                self.stats.record(handler_name, deadline)
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(event: TelegramObject) -> str:
+    if not isinstance(event, Update):
+        return type(event).__name__
+    try:
+        return f"update {event.update_id} ({event.event_type})"
+    except Exception:
+        return f"update {event.update_id}"
+
+
+class InFlightTracker(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: помнит, какие апдейты сейчас обрабатываются,
+    чтобы при остановке дождаться их. После close() новые апдейты отбрасываются.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.accepting = True
+        self._tasks: Dict[asyncio.Task, Tuple[TelegramObject, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.accepting:
+            logger.warning("Dropping %s received during shutdown", _describe(event))
+            return None
+        task = asyncio.current_task()
+        self._tasks[task] = (event, time.monotonic())
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.pop(task, None)
+
+    def close(self) -> None:
+        self.accepting = False
+
+    async def drain(self, timeout: float) -> List[str]:
+        """
+        Ждёт обработки текущих апдейтов не дольше timeout секунд, оставшиеся
+        отменяет. Возвращает описания брошенных апдейтов.
+        """
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        abandoned = []
+        now = time.monotonic()
+        for task, (event, started) in list(self._tasks.items()):
+            abandoned.append(f"{_describe(event)}, running {now - started:.1f}s")
+            task.cancel()
+        if abandoned:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        return abandoned
@@ -0,0 +1,31 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from src.services.profiler import UpdateProfiler
+
+
+class SlowUpdateProfilerMiddleware(BaseMiddleware):
+    """
+    Замеряет обработку апдейта вместе с вложенными спанами БД и сокращателя.
+    Регистрируется только при PROFILER_ENABLED, так что без него накладных расходов нет.
+    """
+
+    def __init__(self, profiler: UpdateProfiler) -> None:
+        super().__init__()
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        handler_name = getattr(callback, "__qualname__", "unknown")
+        update = data.get("event_update")
+        update_type = update.event_type if update is not None else type(event).__name__
+        with self.profiler.track(handler_name, update_type):
+            return await handler(event, data)
@@ -0,0 +1,155 @@
+import asyncio
+import hmac
+import logging
+import math
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from src.config import settings
+from src.services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+SettingValue = Union[bool, int, float]
+PASSWORD_KEY = "bot_password"
+
+_TRUE_WORDS = {"1", "true", "on", "yes", "да", "вкл"}
+_FALSE_WORDS = {"0", "false", "off", "no", "нет", "выкл"}
+
+
+class TunableSetting(NamedTuple):
+    key: str
+    label: str
+    kind: type
+    default: SettingValue
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+# Параметры, которые можно менять из меню настроек без перезапуска.
+# Значения по умолчанию берутся из окружения, изменённые хранятся в app_settings
+TUNABLE_SETTINGS: Tuple[TunableSetting, ...] = (
+    TunableSetting(
+        "broadcast_rate_per_second", "Рассылка: сообщений в секунду", float,
+        settings.broadcast_rate_per_second, 0.1, 30.0,
+    ),
+    TunableSetting(
+        "broadcast_max_in_flight", "Рассылка: одновременных отправок", int,
+        settings.broadcast_max_in_flight, 1, 100,
+    ),
+    TunableSetting(
+        "shortener_hedging_enabled", "Сокращатель: запасной запрос", bool,
+        settings.shortener_hedging_enabled,
+    ),
+    TunableSetting(
+        "shortener_hedge_delay_seconds", "Сокращатель: начальная задержка запасного запроса, с", float,
+        settings.shortener_hedge_delay_seconds, 0.1, 30.0,
+    ),
+    TunableSetting(
+        "shorten_retry_max_attempts", "Очередь повторов: попыток", int,
+        settings.shorten_retry_max_attempts, 1, 100,
+    ),
+    TunableSetting(
+        "profiler_threshold_ms", "Профайлер: порог медленного апдейта, мс", float,
+        settings.profiler_threshold_ms, 1.0, 600000.0,
+    ),
+    TunableSetting(
+        "profiler_sample_rate", "Профайлер: доля апдейтов под cProfile", float,
+        settings.profiler_sample_rate, 0.0, 1.0,
+    ),
+)
+TUNABLES_BY_KEY: Dict[str, TunableSetting] = {setting.key: setting for setting in TUNABLE_SETTINGS}
+
+
+def parse_value(setting: TunableSetting, raw: str) -> SettingValue:
+    """Разбирает текстовое значение параметра, при ошибке выбрасывает ValueError с текстом для пользователя"""
+    text = raw.strip().casefold()
+    if setting.kind is bool:
+        if text in _TRUE_WORDS:
+            return True
+        if text in _FALSE_WORDS:
+            return False
+        raise ValueError("ожидается «да» или «нет»")
+    try:
+        value = setting.kind(text.replace(",", "."))
+    except ValueError:
+        raise ValueError("ожидается целое число" if setting.kind is int else "ожидается число") from None
+    if not math.isfinite(value):
+        raise ValueError("ожидается число")
+    if setting.minimum is not None and value < setting.minimum:
+        raise ValueError(f"значение должно быть не меньше {setting.minimum:g}")
+    if setting.maximum is not None and value > setting.maximum:
+        raise ValueError(f"значение должно быть не больше {setting.maximum:g}")
+    return value
+
+
+def format_value(value: SettingValue) -> str:
+    if isinstance(value, bool):
+        return "вкл" if value else "выкл"
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+def _serialize(value: SettingValue) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(value)
+
+
+class RuntimeSettings:
+    """
+    Настройки из таблицы app_settings, загруженные в память один раз при
+    старте. Запись идёт сквозь кеш: сначала в базу, затем в память и
+    подписчикам, поэтому чтение (в том числе проверка пароля) не трогает БД.
+    """
+
+    def __init__(self, db: Storage) -> None:
+        self.db = db
+        self._password = settings.bot_access_password
+        self._values: Dict[str, SettingValue] = {}
+        self._subscribers: Dict[str, List[Callable[[SettingValue], None]]] = {}
+        self.load()
+
+    def load(self) -> None:
+        stored = self.db.get_app_settings()
+        self._password = stored.get(PASSWORD_KEY, settings.bot_access_password)
+        values: Dict[str, SettingValue] = {}
+        for setting in TUNABLE_SETTINGS:
+            raw = stored.get(setting.key)
+            values[setting.key] = setting.default
+            if raw is None:
+                continue
+            try:
+                values[setting.key] = parse_value(setting, raw)
+            except ValueError as exc:
+                logger.warning("Ignoring stored setting %s=%r: %s", setting.key, raw, exc)
+        self._values = values
+
+    def check_password(self, candidate: str) -> bool:
+        return hmac.compare_digest(candidate.encode("utf-8"), self._password.encode("utf-8"))
+
+    async def update_bot_password(self, new_password: str) -> None:
+        await asyncio.to_thread(self.db.set_app_setting, PASSWORD_KEY, new_password)
+        self._password = new_password
+
+    def get(self, key: str) -> SettingValue:
+        return self._values[key]
+
+    def items(self) -> List[Tuple[TunableSetting, SettingValue]]:
+        return [(setting, self._values[setting.key]) for setting in TUNABLE_SETTINGS]
+
+    async def set(self, key: str, value: SettingValue) -> None:
+        await asyncio.to_thread(self.db.set_app_setting, key, _serialize(value))
+        self._values[key] = value
+        logger.info("Runtime setting %s changed to %r", key, value)
+        for callback in self._subscribers.get(key, ()):
+            try:
+                callback(value)
+            except Exception:
+                logger.exception("Failed to apply runtime setting %s", key)
+
+    def subscribe(self, key: str, callback: Callable[[SettingValue], None]) -> None:
+        """Сразу применяет текущее значение и повторяет это при каждом изменении"""
+        self._subscribers.setdefault(key, []).append(callback)
+        callback(self._values[key])
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+from src.services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторяется отправка одному пользователю после RetryAfter
+MAX_RETRY_AFTER = 3
+
+
+class RatePacer:
+    """Равномерно распределяет отправки: не чаще rate в секунду на весь процесс"""
+
+    def __init__(self, rate: float) -> None:
+        self.set_rate(rate)
+        self._next_at = 0.0
+
+    def set_rate(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+
+    async def wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_at)
+        self._next_at = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        # Telegram попросил подождать: сдвигаем все следующие отправки
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self._next_at = max(self._next_at, resume_at)
+
+
+class Broadcaster:
+    """
+    Рассылка всем авторизованным пользователям. Получатели читаются порциями
+    по user_id, после каждой порции прогресс сохраняется в broadcasts, поэтому
+    прерванная рассылка продолжается с места остановки (повторно может уйти
+    не больше одной порции). Заблокировавшие бота помечаются и пропускаются.
+    """
+
+    def __init__(self, db: Storage, rate: float, batch_size: int, max_in_flight: int) -> None:
+        self.db = db
+        self.pacer = RatePacer(rate)
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: set = set()
+
+    def running(self) -> Optional[int]:
+        for broadcast_id, task in self._tasks.items():
+            if not task.done():
+                return broadcast_id
+        return None
+
+    async def start(self, bot: Bot, text: str, created_by: int) -> int:
+        broadcast_id = await asyncio.to_thread(self.db.create_broadcast, text, created_by)
+        self._spawn(bot, broadcast_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot) -> None:
+        for row in await asyncio.to_thread(self.db.list_running_broadcasts):
+            logger.info("Resuming broadcast %s after user %s", row["id"], row["last_user_id"])
+            self._spawn(bot, int(row["id"]))
+
+    def cancel(self, broadcast_id: int) -> None:
+        self._cancelled.add(broadcast_id)
+
+    async def shutdown(self) -> None:
+        """Прерывает идущие рассылки при остановке бота: они продолжатся после запуска"""
+        interrupted = {broadcast_id: task for broadcast_id, task in self._tasks.items() if not task.done()}
+        for task in interrupted.values():
+            task.cancel()
+        await asyncio.gather(*interrupted.values(), return_exceptions=True)
+        for broadcast_id in interrupted:
+            logger.warning("Broadcast %s interrupted by shutdown, it will resume after restart", broadcast_id)
+
+    def _spawn(self, bot: Bot, broadcast_id: int) -> None:
+        self._tasks[broadcast_id] = asyncio.create_task(self.run(bot, broadcast_id))
+
+    async def _send(self, bot: Bot, user_id: int, text: str, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            for _ in range(MAX_RETRY_AFTER):
+                await self.pacer.wait()
+                try:
+                    await bot.send_message(user_id, text)
+                    return "sent"
+                except TelegramRetryAfter as exc:
+                    logger.warning("Broadcast throttled by Telegram for %s s", exc.retry_after)
+                    self.pacer.pause(exc.retry_after)
+                except TelegramForbiddenError:
+                    return "blocked"
+                except TelegramAPIError as exc:
+                    logger.warning("Broadcast message to %s failed: %s", user_id, exc)
+                    return "failed"
+            return "failed"
+
+    async def run(self, bot: Bot, broadcast_id: int) -> None:
+        try:
+            await self._run(bot, broadcast_id)
+        except Exception:
+            # Без этого упавшая задача молча оставила бы рассылку в статусе running:
+            # она висела бы в «идущих» и возобновлялась бы при каждом запуске
+            logger.exception("Broadcast %s failed", broadcast_id)
+            self._cancelled.discard(broadcast_id)
+            try:
+                await asyncio.to_thread(self.db.finish_broadcast, broadcast_id, "failed")
+            except Exception:
+                logger.exception("Could not mark broadcast %s as failed", broadcast_id)
+
+    async def _run(self, bot: Bot, broadcast_id: int) -> None:
+        row = await asyncio.to_thread(self.db.get_broadcast, broadcast_id)
+        if row is None:
+            return
+        text = row["text"]
+        last_user_id = int(row["last_user_id"])
+
+        while True:
+            if broadcast_id in self._cancelled:
+                status = "cancelled"
+                break
+            recipients = await asyncio.to_thread(
+                self.db.get_broadcast_recipients, last_user_id, self.batch_size
+            )
+            if not recipients:
+                status = "done"
+                break
+            # Лимит перечитывается на каждую порцию: изменение в «Параметрах работы»
+            # действует на идущую рассылку со следующей порции
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            results = await asyncio.gather(
+                *(self._send(bot, user_id, text, semaphore) for user_id in recipients)
+            )
+            blocked = [user_id for user_id, result in zip(recipients, results) if result == "blocked"]
+            last_user_id = recipients[-1]
+            await asyncio.to_thread(
+                self.db.record_broadcast_batch,
+                broadcast_id,
+                last_user_id,
+                results.count("sent"),
+                results.count("failed"),
+                blocked,
+            )
+
+        await asyncio.to_thread(self.db.finish_broadcast, broadcast_id, status)
+        self._cancelled.discard(broadcast_id)
+        summary = await asyncio.to_thread(self.db.get_broadcast, broadcast_id)
+        logger.info(
+            "Broadcast %s %s: sent=%s failed=%s blocked=%s",
+            broadcast_id,
+            status,
+            summary["sent"],
+            summary["failed"],
+            summary["blocked"],
+        )
+        try:
+            await bot.send_message(
+                summary["created_by"],
+                f"📢 Рассылка #{broadcast_id} {'завершена' if status == 'done' else 'остановлена'}.\n"
+                f"Доставлено: {summary['sent']}\n"
+                f"Ошибок: {summary['failed']}\n"
+                f"Заблокировали бота: {summary['blocked']}",
+            )
+        except TelegramAPIError:
+            logger.warning("Could not report broadcast %s result to %s", broadcast_id, summary["created_by"])
@@ -0,0 +1,166 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+_SEPARATORS = re.compile(r"[\W_]+", re.UNICODE)
+# Сколько токенов-кандидатов по триграммам проверяется расстоянием Левенштейна
+FUZZY_CANDIDATES = 300
+
+
+def normalize(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова названия или значения: «Пост Москва» -> [пост, москва], post_msk -> [post, msk]"""
+    return [token for token in _SEPARATORS.split(normalize(text)) if token]
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def max_typos(length: int) -> int:
+    if length <= 2:
+        return 0
+    if length <= 5:
+        return 1
+    return 2
+
+
+def prefix_distance(query: str, token: str, limit: int) -> Optional[int]:
+    """
+    Наименьшее расстояние Левенштейна между query и каким-либо префиксом token,
+    или None, если оно больше limit (строки после ранней остановки не считаются).
+    """
+    previous = list(range(len(token) + 1))
+    for row, query_char in enumerate(query, start=1):
+        current = [row]
+        for column, token_char in enumerate(token, start=1):
+            current.append(
+                min(
+                    previous[column] + 1,
+                    current[column - 1] + 1,
+                    previous[column - 1] + (query_char != token_char),
+                )
+            )
+        if min(current) > limit:
+            return None
+        previous = current
+    best = min(previous)
+    return best if best <= limit else None
+
+
+class CatalogSearchIndex:
+    """
+    Поиск меток по словам названий и значений: префиксный (отсортированный
+    список токенов + bisect) и с опечатками (триграммы токенов -> кандидаты,
+    затем расстояние Левенштейна до префикса). Все структуры обновляются
+    поштучно при добавлении и удалении метки.
+    """
+
+    def __init__(self) -> None:
+        self._entry_tokens: Dict[int, Tuple[str, ...]] = {}
+        self._token_entries: Dict[str, Set[int]] = {}
+        self._sorted_tokens: List[str] = []
+        self._trigram_tokens: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entry_tokens)
+
+    def add(self, entry_id: int, name: str, value: str) -> None:
+        if entry_id in self._entry_tokens:
+            self.remove(entry_id)
+        tokens = tuple(dict.fromkeys(tokenize(name) + tokenize(value)))
+        self._entry_tokens[entry_id] = tokens
+        for token in tokens:
+            entries = self._token_entries.get(token)
+            if entries is None:
+                entries = self._token_entries[token] = set()
+                insort(self._sorted_tokens, token)
+                for trigram in _trigrams(token):
+                    self._trigram_tokens.setdefault(trigram, set()).add(token)
+            entries.add(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        for token in self._entry_tokens.pop(entry_id, ()):
+            entries = self._token_entries[token]
+            entries.discard(entry_id)
+            if entries:
+                continue
+            del self._token_entries[token]
+            del self._sorted_tokens[bisect_left(self._sorted_tokens, token)]
+            for trigram in _trigrams(token):
+                tokens = self._trigram_tokens[trigram]
+                tokens.discard(token)
+                if not tokens:
+                    del self._trigram_tokens[trigram]
+
+    def _prefix_tokens(self, prefix: str) -> Iterable[str]:
+        index = bisect_left(self._sorted_tokens, prefix)
+        while index < len(self._sorted_tokens) and self._sorted_tokens[index].startswith(prefix):
+            yield self._sorted_tokens[index]
+            index += 1
+
+    def _fuzzy_tokens(self, query: str) -> Dict[str, int]:
+        limit = max_typos(len(query))
+        if limit == 0:
+            return {}
+        shared: Counter = Counter()
+        for trigram in _trigrams(query):
+            shared.update(self._trigram_tokens.get(trigram, ()))
+        matches: Dict[str, int] = {}
+        for token, _ in shared.most_common(FUZZY_CANDIDATES):
+            distance = prefix_distance(query, token, limit)
+            if distance is not None:
+                matches[token] = distance
+        return matches
+
+    def _term_matches(self, term: str, fuzzy: bool) -> Dict[int, int]:
+        """entry_id -> штраф за слово запроса (0 — точный префикс)"""
+        penalties: Dict[int, int] = {}
+        if fuzzy:
+            for token, distance in self._fuzzy_tokens(term).items():
+                for entry_id in self._token_entries[token]:
+                    if distance < penalties.get(entry_id, distance + 1):
+                        penalties[entry_id] = distance
+        for token in self._prefix_tokens(term):
+            for entry_id in self._token_entries[token]:
+                penalties[entry_id] = 0
+        return penalties
+
+    def _score(self, terms: List[str], fuzzy: bool) -> Dict[int, int]:
+        scores: Optional[Dict[int, int]] = None
+        for term in terms:
+            matches = self._term_matches(term, fuzzy)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {
+                    entry_id: penalty + matches[entry_id]
+                    for entry_id, penalty in scores.items()
+                    if entry_id in matches
+                }
+            if not scores:
+                return {}
+        return scores or {}
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[int]:
+        """
+        Идентификаторы меток, у которых каждое слово запроса совпадает с началом
+        какого-либо слова метки (допуская опечатки). Сначала точные совпадения.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        scores = self._score(terms, fuzzy=False)
+        # Если точных совпадений хватает на ответ, опечатки не ищем: они ранжируются ниже
+        if limit is None or len(scores) < limit:
+            scores = self._score(terms, fuzzy=True)
+        if limit is None:
+            return sorted(scores, key=lambda entry_id: (scores[entry_id], entry_id))
+        return heapq.nsmallest(limit, scores, key=lambda entry_id: (scores[entry_id], entry_id))
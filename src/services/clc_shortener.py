@@ -1,43 +1,60 @@
 import aiohttp
 import logging
+from typing import Optional
 
-async def shorten_url(long_url: str, api_key: str) -> str:
+CLC_API_ENDPOINT = "https://clc.li/api/url/add"
+
+
+async def shorten_url(
+    long_url: str,
+    api_key: str,
+    session: Optional[aiohttp.ClientSession] = None,
+    api_endpoint: str = CLC_API_ENDPOINT,
+) -> str:
     """
     Отправляет длинную ссылку в API сервиса clc.li для сокращения.
     Тело запроса содержит ключ 'url'.
     Возвращает короткую ссылку из полей 'short', 'shorturl', 'data.short' или 'url.shorturl'.
     Логирует ошибки HTTP и ошибки, указанные в поле 'error' ответа.
     Возвращает None в случае ошибки.
+    Если передана сессия, запрос идёт через неё, иначе создаётся временная.
     """
-    api_endpoint = "https://clc.li/api/url/add"
+    try:
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                return await _request_short_url(own_session, api_endpoint, long_url, api_key)
+        return await _request_short_url(session, api_endpoint, long_url, api_key)
+    except Exception as e:
+        logging.exception("Exception during shorten_url call")
+        return None
+
+
+async def _request_short_url(
+    session: aiohttp.ClientSession, api_endpoint: str, long_url: str, api_key: str
+) -> Optional[str]:
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
     data = {"url": long_url}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_endpoint, headers=headers, json=data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    if result.get("error", 0) != 0:
-                        logging.error(f"CLC API logical error: {result}")
-                        return None
-                    short_url = None
-                    if "short" in result:
-                        short_url = result["short"]
-                    elif "shorturl" in result:
-                        short_url = result["shorturl"]
-                    elif "data" in result and "short" in result["data"]:
-                        short_url = result["data"]["short"]
-                    elif "url" in result and "shorturl" in result["url"]:
-                        short_url = result["url"]["shorturl"]
-                    return short_url
-                else:
-                    err_text = await response.text()
-                    logging.error(f"CLC API HTTP error {response.status}: {err_text}")
-                    return None
-    except Exception as e:
-        logging.exception("Exception during shorten_url call")
-        return None
\ No newline at end of file
+    async with session.post(api_endpoint, headers=headers, json=data) as response:
+        if response.status == 200:
+            result = await response.json()
+            if result.get("error", 0) != 0:
+                logging.error(f"CLC API logical error: {result}")
+                return None
+            short_url = None
+            if "short" in result:
+                short_url = result["short"]
+            elif "shorturl" in result:
+                short_url = result["shorturl"]
+            elif "data" in result and "short" in result["data"]:
+                short_url = result["data"]["short"]
+            elif "url" in result and "shorturl" in result["url"]:
+                short_url = result["url"]["shorturl"]
+            return short_url
+        else:
+            err_text = await response.text()
+            logging.error(f"CLC API HTTP error {response.status}: {err_text}")
+            return None
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict
+
+from src.services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClickCounter:
+    """
+    Счётчик переходов по коротким ссылкам. Клик — это инкремент в памяти,
+    в базу счётчики уходят пачкой раз в flush_interval секунд,
+    поэтому при падении теряется не больше одного интервала.
+    """
+
+    def __init__(self, db: Storage, flush_interval: float) -> None:
+        self.db = db
+        self.flush_interval = flush_interval
+        self._pending: Counter = Counter()
+
+    def record(self, link_id: int) -> None:
+        self._pending[link_id] += 1
+
+    def pending(self, link_id: int) -> int:
+        return self._pending.get(link_id, 0)
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        # Подменяем буфер целиком: клики, пришедшие во время записи, попадут в следующую пачку
+        batch: Dict[int, int] = dict(self._pending)
+        self._pending = Counter()
+        try:
+            await asyncio.to_thread(self.db.add_link_clicks, batch, datetime.utcnow().isoformat())
+        except Exception:
+            self._pending.update(batch)
+            raise
+        return sum(batch.values())
+
+    async def run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Click counter flush failed")
@@ -0,0 +1,84 @@
+from typing import NamedTuple
+
+from src.config import settings
+from src.services.app_settings import RuntimeSettings
+from src.services.broadcast import Broadcaster
+from src.services.click_counter import ClickCounter
+from src.services.health import HealthService, loop_lag_monitor, poll_tracker
+from src.services.history_archive import history_archive
+from src.services.maintenance import HistoryMaintenance
+from src.services.matrix import MatrixGenerator
+from src.services.retry_queue import ShortenRetryQueue
+from src.services.self_shortener import SelfHostedShortener
+from src.services.shorteners import HedgedShortener, build_shortener
+from src.services.storage import Storage
+from src.utils.deadline import deadline_stats
+
+
+class Services(NamedTuple):
+    """
+    Сервисы, работающие поверх хранилища. Собираются один раз при запуске
+    и попадают в обработчики именованными аргументами через workflow data
+    диспетчера (storage, broadcaster, shortener, …).
+    """
+
+    storage: Storage
+    runtime_settings: RuntimeSettings
+    self_shortener: SelfHostedShortener
+    shortener: HedgedShortener
+    click_counter: ClickCounter
+    shorten_retry_queue: ShortenRetryQueue
+    broadcaster: Broadcaster
+    matrix_generator: MatrixGenerator
+    history_maintenance: HistoryMaintenance
+    health_service: HealthService
+
+
+def build_services(storage: Storage) -> Services:
+    self_shortener = SelfHostedShortener(
+        storage,
+        settings.short_link_base_url,
+        cache_size=settings.short_link_cache_size,
+    )
+    shortener = build_shortener(self_shortener)
+    return Services(
+        storage=storage,
+        runtime_settings=RuntimeSettings(storage),
+        self_shortener=self_shortener,
+        shortener=shortener,
+        click_counter=ClickCounter(storage, settings.click_flush_interval_seconds),
+        shorten_retry_queue=ShortenRetryQueue(
+            storage,
+            shortener,
+            base_delay=settings.shorten_retry_base_delay_seconds,
+            max_delay=settings.shorten_retry_max_delay_seconds,
+            max_attempts=settings.shorten_retry_max_attempts,
+            poll_interval=settings.shorten_retry_poll_seconds,
+        ),
+        broadcaster=Broadcaster(
+            storage,
+            rate=settings.broadcast_rate_per_second,
+            batch_size=settings.broadcast_batch_size,
+            max_in_flight=settings.broadcast_max_in_flight,
+        ),
+        matrix_generator=MatrixGenerator(
+            shortener,
+            storage,
+            concurrency=settings.matrix_concurrency,
+            cache_size=settings.matrix_cache_size,
+        ),
+        history_maintenance=HistoryMaintenance(
+            storage,
+            history_archive,
+            retention_days=settings.history_retention_days,
+            interval_seconds=settings.maintenance_interval_seconds,
+        ),
+        health_service=HealthService(
+            storage,
+            loop_lag_monitor,
+            poll_tracker,
+            deadline_stats,
+            poll_max_age=settings.readiness_poll_max_age_seconds,
+            db_timeout=settings.readiness_db_timeout_seconds,
+        ),
+    )
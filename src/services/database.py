@@ -1,166 +1,477 @@
+import hashlib
+import logging
+import queue
 import sqlite3
 import threading
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from src.config import settings
-
-
-class DatabaseManager:
-    def __init__(self, db_path: str) -> None:
+from src.services.migrations import run_migrations
+from src.services.profiler import SpanLock, span
+from src.services.storage import SEARCH_CANDIDATE_LIMIT, USER_LISTS, InMemoryStorage, Storage
+from src.services.utm_builder import build_from_parsed, extract_utm_params, parse_url
+from src.utils.utm import extract_action_slug
+
+
+logger = logging.getLogger(__name__)
+
+# UTM-компоненты, которые хранятся в history отдельными ссылками на utm_values
+HISTORY_UTM_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("utm_source", "source_id"),
+    ("utm_medium", "medium_id"),
+    ("utm_campaign", "campaign_id"),
+    ("utm_content", "content_id"),
+)
+# Максимум строк, удаляемых за одно удержание блокировки
+DELETE_BATCH_SIZE = 500
+# Кеш подготовленных выражений на соединение: постоянных запросов около 70,
+# остальное — варианты IN (?, ...) с разным числом параметров
+STATEMENT_CACHE_SIZE = 256
+
+
+def _build_match_query(terms: str) -> str:
+    # Каждое слово — строка FTS5 с префиксным поиском; все слова должны совпасть
+    tokens = [token.replace('"', '""') for token in terms.split()]
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def _url_hash(url: str) -> int:
+    digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class ReadConnectionPool:
+    """
+    Ограниченный пул соединений только для чтения. В режиме WAL читатели
+    не ждут писателя и друг друга; соединения открываются по мере нужды,
+    но не больше size одновременно.
+    """
+
+    def __init__(self, db_path: Path, size: int) -> None:
+        self.db_path = db_path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    def close(self) -> None:
+        # Занятые соединения закроются при возврате в пул
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class DatabaseManager(Storage):
+    def __init__(self, db_path: str, read_pool_size: int = 4) -> None:
         self.db_path = Path(db_path)
         if not self.db_path.parent.exists():
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
-        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
-        self._connection.row_factory = sqlite3.Row
-        self._lock = threading.Lock()
-        self._setup()
-
-    def _setup(self) -> None:
-        users_table = """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            authorized_at TEXT NOT NULL
+        # Единственное пишущее соединение; чтения идут через пул self._readers
+        self._connection = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
         )
+        self._connection.row_factory = sqlite3.Row
+        self._lock = SpanLock("db")
+        with self._lock:
+            run_migrations(self, self._connection)
+            # WAL сохраняется в файле базы; при нём NORMAL не теряет целостность при сбое
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._readers = ReadConnectionPool(self.db_path, read_pool_size)
+
+    def close(self) -> None:
+        self._readers.close()
+        # Дожидаемся текущей записи; при закрытии последнего соединения SQLite
+        # переносит WAL в основной файл и удаляет -wal/-shm
+        with self._lock:
+            self._connection.close()
+
+    def ping(self, timeout: float) -> int:
+        # Отдельное соединение только на чтение: проверка не ждёт self._lock,
+        # который может держать долгий запрос
+        uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False)
+        try:
+            return int(connection.execute("PRAGMA user_version").fetchone()[0])
+        finally:
+            connection.close()
+
+    def is_user_authorized(self, user_id: int) -> bool:
+        query = "SELECT 1 FROM users WHERE user_id = ?"
+        return self._exists(query, (user_id,))
+
+    def authorize_user(self, user_id: int, username: Optional[str]) -> None:
+        now = datetime.utcnow().isoformat()
+        query = """
+        INSERT INTO users (user_id, username, authorized_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, bot_blocked_at = NULL
         """
+        self._execute(query, (user_id, username, now))
+        self.reset_auth_attempts(user_id)
 
-        banned_table = """
-        CREATE TABLE IF NOT EXISTS banned_users (
-            user_id INTEGER PRIMARY KEY,
-            banned_at TEXT NOT NULL,
-            reason TEXT
-        )
+    def is_user_banned(self, user_id: int) -> bool:
+        query = "SELECT 1 FROM banned_users WHERE user_id = ?"
+        return self._exists(query, (user_id,))
+
+    def ban_user(self, user_id: int, username: Optional[str], reason: str | None = None) -> None:
+        now = datetime.utcnow().isoformat()
+        query = """
+        INSERT OR IGNORE INTO banned_users (user_id, username, banned_at, reason)
+        VALUES (?, ?, ?, ?)
         """
+        self._execute(query, (user_id, username, now, reason))
+        self.reset_auth_attempts(user_id)
 
-        attempts_table = """
-        CREATE TABLE IF NOT EXISTS auth_attempts (
-            user_id INTEGER PRIMARY KEY,
-            attempts INTEGER NOT NULL DEFAULT 0
+    def add_history(self, user_id: int, base_url: str, utm_url: str, short_url: str) -> None:
+        now = datetime.utcnow().isoformat()
+        query = """
+        INSERT INTO history (
+            user_id, base_url_id, utm_url_id, short_url_id,
+            source_id, medium_id, campaign_id, content_id, slug_id, created_at
         )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
+        with self._lock:
+            cursor = self._connection.cursor()
+            refs = self._history_refs(cursor, base_url, utm_url, short_url)
+            cursor.execute(query, (user_id,) + refs + (now,))
+            history_id = cursor.lastrowid
+            cursor.execute(f"{self._HISTORY_SELECT} WHERE h.id = ?", (history_id,))
+            cursor.execute(self._SEARCH_INSERT, self._search_values(cursor.fetchone()))
+            self._connection.commit()
 
-        settings_table = """
-        CREATE TABLE IF NOT EXISTS app_settings (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
+    def search_history(self, user_id: int, terms: str, limit: int, offset: int = 0) -> List[dict]:
+        match_query = _build_match_query(terms)
+        if not match_query:
+            return []
+        # Ранжируются только самые свежие совпадения пользователя, чтобы общий
+        # запрос вроде «gorbilet» не сортировал всю историю
+        query = f"""
+        WITH matches AS (
+            SELECT history_search.rowid AS id, bm25(history_search) AS score
+            FROM history_search
+            JOIN history ON history.id = history_search.rowid
+            WHERE history_search MATCH ? AND history.user_id = ?
+            ORDER BY history_search.rowid DESC
+            LIMIT ?
         )
+        {self._HISTORY_SELECT}
+        JOIN matches ON matches.id = h.id
+        ORDER BY matches.score, h.id DESC
+        LIMIT ? OFFSET ?
         """
+        rows = self._fetchall(query, (match_query, user_id, SEARCH_CANDIDATE_LIMIT, limit, offset))
+        return [self._history_record(row) for row in rows]
 
-        history_table = """
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            base_url TEXT NOT NULL,
-            utm_url TEXT NOT NULL,
-            short_url TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
+    def get_history(self, user_id: int, limit: int = 50) -> List[Tuple[str, str, str]]:
+        query = f"""
+        {self._HISTORY_SELECT}
+        WHERE h.user_id = ?
+        ORDER BY h.id DESC
+        LIMIT ?
+        """
+        rows = self._fetchall(query, (user_id, limit))
+        return [self._history_row(row) for row in rows]
+
+    def get_history_before(self, cutoff: str, limit: int) -> List[dict]:
+        query = f"""
+        {self._HISTORY_SELECT}
+        WHERE h.created_at < ?
+        ORDER BY h.id
+        LIMIT ?
+        """
+        rows = self._fetchall(query, (cutoff, limit))
+        return [self._history_record(row) for row in rows]
+
+    def iter_history_records(self, user_id: int, batch_size: int = DELETE_BATCH_SIZE) -> Iterator[dict]:
+        query = f"""
+        {self._HISTORY_SELECT}
+        WHERE h.user_id = ? AND h.id > ?
+        ORDER BY h.id
+        LIMIT ?
         """
+        last_id = 0
+        while True:
+            rows = self._fetchall(query, (user_id, last_id, batch_size))
+            if not rows:
+                return
+            for row in rows:
+                yield self._history_record(row)
+            last_id = rows[-1]["id"]
+
+    def delete_history_ids(self, history_ids: Sequence[int]) -> int:
+        deleted = 0
+        for start in range(0, len(history_ids), DELETE_BATCH_SIZE):
+            batch = list(history_ids[start:start + DELETE_BATCH_SIZE])
+            with self._lock:
+                cursor = self._connection.cursor()
+                deleted += self._delete_history_batch(cursor, batch)
+                self._connection.commit()
+        return deleted
+
+    def incremental_vacuum_enabled(self) -> bool:
+        rows = self._fetchall("PRAGMA auto_vacuum", ())
+        return int(rows[0][0]) == 2  # INCREMENTAL
 
+    def incremental_vacuum(self, pages: int) -> int:
         with self._lock:
-            cursor = self._connection.cursor()
-            cursor.execute(users_table)
-            cursor.execute(banned_table)
-            cursor.execute(attempts_table)
-            cursor.execute(settings_table)
-            cursor.execute(history_table)
+            self._connection.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
             self._connection.commit()
+            return int(self._connection.execute("PRAGMA freelist_count").fetchone()[0])
 
-        self._ensure_column("users", "username", "TEXT")
-        self._ensure_column("banned_users", "username", "TEXT")
-        self._ensure_default_password()
+    def optimize(self) -> None:
+        with self._lock:
+            self._connection.execute("PRAGMA optimize")
+            self._connection.commit()
 
-    def _ensure_column(self, table: str, column: str, definition: str) -> None:
+    def allocate_sequence(self, name: str, count: int) -> range:
+        query = """
+        UPDATE sequences
+        SET next_value = next_value + ?
+        WHERE name = ?
+        RETURNING next_value
+        """
         with self._lock:
             cursor = self._connection.cursor()
-            cursor.execute(f"PRAGMA table_info({table})")
-            columns = {row["name"] for row in cursor.fetchall()}
-            if column not in columns:
-                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-                self._connection.commit()
+            cursor.execute(query, (count, name))
+            row = cursor.fetchone()
+            self._connection.commit()
+        if row is None:
+            raise KeyError(f"Unknown sequence: {name}")
+        end = int(row["next_value"])
+        return range(end - count, end)
 
-    def _ensure_default_password(self) -> None:
+    def add_short_link(self, link_id: int, target_url: str) -> None:
+        now = datetime.utcnow().isoformat()
         with self._lock:
             cursor = self._connection.cursor()
             cursor.execute(
-                "SELECT value FROM app_settings WHERE key = ?", ("bot_password",)
+                "INSERT INTO short_links (id, target_url_id, created_at) VALUES (?, ?, ?)",
+                (link_id, self._intern_url(cursor, target_url), now),
             )
-            if cursor.fetchone() is None:
-                cursor.execute(
-                    "INSERT INTO app_settings (key, value) VALUES (?, ?)",
-                    ("bot_password", settings.bot_access_password),
-                )
-                self._connection.commit()
+            self._connection.commit()
 
-    def is_user_authorized(self, user_id: int) -> bool:
-        query = "SELECT 1 FROM users WHERE user_id = ?"
-        return self._exists(query, (user_id,))
+    def get_short_link_target(self, link_id: int) -> Optional[str]:
+        query = """
+        SELECT urls.url
+        FROM short_links
+        JOIN urls ON urls.id = short_links.target_url_id
+        WHERE short_links.id = ?
+        """
+        rows = self._fetchall(query, (link_id,))
+        return str(rows[0]["url"]) if rows else None
 
-    def authorize_user(self, user_id: int, username: Optional[str]) -> None:
-        now = datetime.utcnow().isoformat()
+    def add_link_clicks(self, clicks: Dict[int, int], clicked_at: str) -> None:
         query = """
-        INSERT INTO users (user_id, username, authorized_at)
+        INSERT INTO link_clicks (link_id, clicks, last_click_at)
         VALUES (?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET username = excluded.username
+        ON CONFLICT(link_id) DO UPDATE SET
+            clicks = clicks + excluded.clicks,
+            last_click_at = excluded.last_click_at
         """
-        self._execute(query, (user_id, username, now))
-        self.reset_auth_attempts(user_id)
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.executemany(query, [(link_id, count, clicked_at) for link_id, count in clicks.items()])
+            self._connection.commit()
 
-    def is_user_banned(self, user_id: int) -> bool:
-        query = "SELECT 1 FROM banned_users WHERE user_id = ?"
-        return self._exists(query, (user_id,))
+    def get_link_clicks(self, link_ids: Sequence[int]) -> Dict[int, int]:
+        if not link_ids:
+            return {}
+        placeholders = ",".join("?" * len(link_ids))
+        query = f"SELECT link_id, clicks FROM link_clicks WHERE link_id IN ({placeholders})"
+        rows = self._fetchall(query, tuple(link_ids))
+        return {int(row["link_id"]): int(row["clicks"]) for row in rows}
 
-    def ban_user(self, user_id: int, username: Optional[str], reason: str | None = None) -> None:
-        now = datetime.utcnow().isoformat()
+    def list_clicked_links(self) -> List[sqlite3.Row]:
         query = """
-        INSERT OR IGNORE INTO banned_users (user_id, username, banned_at, reason)
-        VALUES (?, ?, ?, ?)
+        SELECT link_clicks.link_id, link_clicks.clicks, urls.url AS target_url
+        FROM link_clicks
+        JOIN short_links ON short_links.id = link_clicks.link_id
+        JOIN urls ON urls.id = short_links.target_url_id
         """
-        self._execute(query, (user_id, username, now, reason))
-        self.reset_auth_attempts(user_id)
+        return self._fetchall(query, ())
 
-    def add_history(self, user_id: int, base_url: str, utm_url: str, short_url: str) -> None:
+    def enqueue_shorten_job(
+        self, user_id: int, chat_id: int, base_url: str, utm_url: str, next_attempt_at: str
+    ) -> int:
         now = datetime.utcnow().isoformat()
         query = """
-        INSERT INTO history (user_id, base_url, utm_url, short_url, created_at)
-        VALUES (?, ?, ?, ?, ?)
+        INSERT INTO shorten_jobs (user_id, chat_id, base_url, utm_url, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
         """
-        self._execute(query, (user_id, base_url, utm_url, short_url, now))
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute(query, (user_id, chat_id, base_url, utm_url, next_attempt_at, now))
+            self._connection.commit()
+            return int(cursor.lastrowid)
 
-    def get_history(self, user_id: int, limit: int = 50) -> List[Tuple[str, str, str]]:
+    def get_due_shorten_jobs(self, now: str, limit: int) -> List[sqlite3.Row]:
         query = """
-        SELECT base_url, utm_url, short_url
-        FROM history
-        WHERE user_id = ?
-        ORDER BY id DESC
+        SELECT id, user_id, chat_id, base_url, utm_url, attempts, created_at
+        FROM shorten_jobs
+        WHERE next_attempt_at <= ?
+        ORDER BY next_attempt_at, id
         LIMIT ?
         """
-        rows = self._fetchall(query, (user_id, limit))
-        return [(row["base_url"], row["utm_url"], row["short_url"]) for row in rows]
+        return self._fetchall(query, (now, limit))
 
-    def list_authorized_users(self) -> List[sqlite3.Row]:
+    def reschedule_shorten_job(self, job_id: int, next_attempt_at: str, error: str) -> None:
         query = """
-        SELECT user_id, username, authorized_at
-        FROM users
-        ORDER BY authorized_at DESC
+        UPDATE shorten_jobs
+        SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+        WHERE id = ?
         """
-        return self._fetchall(query, ())
+        self._execute(query, (next_attempt_at, error, job_id))
+
+    def delete_shorten_job(self, job_id: int) -> None:
+        self._execute("DELETE FROM shorten_jobs WHERE id = ?", (job_id,))
+
+    def get_shorten_queue_stats(self) -> Tuple[int, Optional[str]]:
+        rows = self._fetchall("SELECT COUNT(*) AS depth, MIN(created_at) AS oldest FROM shorten_jobs", ())
+        return int(rows[0]["depth"]), rows[0]["oldest"]
+
+    def create_broadcast(self, text: str, created_by: int) -> int:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute(
+                "INSERT INTO broadcasts (text, created_by, created_at) VALUES (?, ?, ?)",
+                (text, created_by, now),
+            )
+            self._connection.commit()
+            return int(cursor.lastrowid)
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[sqlite3.Row]:
+        rows = self._fetchall("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        return rows[0] if rows else None
 
-    def list_banned_users(self) -> List[sqlite3.Row]:
+    def list_running_broadcasts(self) -> List[sqlite3.Row]:
+        return self._fetchall("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id", ())
+
+    def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
         query = """
-        SELECT user_id, username, banned_at, reason
-        FROM banned_users
-        ORDER BY banned_at DESC
+        SELECT user_id
+        FROM users
+        WHERE user_id > ? AND bot_blocked_at IS NULL
+        ORDER BY user_id
+        LIMIT ?
         """
-        return self._fetchall(query, ())
+        return [int(row["user_id"]) for row in self._fetchall(query, (after_user_id, limit))]
+
+    def record_broadcast_batch(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked_user_ids: Sequence[int],
+    ) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.executemany(
+                "UPDATE users SET bot_blocked_at = ? WHERE user_id = ?",
+                [(now, user_id) for user_id in blocked_user_ids],
+            )
+            cursor.execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+                WHERE id = ?
+                """,
+                (last_user_id, sent, failed, len(blocked_user_ids), broadcast_id),
+            )
+            self._connection.commit()
+
+    def finish_broadcast(self, broadcast_id: int, status: str) -> None:
+        now = datetime.utcnow().isoformat()
+        self._execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+            (status, now, broadcast_id),
+        )
+
+    def count_users(self, kind: str) -> int:
+        table, _, _ = USER_LISTS[kind]
+        rows = self._fetchall(f"SELECT COUNT(*) AS total FROM {table}", ())
+        return int(rows[0]["total"])
+
+    def get_users_page(
+        self,
+        kind: str,
+        limit: int,
+        cursor: Optional[Tuple[str, int]] = None,
+        backwards: bool = False,
+    ) -> List[sqlite3.Row]:
+        # Keyset-пагинация по индексу (время, user_id): от новых к старым,
+        # backwards — страница перед курсором
+        table, time_column, columns = USER_LISTS[kind]
+        order = "ASC" if backwards else "DESC"
+        where = ""
+        params: tuple = ()
+        if cursor is not None:
+            where = f"WHERE ({time_column}, user_id) {'>' if backwards else '<'} (?, ?)"
+            params = tuple(cursor)
+        query = f"""
+        SELECT {columns}
+        FROM {table}
+        {where}
+        ORDER BY {time_column} {order}, user_id {order}
+        LIMIT ?
+        """
+        rows = self._fetchall(query, params + (limit,))
+        return rows[::-1] if backwards else rows
 
     def delete_user(self, user_id: int) -> bool:
+        # История удаляется порциями, чтобы не держать блокировку на всё время удаления
+        while True:
+            with self._lock:
+                cursor = self._connection.cursor()
+                cursor.execute(
+                    "SELECT id FROM history WHERE user_id = ? LIMIT ?", (user_id, DELETE_BATCH_SIZE)
+                )
+                batch = [row["id"] for row in cursor.fetchall()]
+                self._delete_history_batch(cursor, batch)
+                self._connection.commit()
+            if len(batch) < DELETE_BATCH_SIZE:
+                break
+
         with self._lock:
             cursor = self._connection.cursor()
-            cursor.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
             cursor.execute("DELETE FROM auth_attempts WHERE user_id = ?", (user_id,))
             cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
             deleted_from_users = cursor.rowcount
@@ -169,20 +480,17 @@ class DatabaseManager:
             self._connection.commit()
         return (deleted_from_users + deleted_from_banned) > 0
 
-    def get_bot_password(self) -> str:
-        query = "SELECT value FROM app_settings WHERE key = ?"
-        rows = self._fetchall(query, ("bot_password",))
-        if not rows:
-            return settings.bot_access_password
-        return str(rows[0]["value"])
+    def get_app_settings(self) -> Dict[str, str]:
+        rows = self._fetchall("SELECT key, value FROM app_settings", ())
+        return {row["key"]: str(row["value"]) for row in rows}
 
-    def update_bot_password(self, new_password: str) -> None:
+    def set_app_setting(self, key: str, value: str) -> None:
         query = """
         INSERT INTO app_settings (key, value)
         VALUES (?, ?)
         ON CONFLICT(key) DO UPDATE SET value = excluded.value
         """
-        self._execute(query, ("bot_password", new_password))
+        self._execute(query, (key, value))
 
     def get_auth_attempts(self, user_id: int) -> int:
         query = "SELECT attempts FROM auth_attempts WHERE user_id = ?"
@@ -211,6 +519,143 @@ class DatabaseManager:
         query = "DELETE FROM auth_attempts WHERE user_id = ?"
         self._execute(query, (user_id,))
 
+    _HISTORY_SELECT = """
+    SELECT
+        h.id AS id,
+        h.user_id AS user_id,
+        h.created_at AS created_at,
+        base.url AS base_url,
+        utm.url AS utm_url,
+        short.url AS short_url,
+        source.value AS utm_source,
+        medium.value AS utm_medium,
+        campaign.value AS utm_campaign,
+        content.value AS utm_content,
+        slug.value AS slug
+    FROM history AS h
+    JOIN urls AS base ON base.id = h.base_url_id
+    JOIN urls AS short ON short.id = h.short_url_id
+    LEFT JOIN urls AS utm ON utm.id = h.utm_url_id
+    LEFT JOIN utm_values AS source ON source.id = h.source_id
+    LEFT JOIN utm_values AS medium ON medium.id = h.medium_id
+    LEFT JOIN utm_values AS campaign ON campaign.id = h.campaign_id
+    LEFT JOIN utm_values AS content ON content.id = h.content_id
+    LEFT JOIN utm_values AS slug ON slug.id = h.slug_id
+    """
+
+    _SEARCH_INSERT = """
+    INSERT INTO history_search (
+        rowid, base_url, slug, utm_source, utm_medium, utm_campaign, utm_content
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    # Удаление из contentless-индекса требует тех же значений, что были проиндексированы
+    _SEARCH_DELETE = """
+    INSERT INTO history_search (
+        history_search, rowid, base_url, slug, utm_source, utm_medium, utm_campaign, utm_content
+    )
+    VALUES ('delete', ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    @staticmethod
+    def _search_values(row: sqlite3.Row, slug: Optional[str] = None) -> tuple:
+        return (row["id"], row["base_url"], slug or row["slug"] or "") + tuple(
+            row[key] or "" for key, _ in HISTORY_UTM_COLUMNS
+        )
+
+    @staticmethod
+    def _history_row(row: sqlite3.Row) -> Tuple[str, str, str]:
+        utm_url = row["utm_url"]
+        if utm_url is None:
+            utm_params = {key: row[key] for key, _ in HISTORY_UTM_COLUMNS}
+            utm_url = build_from_parsed(parse_url(row["base_url"]), utm_params)
+        return row["base_url"], utm_url, row["short_url"]
+
+    @classmethod
+    def _history_record(cls, row: sqlite3.Row) -> dict:
+        base_url, utm_url, short_url = cls._history_row(row)
+        return {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "base_url": base_url,
+            "utm_url": utm_url,
+            "short_url": short_url,
+            "created_at": row["created_at"],
+        }
+
+    def _delete_history_batch(self, cursor: sqlite3.Cursor, history_ids: List[int]) -> int:
+        if not history_ids:
+            return 0
+        placeholders = ",".join("?" * len(history_ids))
+        cursor.execute(
+            f"SELECT base_url_id, utm_url_id, short_url_id FROM history WHERE id IN ({placeholders})",
+            history_ids,
+        )
+        url_ids = set()
+        for row in cursor.fetchall():
+            url_ids.update(value for value in row if value is not None)
+        cursor.execute(f"{self._HISTORY_SELECT} WHERE h.id IN ({placeholders})", history_ids)
+        cursor.executemany(self._SEARCH_DELETE, [self._search_values(row) for row in cursor.fetchall()])
+        cursor.execute(f"DELETE FROM history WHERE id IN ({placeholders})", history_ids)
+        deleted = cursor.rowcount
+        self._delete_orphan_urls(cursor, url_ids)
+        return deleted
+
+    @staticmethod
+    def _delete_orphan_urls(cursor: sqlite3.Cursor, url_ids: Iterable[int]) -> None:
+        cursor.executemany(
+            """
+            DELETE FROM urls
+            WHERE id = ?1
+              AND NOT EXISTS (SELECT 1 FROM history WHERE base_url_id = ?1)
+              AND NOT EXISTS (SELECT 1 FROM history WHERE short_url_id = ?1)
+              AND NOT EXISTS (SELECT 1 FROM history WHERE utm_url_id = ?1)
+              AND NOT EXISTS (SELECT 1 FROM short_links WHERE target_url_id = ?1)
+            """,
+            [(url_id,) for url_id in url_ids],
+        )
+
+    def _history_refs(
+        self, cursor: sqlite3.Cursor, base_url: str, utm_url: str, short_url: str
+    ) -> Tuple[Optional[int], ...]:
+        utm_params: Dict[str, str] = extract_utm_params(utm_url)
+        component_ids = tuple(
+            self._intern_value(cursor, utm_params.get(key)) for key, _ in HISTORY_UTM_COLUMNS
+        )
+        # Полную UTM-ссылку храним только если её нельзя восстановить из базовой и компонентов
+        rebuilt = build_from_parsed(
+            parse_url(base_url), {key: utm_params.get(key) for key, _ in HISTORY_UTM_COLUMNS}
+        )
+        utm_url_id = None if rebuilt == utm_url else self._intern_url(cursor, utm_url)
+        return (
+            self._intern_url(cursor, base_url),
+            utm_url_id,
+            self._intern_url(cursor, short_url),
+        ) + component_ids + (self._intern_value(cursor, extract_action_slug(base_url)),)
+
+    @staticmethod
+    def _intern_url(cursor: sqlite3.Cursor, url: str) -> int:
+        # Хеш только сужает поиск: при коллизии у разных ссылок один hash и разные строки urls
+        url_hash = _url_hash(url)
+        cursor.execute("SELECT id FROM urls WHERE hash = ? AND url = ?", (url_hash, url))
+        row = cursor.fetchone()
+        if row is not None:
+            return int(row["id"])
+        cursor.execute("INSERT INTO urls (hash, url) VALUES (?, ?)", (url_hash, url))
+        return int(cursor.lastrowid)
+
+    @staticmethod
+    def _intern_value(cursor: sqlite3.Cursor, value: Optional[str]) -> Optional[int]:
+        if not value:
+            return None
+        cursor.execute("SELECT id FROM utm_values WHERE value = ?", (value,))
+        row = cursor.fetchone()
+        if row is not None:
+            return int(row["id"])
+        cursor.execute("INSERT INTO utm_values (value) VALUES (?)", (value,))
+        return int(cursor.lastrowid)
+
     def _execute(self, query: str, params: Iterable) -> None:
         with self._lock:
             cursor = self._connection.cursor()
@@ -218,16 +663,28 @@ class DatabaseManager:
             self._connection.commit()
 
     def _fetchall(self, query: str, params: Iterable) -> List[sqlite3.Row]:
-        with self._lock:
-            cursor = self._connection.cursor()
-            cursor.execute(query, tuple(params))
-            return cursor.fetchall()
+        with span("db"):
+            connection = self._readers.acquire()
+            try:
+                return connection.execute(query, tuple(params)).fetchall()
+            finally:
+                self._readers.release(connection)
 
     def _exists(self, query: str, params: Iterable) -> bool:
-        with self._lock:
-            cursor = self._connection.cursor()
-            cursor.execute(query, tuple(params))
-            return cursor.fetchone() is not None
-
-
-database = DatabaseManager(settings.database_path)
+        with span("db"):
+            connection = self._readers.acquire()
+            try:
+                # Недочитанный курсор держит снимок WAL открытым — закрываем сразу
+                with closing(connection.execute(query, tuple(params))) as cursor:
+                    return cursor.fetchone() is not None
+            finally:
+                self._readers.release(connection)
+
+
+def build_storage(backend: str) -> Storage:
+    """Создаёт хранилище; файл SQLite открывается и мигрируется только здесь"""
+    if backend == "sqlite":
+        return DatabaseManager(settings.database_path, read_pool_size=settings.database_read_pool_size)
+    if backend == "memory":
+        return InMemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend!r}")
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiohttp import web
+
+from src.config import settings
+from src.services.migrations import LATEST_VERSION
+from src.services.shorteners import LatencyTracker
+from src.services.storage import Storage
+from src.utils.deadline import DeadlineStats
+
+
+logger = logging.getLogger(__name__)
+
+LAG_PERCENTILES = (50, 90, 99)
+
+
+class LoopLagMonitor:
+    """
+    Замеряет задержку планирования event loop: спит interval секунд и
+    смотрит, насколько позже заказанного проснулся. Большая задержка значит,
+    что кто-то блокирует loop синхронной работой.
+    """
+
+    def __init__(self, interval: float, window: int = 600) -> None:
+        self.interval = interval
+        self.samples = LatencyTracker(window=window, min_samples=1)
+        self.max_lag = 0.0
+        self.last_sample_at: Optional[float] = None
+
+    async def run_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.last_sample_at = time.monotonic()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples.record(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.last_sample_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        result: Dict[str, Optional[float]] = {}
+        for percent in LAG_PERCENTILES:
+            value = self.samples.percentile(percent)
+            result[f"p{percent}_ms"] = round(value * 1000, 2) if value is not None else None
+        result["max_ms"] = round(self.max_lag * 1000, 2)
+        return result
+
+
+class PollTracker(BaseRequestMiddleware):
+    """Middleware сессии бота: запоминает время последнего успешного getUpdates"""
+
+    def __init__(self) -> None:
+        self.last_success_at: Optional[float] = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        response = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            self.last_success_at = time.monotonic()
+        return response
+
+    def age(self) -> Optional[float]:
+        if self.last_success_at is None:
+            return None
+        return time.monotonic() - self.last_success_at
+
+
+class HealthService:
+    def __init__(
+        self,
+        db: Storage,
+        lag_monitor: LoopLagMonitor,
+        poll_tracker: PollTracker,
+        deadline_stats: DeadlineStats,
+        poll_max_age: float,
+        db_timeout: float,
+    ) -> None:
+        self.db = db
+        self.lag_monitor = lag_monitor
+        self.poll_tracker = poll_tracker
+        self.deadline_stats = deadline_stats
+        self.poll_max_age = poll_max_age
+        self.db_timeout = db_timeout
+        self.shutting_down = False
+
+    def liveness(self) -> Dict[str, object]:
+        last_sample = self.lag_monitor.last_sample_at
+        # Монитор сам работает в loop: если он давно не просыпался, loop завис или задача умерла
+        stale = last_sample is None or time.monotonic() - last_sample > max(5.0, self.lag_monitor.interval * 10)
+        return {"ok": not stale, "loop_lag": self.lag_monitor.snapshot()}
+
+    async def readiness(self) -> Dict[str, object]:
+        checks: Dict[str, object] = {}
+        try:
+            version = await asyncio.wait_for(
+                asyncio.to_thread(self.db.ping, self.db_timeout), timeout=self.db_timeout + 1
+            )
+            checks["database"] = "ok" if version >= LATEST_VERSION else f"schema {version} < {LATEST_VERSION}"
+        except Exception as exc:
+            checks["database"] = f"error: {type(exc).__name__}: {exc}"
+
+        poll_age = self.poll_tracker.age()
+        if poll_age is None:
+            checks["telegram"] = "no successful poll yet"
+        elif poll_age > self.poll_max_age:
+            checks["telegram"] = f"last poll {poll_age:.0f}s ago"
+        else:
+            checks["telegram"] = "ok"
+
+        if self.shutting_down:
+            checks["shutdown"] = "in progress"
+
+        ok = all(value == "ok" for value in checks.values())
+        return {"ok": ok, "checks": checks, "last_poll_age_seconds": poll_age}
+
+    def metrics(self) -> str:
+        lines = [
+            "# HELP bot_event_loop_lag_seconds Event loop scheduling lag",
+            "# TYPE bot_event_loop_lag_seconds summary",
+        ]
+        for percent in LAG_PERCENTILES:
+            value = self.lag_monitor.samples.percentile(percent)
+            if value is not None:
+                lines.append(f'bot_event_loop_lag_seconds{{quantile="{percent / 100}"}} {value:.6f}')
+        lines.append(f"bot_event_loop_lag_max_seconds {self.lag_monitor.max_lag:.6f}")
+        poll_age = self.poll_tracker.age()
+        if poll_age is not None:
+            lines.append(f"bot_last_poll_age_seconds {poll_age:.3f}")
+        updates, hits, stage_hits = self.deadline_stats.snapshot()
+        if updates:
+            lines.append("# TYPE bot_deadline_updates_total counter")
+            for handler, count in sorted(updates.items()):
+                lines.append(f'bot_deadline_updates_total{{handler="{handler}"}} {count}')
+            lines.append("# TYPE bot_deadline_exceeded_total counter")
+            for handler in sorted(updates):
+                lines.append(f'bot_deadline_exceeded_total{{handler="{handler}"}} {hits.get(handler, 0)}')
+            for (handler, stage), count in sorted(stage_hits.items()):
+                lines.append(f'bot_deadline_exceeded_total{{handler="{handler}",stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def build_health_app(service: HealthService) -> web.Application:
+    async def healthz(request: web.Request) -> web.Response:
+        payload = service.liveness()
+        return web.json_response(payload, status=200 if payload["ok"] else 503)
+
+    async def readyz(request: web.Request) -> web.Response:
+        payload = await service.readiness()
+        return web.json_response(payload, status=200 if payload["ok"] else 503)
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=service.metrics(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def start_health_server(service: HealthService, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(build_health_app(service), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Health server listening on %s:%s", host, port)
+    return runner
+
+
+loop_lag_monitor = LoopLagMonitor(settings.loop_lag_interval_seconds)
+poll_tracker = PollTracker()
@@ -0,0 +1,120 @@
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryArchive:
+    """
+    Хранилище архивной истории: по одному сжатому JSONL-файлу на месяц
+    (history-YYYY-MM.jsonl.gz). Файлы только дописываются.
+    """
+
+    FILE_PREFIX = "history-"
+    FILE_SUFFIX = ".jsonl.gz"
+
+    def __init__(self, archive_dir: str) -> None:
+        self.archive_dir = archive_dir
+        # Дозапись и перезапись файлов при удалении пользователя не должны пересекаться
+        self._lock = threading.Lock()
+
+    def _month_path(self, month: str) -> str:
+        return os.path.join(self.archive_dir, f"{self.FILE_PREFIX}{month}{self.FILE_SUFFIX}")
+
+    def append(self, records: Iterable[dict]) -> int:
+        """
+        Дописывает записи в файлы соответствующих месяцев.
+        Каждый вызов добавляет отдельный gzip-член, поэтому файл остаётся читаемым целиком.
+        """
+        by_month: Dict[str, List[dict]] = defaultdict(list)
+        for record in records:
+            by_month[record["created_at"][:7]].append(record)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        written = 0
+        with self._lock:
+            for month, month_records in by_month.items():
+                payload = "".join(
+                    json.dumps(record, ensure_ascii=False) + "\n" for record in month_records
+                )
+                with gzip.open(self._month_path(month), "at", encoding="utf-8") as archive_file:
+                    archive_file.write(payload)
+                    archive_file.flush()
+                    os.fsync(archive_file.fileno())
+                written += len(month_records)
+        return written
+
+    def purge_user(self, user_id: int) -> int:
+        """
+        Удаляет из архива все записи пользователя. Затронутые файлы пишутся
+        заново во временный файл и подменяются целиком (os.replace).
+        """
+        removed = 0
+        with self._lock:
+            for month in self.months():
+                path = self._month_path(month)
+                kept_lines = []
+                month_removed = 0
+                try:
+                    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+                        for line in archive_file:
+                            if json.loads(line)["user_id"] == user_id:
+                                month_removed += 1
+                            else:
+                                kept_lines.append(line)
+                except (OSError, EOFError, json.JSONDecodeError) as exc:
+                    logger.error("Error reading history archive %s, user %s not purged from it: %s", path, user_id, exc)
+                    continue
+                if not month_removed:
+                    continue
+                temp_path = f"{path}.tmp"
+                with gzip.open(temp_path, "wt", encoding="utf-8") as archive_file:
+                    archive_file.writelines(kept_lines)
+                    archive_file.flush()
+                    os.fsync(archive_file.fileno())
+                os.replace(temp_path, path)
+                removed += month_removed
+        return removed
+
+    def months(self) -> List[str]:
+        if not os.path.isdir(self.archive_dir):
+            return []
+        months = [
+            name[len(self.FILE_PREFIX):-len(self.FILE_SUFFIX)]
+            for name in os.listdir(self.archive_dir)
+            if name.startswith(self.FILE_PREFIX) and name.endswith(self.FILE_SUFFIX)
+        ]
+        return sorted(months)
+
+    def iter_records(self, user_id: int | None = None) -> Iterator[dict]:
+        """
+        Возвращает архивные записи от старых к новым.
+        Если архивация прервалась между записью файла и удалением строк,
+        одна и та же запись может попасть в архив дважды — дубликаты отбрасываются.
+        """
+        seen_ids = set()
+        for month in self.months():
+            path = self._month_path(month)
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+                    for line in archive_file:
+                        record = json.loads(line)
+                        if user_id is not None and record["user_id"] != user_id:
+                            continue
+                        if record["id"] in seen_ids:
+                            continue
+                        seen_ids.add(record["id"])
+                        yield record
+            except (OSError, EOFError, json.JSONDecodeError) as exc:
+                logger.error("Error reading history archive %s: %s", path, exc)
+
+
+history_archive = HistoryArchive(settings.history_archive_dir)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from src.services.database import DELETE_BATCH_SIZE
+from src.services.history_archive import HistoryArchive
+from src.services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько свободных страниц возвращается системе за одно удержание блокировки
+VACUUM_PAGES_PER_STEP = 1000
+# Не больше стольких шагов за проход, остаток освободится в следующий
+VACUUM_MAX_STEPS = 100
+
+
+class HistoryMaintenance:
+    """
+    Фоновое обслуживание базы: перенос старой истории в архив,
+    освобождение страниц (incremental_vacuum) и PRAGMA optimize.
+    Здесь же удаление пользователя: его история лежит и в базе, и в архиве.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        archive: HistoryArchive,
+        retention_days: int,
+        interval_seconds: int,
+        batch_size: int = DELETE_BATCH_SIZE,
+    ) -> None:
+        self.db = db
+        self.archive = archive
+        self.retention_days = retention_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        # Поток to_thread не отменяется вместе с задачей: он сам проверяет флаг между порциями
+        self._stop = threading.Event()
+        # Порция архивации (чтение, запись в архив, удаление) и удаление пользователя
+        # не пересекаются: иначе уже прочитанные строки вернулись бы в очищенный архив
+        self._history_lock = threading.Lock()
+
+    def archive_expired_history(self) -> int:
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).isoformat()
+        archived = 0
+        while not self._stop.is_set():
+            # Блокировка базы берётся отдельно на чтение и на удаление каждой порции
+            with self._history_lock:
+                records = self.db.get_history_before(cutoff, self.batch_size)
+                if not records:
+                    break
+                self.archive.append(records)
+                self.db.delete_history_ids([record["id"] for record in records])
+            archived += len(records)
+            if len(records) < self.batch_size:
+                break
+        return archived
+
+    def delete_user(self, user_id: int) -> bool:
+        """Удаляет пользователя с историей в базе и в архиве; True, если он был в базе"""
+        with self._history_lock:
+            deleted = self.db.delete_user(user_id)
+            purged = self.archive.purge_user(user_id)
+        if purged:
+            logger.info("Removed %s archived history records of user %s", purged, user_id)
+        return deleted
+
+    def reclaim_space(self) -> int:
+        """Освобождает свободные страницы порциями; возвращает число шагов incremental_vacuum"""
+        if not self.db.incremental_vacuum_enabled():
+            return 0
+        steps = 0
+        while steps < VACUUM_MAX_STEPS and not self._stop.is_set():
+            steps += 1
+            if self.db.incremental_vacuum(VACUUM_PAGES_PER_STEP) == 0:
+                return steps
+        if steps == VACUUM_MAX_STEPS:
+            logger.info("Incremental vacuum stopped after %s steps, the rest is left for the next run", steps)
+        return steps
+
+    def run_once(self) -> None:
+        if self.retention_days > 0:
+            archived = self.archive_expired_history()
+            if archived:
+                logger.info("Archived %s history rows older than %s days", archived, self.retention_days)
+        self.reclaim_space()
+        if not self._stop.is_set():
+            self.db.optimize()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except asyncio.CancelledError:
+                self.stop()
+                raise
+            except Exception:
+                logger.exception("History maintenance failed")
+            await asyncio.sleep(self.interval_seconds)
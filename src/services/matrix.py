@@ -0,0 +1,134 @@
+import asyncio
+import csv
+import io
+import itertools
+import logging
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from src.services.shorteners import ShortenerProvider
+from src.services.storage import Storage
+from src.services.utm_builder import build_utm_url
+from src.utils.utm import build_utm_content_with_date, extract_action_slug
+
+
+logger = logging.getLogger(__name__)
+
+# Сочетание меток: utm_source, utm_medium, utm_campaign и готовая UTM-ссылка
+Combination = Tuple[str, str, str, str]
+
+
+class MatrixRow(NamedTuple):
+    utm_source: str
+    utm_medium: str
+    utm_campaign: str
+    utm_url: str
+    short_url: Optional[str]
+    cached: bool
+
+
+class MatrixResult(NamedTuple):
+    rows: List[MatrixRow]
+    provider_calls: int
+    cached: int
+    failed: int
+
+
+def build_combinations(
+    base_url: str,
+    sources: Sequence[str],
+    mediums: Sequence[str],
+    campaigns: Sequence[str],
+    date_for_utm: str = "",
+) -> List[Combination]:
+    """Декартово произведение выбранных меток в порядке выбора"""
+    utm_content = build_utm_content_with_date(extract_action_slug(base_url), date_for_utm)
+    return [
+        (source, medium, campaign, build_utm_url(base_url, source, medium, campaign, utm_content))
+        for source, medium, campaign in itertools.product(sources, mediums, campaigns)
+    ]
+
+
+class MatrixGenerator:
+    """
+    Пакетная генерация ссылок по всем сочетаниям меток. Одинаковые UTM-ссылки
+    сокращаются один раз за пакет, готовые короткие ссылки живут в LRU-кеше
+    между пакетами. К сокращателю одновременно уходит не больше concurrency
+    запросов, чтобы пакет не занимал весь лимит провайдера.
+    """
+
+    def __init__(self, provider: ShortenerProvider, history: Storage, concurrency: int, cache_size: int) -> None:
+        self.provider = provider
+        self.history = history
+        self.concurrency = concurrency
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def _cached(self, utm_url: str) -> Optional[str]:
+        short_url = self._cache.get(utm_url)
+        if short_url is not None:
+            self._cache.move_to_end(utm_url)
+        return short_url
+
+    def _remember(self, utm_url: str, short_url: str) -> None:
+        self._cache[utm_url] = short_url
+        self._cache.move_to_end(utm_url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _shorten(self, semaphore: asyncio.Semaphore, user_id: int, base_url: str, utm_url: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                short_url = await self.provider.shorten(utm_url)
+            except Exception:  # pragma: no cover - network failure path
+                logger.exception("Matrix shortener exception for %s", utm_url)
+                return None
+        if short_url is not None:
+            self._remember(utm_url, short_url)
+            await asyncio.to_thread(self.history.add_history, user_id, base_url, utm_url, short_url)
+        return short_url
+
+    async def generate(self, user_id: int, base_url: str, combinations: Sequence[Combination]) -> MatrixResult:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        short_urls: Dict[str, Optional[str]] = {}
+        pending: Dict[str, "asyncio.Future[Optional[str]]"] = {}
+        for *_, utm_url in combinations:
+            if utm_url in short_urls or utm_url in pending:
+                continue
+            short_url = self._cached(utm_url)
+            if short_url is not None:
+                short_urls[utm_url] = short_url
+            else:
+                pending[utm_url] = asyncio.ensure_future(self._shorten(semaphore, user_id, base_url, utm_url))
+        try:
+            results = await asyncio.gather(*pending.values())
+        finally:
+            for task in pending.values():
+                task.cancel()
+        short_urls.update(zip(pending, results))
+
+        rows: List[MatrixRow] = []
+        fresh = set(pending)
+        for source, medium, campaign, utm_url in combinations:
+            # Первое вхождение запрошенной ссылки — свежая, остальные отданы из кеша
+            cached = utm_url not in fresh
+            fresh.discard(utm_url)
+            rows.append(MatrixRow(source, medium, campaign, utm_url, short_urls[utm_url], cached))
+        failed = sum(1 for row in rows if row.short_url is None)
+        cached = sum(1 for row in rows if row.cached and row.short_url is not None)
+        logger.info(
+            "Matrix for user %s: %s rows, %s provider calls, %s cached, %s failed",
+            user_id, len(rows), len(pending), cached, failed,
+        )
+        return MatrixResult(rows, len(pending), cached, failed)
+
+
+def build_matrix_csv(rows: Sequence[MatrixRow]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["utm_source", "utm_medium", "utm_campaign", "utm_url", "short_url", "cached"])
+    for row in rows:
+        writer.writerow(
+            [row.utm_source, row.utm_medium, row.utm_campaign, row.utm_url, row.short_url or "", int(row.cached)]
+        )
+    return buffer.getvalue().encode("utf-8-sig")
@@ -0,0 +1,353 @@
+import logging
+import sqlite3
+from typing import TYPE_CHECKING, Callable, NamedTuple, Tuple
+
+from src.config import settings
+from src.utils.utm import extract_action_slug
+
+if TYPE_CHECKING:  # pragma: no cover - только для аннотаций
+    from src.services.database import DatabaseManager
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 5000
+
+
+class Migration(NamedTuple):
+    """
+    Шаг схемы. Применяется ровно один раз: номер последнего применённого шага
+    хранится в PRAGMA user_version. Нетранзакционные шаги (VACUUM) выполняются
+    вне BEGIN/COMMIT и поэтому обязаны быть идемпотентными.
+    """
+
+    version: int
+    description: str
+    apply: Callable[["DatabaseManager", sqlite3.Cursor], None]
+    transactional: bool = True
+
+
+def _table_columns(cursor: sqlite3.Cursor, table: str) -> set:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row["name"] for row in cursor.fetchall()}
+
+
+def _add_column_if_missing(cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> None:
+    # Базы, созданные до появления миграций, могли уже получить колонку
+    if column not in _table_columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _enable_incremental_vacuum(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:  # INCREMENTAL
+        return
+    # Смена режима на существующей базе вступает в силу только после VACUUM
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("VACUUM")
+
+
+def _create_base_tables(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            authorized_at TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS banned_users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            banned_at TEXT NOT NULL,
+            reason TEXT
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS auth_attempts (
+            user_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+    _add_column_if_missing(cursor, "users", "username", "TEXT")
+    _add_column_if_missing(cursor, "banned_users", "username", "TEXT")
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_settings (key, value) VALUES (?, ?)",
+        ("bot_password", settings.bot_access_password),
+    )
+
+
+def _create_history_table(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            base_url_id INTEGER NOT NULL REFERENCES urls(id),
+            utm_url_id INTEGER REFERENCES urls(id),
+            short_url_id INTEGER NOT NULL REFERENCES urls(id),
+            source_id INTEGER REFERENCES utm_values(id),
+            medium_id INTEGER REFERENCES utm_values(id),
+            campaign_id INTEGER REFERENCES utm_values(id),
+            content_id INTEGER REFERENCES utm_values(id),
+            slug_id INTEGER REFERENCES utm_values(id),
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id, id)")
+    # Индексы по ссылкам нужны, чтобы быстро находить осиротевшие записи urls
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_base_url ON history(base_url_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_short_url ON history(short_url_id)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_utm_url ON history(utm_url_id) WHERE utm_url_id IS NOT NULL"
+    )
+
+
+def _intern_history(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY,
+            hash INTEGER NOT NULL,
+            url TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_hash ON urls(hash)")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS utm_values (
+            id INTEGER PRIMARY KEY,
+            value TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+
+    columns = _table_columns(cursor, "history")
+    if not columns:
+        _create_history_table(cursor)
+        return
+    if "base_url" not in columns:
+        # Интернированная таблица из версии без миграций могла быть создана до slug_id
+        _add_column_if_missing(cursor, "history", "slug_id", "INTEGER REFERENCES utm_values(id)")
+        return
+
+    # Старые строки с полными ссылками переводятся на ссылки в urls/utm_values.
+    # Идентификаторы и даты сохраняются.
+    logger.info("Migrating history table to interned URL layout...")
+    cursor.execute("ALTER TABLE history RENAME TO history_legacy")
+    _create_history_table(cursor)
+    read_cursor = cursor.connection.cursor()
+    read_cursor.execute(
+        "SELECT id, user_id, base_url, utm_url, short_url, created_at FROM history_legacy ORDER BY id"
+    )
+    migrated = 0
+    while True:
+        rows = read_cursor.fetchmany(MIGRATION_BATCH_SIZE)
+        if not rows:
+            break
+        cursor.executemany(
+            """
+            INSERT INTO history (
+                id, user_id, base_url_id, utm_url_id, short_url_id,
+                source_id, medium_id, campaign_id, content_id, slug_id, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (row["id"], row["user_id"])
+                + db._history_refs(cursor, row["base_url"], row["utm_url"], row["short_url"])
+                + (row["created_at"],)
+                for row in rows
+            ],
+        )
+        migrated += len(rows)
+    cursor.execute("DROP TABLE history_legacy")
+    logger.info("History migration finished: %s rows", migrated)
+
+
+def _create_search_index(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_search'")
+    if cursor.fetchone() is not None:
+        return
+
+    # Индекс без собственной копии текста (content=''): все индексируемые
+    # значения уже лежат в history/urls/utm_values и нужны только при удалении
+    logger.info("Building full-text search index over history...")
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE history_search USING fts5(
+            base_url, slug, utm_source, utm_medium, utm_campaign, utm_content,
+            content = '',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    read_cursor = cursor.connection.cursor()
+    read_cursor.execute(db._HISTORY_SELECT)
+    while True:
+        rows = read_cursor.fetchmany(MIGRATION_BATCH_SIZE)
+        if not rows:
+            break
+        search_rows = []
+        for row in rows:
+            slug = row["slug"]
+            if slug is None:
+                slug = extract_action_slug(row["base_url"])
+                cursor.execute(
+                    "UPDATE history SET slug_id = ? WHERE id = ?",
+                    (db._intern_value(cursor, slug), row["id"]),
+                )
+            search_rows.append(db._search_values(row, slug))
+        cursor.executemany(db._SEARCH_INSERT, search_rows)
+
+
+def _add_missing_indexes(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    # Сортировки списков пользователей и выборка истории по возрасту
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_authorized_at ON users(authorized_at, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_banned_users_banned_at ON banned_users(banned_at, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_created_at ON history(created_at)")
+
+
+def _create_short_links(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS short_links (
+            id INTEGER PRIMARY KEY,
+            target_url_id INTEGER NOT NULL REFERENCES urls(id),
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_short_links_target ON short_links(target_url_id)")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )
+        """
+    )
+    # Первые коды начинаются с четырёх символов base62, чтобы не выдавать «a», «b», …
+    cursor.execute(
+        "INSERT OR IGNORE INTO sequences (name, next_value) VALUES ('short_links', ?)",
+        (62 ** 3,),
+    )
+
+
+def _create_link_clicks(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS link_clicks (
+            link_id INTEGER PRIMARY KEY REFERENCES short_links(id),
+            clicks INTEGER NOT NULL DEFAULT 0,
+            last_click_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _create_shorten_jobs(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    # Ссылки хранятся целиком: строка задания не должна зависеть от очистки urls
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shorten_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            base_url TEXT NOT NULL,
+            utm_url TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_error TEXT
+        )
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_shorten_jobs_due ON shorten_jobs(next_attempt_at, id)")
+
+
+def _create_broadcasts(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    # Пользователи, заблокировавшие бота, пропускаются в следующих рассылках до нового /start
+    _add_column_if_missing(cursor, "users", "bot_blocked_at", "TEXT")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            finished_at TEXT
+        )
+        """
+    )
+
+
+def _allow_url_hash_collisions(db: "DatabaseManager", cursor: sqlite3.Cursor) -> None:
+    # Уникальный индекс по 64-битному хешу превращал коллизию в отказ записи истории
+    cursor.execute("DROP INDEX IF EXISTS idx_urls_hash")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_hash ON urls(hash)")
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "incremental auto_vacuum", _enable_incremental_vacuum, transactional=False),
+    Migration(2, "users, bans, auth attempts and settings", _create_base_tables),
+    Migration(3, "interned history layout", _intern_history),
+    Migration(4, "full-text search over history", _create_search_index),
+    Migration(5, "indexes for listings and retention", _add_missing_indexes),
+    Migration(6, "self-hosted short links", _create_short_links),
+    Migration(7, "click counters for short links", _create_link_clicks),
+    Migration(8, "retry queue for failed shortening", _create_shorten_jobs),
+    Migration(9, "broadcasts and blocked-bot marks", _create_broadcasts),
+    Migration(10, "non-unique URL hash index", _allow_url_hash_collisions),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def run_migrations(db: "DatabaseManager", connection: sqlite3.Connection) -> None:
+    """
+    Применяет недостающие миграции по порядку. На актуальной базе
+    ограничивается одним чтением PRAGMA user_version.
+    """
+    current = connection.execute("PRAGMA user_version").fetchone()[0]
+    if current >= LATEST_VERSION:
+        return
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        logger.info("Applying migration %s: %s", migration.version, migration.description)
+        cursor = connection.cursor()
+        if not migration.transactional:
+            migration.apply(db, cursor)
+            cursor.execute(f"PRAGMA user_version = {migration.version}")
+            continue
+        try:
+            cursor.execute("BEGIN")
+            migration.apply(db, cursor)
+            cursor.execute(f"PRAGMA user_version = {migration.version}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
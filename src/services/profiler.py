@@ -0,0 +1,183 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Строк статистики cProfile в одном отчёте
+PROFILE_STATS_LINES = 25
+
+# Интервалы (имя, секунды), накопленные текущим апдейтом; None — профилирование выключено.
+# asyncio.to_thread копирует контекст, поэтому сюда попадают и спаны из рабочих потоков
+_current_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("profiler_spans", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Засекает вложенный участок (БД, сокращатель), если апдейт профилируется"""
+    spans = _current_spans.get()
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - started))
+
+
+class SpanLock:
+    """
+    threading.Lock, который записывает время от ожидания до освобождения
+    как спан: для БД это и очередь на соединение, и сам запрос.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._started = threading.local()
+
+    def __enter__(self) -> None:
+        if _current_spans.get() is not None:
+            self._started.value = time.perf_counter()
+        self._lock.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self._lock.release()
+        spans = _current_spans.get()
+        if spans is None:
+            return
+        started = getattr(self._started, "value", None)
+        if started is not None:
+            self._started.value = None
+            spans.append((self.name, time.perf_counter() - started))
+
+
+class UpdateProfiler:
+    """
+    Хранит последние отчёты о медленных апдейтах. Каждый апдейт получает
+    список спанов; с вероятностью sample_rate он ещё и идёт под cProfile
+    (одновременно профилируется только один апдейт — профайлер глобальный).
+    """
+
+    def __init__(
+        self,
+        threshold_seconds: float,
+        sample_rate: float,
+        max_reports: int,
+        dump_path: str = "",
+    ) -> None:
+        self.threshold_seconds = threshold_seconds
+        self.sample_rate = sample_rate
+        self.reports: Deque[Dict[str, object]] = deque(maxlen=max_reports)
+        self.dump_path = Path(dump_path) if dump_path else None
+        self._profiling = False
+
+    @contextmanager
+    def track(self, handler_name: str, update_type: str) -> Iterator[None]:
+        spans: List[Tuple[str, float]] = []
+        token = _current_spans.set(spans)
+        profile = self._start_profile()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_spans.reset(token)
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            if elapsed >= self.threshold_seconds:
+                self._store(handler_name, update_type, elapsed, spans, profile)
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        if self._profiling or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # другой профайлер уже активен
+            return None
+        self._profiling = True
+        return profile
+
+    def _store(
+        self,
+        handler_name: str,
+        update_type: str,
+        elapsed: float,
+        spans: List[Tuple[str, float]],
+        profile: Optional[cProfile.Profile],
+    ) -> None:
+        totals: Dict[str, Dict[str, float]] = {}
+        for name, seconds in spans:
+            bucket = totals.setdefault(name, {"count": 0, "seconds": 0.0})
+            bucket["count"] += 1
+            bucket["seconds"] += seconds
+        report: Dict[str, object] = {
+            "at": datetime.utcnow().isoformat(),
+            "handler": handler_name,
+            "update_type": update_type,
+            "duration_ms": round(elapsed * 1000, 1),
+            "spans": {
+                name: {"count": int(bucket["count"]), "ms": round(bucket["seconds"] * 1000, 1)}
+                for name, bucket in totals.items()
+            },
+            "profile": self._format_profile(profile) if profile is not None else None,
+        }
+        self.reports.append(report)
+        logger.warning(
+            "Slow update: handler=%s type=%s duration=%.0fms spans=%s",
+            handler_name,
+            update_type,
+            elapsed * 1000,
+            report["spans"],
+        )
+        if self.dump_path is not None:
+            try:
+                with self.dump_path.open("a", encoding="utf-8") as dump:
+                    dump.write(json.dumps(report, ensure_ascii=False) + "\n")
+            except OSError:
+                logger.exception("Failed to append slow update report to %s", self.dump_path)
+
+    @staticmethod
+    def _format_profile(profile: cProfile.Profile) -> str:
+        buffer = io.StringIO()
+        stats = pstats.Stats(profile, stream=buffer)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_STATS_LINES)
+        return buffer.getvalue()
+
+    def render_reports(self) -> str:
+        blocks = []
+        for report in reversed(self.reports):
+            lines = [
+                f"{report['at']} {report['update_type']} {report['handler']} — {report['duration_ms']} ms"
+            ]
+            for name, bucket in report["spans"].items():
+                lines.append(f"  {name}: {bucket['count']} раз, {bucket['ms']} ms")
+            if report["profile"]:
+                lines.append(report["profile"])
+            blocks.append("\n".join(lines))
+        return "\n\n".join(blocks)
+
+
+update_profiler = UpdateProfiler(
+    threshold_seconds=settings.profiler_threshold_ms / 1000,
+    sample_rate=settings.profiler_sample_rate,
+    max_reports=settings.profiler_max_reports,
+    dump_path=settings.profiler_dump_path,
+)
@@ -0,0 +1,33 @@
+import logging
+
+from aiohttp import web
+
+from src.services.click_counter import ClickCounter
+from src.services.self_shortener import SelfHostedShortener, decode_base62
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_redirect_app(resolver: SelfHostedShortener, counter: ClickCounter) -> web.Application:
+    async def redirect(request: web.Request) -> web.StreamResponse:
+        code = request.match_info["code"]
+        target = await resolver.resolve(code)
+        if target is None:
+            raise web.HTTPNotFound(text="Ссылка не найдена")
+        counter.record(decode_base62(code))
+        raise web.HTTPFound(location=target)
+
+    app = web.Application()
+    app.router.add_get(r"/{code:[0-9A-Za-z]+}", redirect)
+    return app
+
+
+async def start_redirect_server(
+    resolver: SelfHostedShortener, counter: ClickCounter, host: str, port: int
+) -> web.AppRunner:
+    runner = web.AppRunner(build_redirect_app(resolver, counter), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Redirect server listening on %s:%s", host, port)
+    return runner
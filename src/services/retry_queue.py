@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from src.keyboards.utm_keyboards import build_result_keyboard
+from src.services.shorteners import ShortenerProvider
+from src.services.storage import Storage
+from src.utils.utm import format_generation_result
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько заданий забирается из базы за один проход
+RETRY_BATCH_SIZE = 20
+
+
+class ShortenRetryQueue:
+    """
+    Очередь повторных попыток сокращения. Задания лежат в хранилище (в SQLite
+    переживают перезапуск); воркер повторяет их с экспоненциальной задержкой
+    и присылает пользователю готовую короткую ссылку. Доставка «хотя бы один раз»: при
+    падении между записью в историю и удалением задания ссылка придёт повторно.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        provider: ShortenerProvider,
+        base_delay: float,
+        max_delay: float,
+        max_attempts: int,
+        poll_interval: float,
+    ) -> None:
+        self.db = db
+        self.provider = provider
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+        # Разброс ±20%, чтобы после сбоя провайдера задания не шли одной волной
+        return delay * random.uniform(0.8, 1.2)
+
+    async def enqueue(self, user_id: int, chat_id: int, base_url: str, utm_url: str) -> int:
+        first_attempt = datetime.utcnow() + timedelta(seconds=self.backoff(0))
+        return await asyncio.to_thread(
+            self.db.enqueue_shorten_job, user_id, chat_id, base_url, utm_url, first_attempt.isoformat()
+        )
+
+    async def stats(self) -> Dict[str, Optional[float]]:
+        depth, oldest = await asyncio.to_thread(self.db.get_shorten_queue_stats)
+        age = None
+        if oldest is not None:
+            age = (datetime.utcnow() - datetime.fromisoformat(oldest)).total_seconds()
+        return {"depth": depth, "oldest_age_seconds": age}
+
+    async def process_due(self, bot: Bot) -> int:
+        now = datetime.utcnow()
+        jobs = await asyncio.to_thread(self.db.get_due_shorten_jobs, now.isoformat(), RETRY_BATCH_SIZE)
+        for job in jobs:
+            try:
+                short_url = await self.provider.shorten(job["utm_url"])
+            except Exception as exc:  # pragma: no cover - network failure path
+                logger.exception("Retry shortener exception for job %s", job["id"])
+                short_url, error = None, repr(exc)
+            else:
+                error = "provider returned no short link"
+
+            if short_url is not None:
+                await self._deliver(bot, job, short_url)
+            elif job["attempts"] + 1 >= self.max_attempts:
+                await self._give_up(bot, job, error)
+            else:
+                next_attempt = now + timedelta(seconds=self.backoff(job["attempts"] + 1))
+                await asyncio.to_thread(
+                    self.db.reschedule_shorten_job, job["id"], next_attempt.isoformat(), error
+                )
+        return len(jobs)
+
+    async def _deliver(self, bot: Bot, job, short_url: str) -> None:
+        await asyncio.to_thread(
+            self.db.add_history, job["user_id"], job["base_url"], job["utm_url"], short_url
+        )
+        await asyncio.to_thread(self.db.delete_shorten_job, job["id"])
+        text = format_generation_result(job["base_url"], job["utm_url"], short_url)
+        await self._send(bot, job["chat_id"], text, build_result_keyboard())
+        logger.info("Shorten job %s delivered after %s retries", job["id"], job["attempts"] + 1)
+
+    async def _give_up(self, bot: Bot, job, error: str) -> None:
+        await asyncio.to_thread(self.db.delete_shorten_job, job["id"])
+        logger.error("Shorten job %s dropped after %s attempts: %s", job["id"], self.max_attempts, error)
+        await self._send(
+            bot,
+            job["chat_id"],
+            "❌ Не удалось сократить ссылку после нескольких попыток. Ссылка с UTM:\n\n"
+            f"{job['utm_url']}",
+        )
+
+    @staticmethod
+    async def _send(bot: Bot, chat_id: int, text: str, reply_markup=None) -> None:
+        try:
+            await bot.send_message(chat_id, text, reply_markup=reply_markup)
+        except TelegramForbiddenError:
+            logger.warning("Chat %s blocked the bot, result not delivered", chat_id)
+        except Exception:
+            # Ссылка уже сохранена в истории, пользователь увидит её там
+            logger.exception("Failed to deliver shorten result to chat %s", chat_id)
+
+    async def run_forever(self, bot: Bot) -> None:
+        while True:
+            try:
+                processed = await self.process_due(bot)
+                if processed:
+                    stats = await self.stats()
+                    logger.info(
+                        "Shorten retry queue: depth=%s oldest_age=%.0fs",
+                        stats["depth"],
+                        stats["oldest_age_seconds"] or 0.0,
+                    )
+            except Exception:
+                logger.exception("Shorten retry queue iteration failed")
+                processed = 0
+            # Полная порция — значит, есть ещё просроченные задания
+            if processed < RETRY_BATCH_SIZE:
+                await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import string
+from collections import OrderedDict
+from typing import Generic, Hashable, Iterator, Optional, TypeVar
+
+from src.services.shorteners import ShortenerProvider
+from src.services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+_BASE62_INDEX = {char: index for index, char in enumerate(BASE62_ALPHABET)}
+SHORT_LINK_SEQUENCE = "short_links"
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def encode_base62(value: int) -> str:
+    if value < 0:
+        raise ValueError("base62 encodes non-negative integers only")
+    if value == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while value:
+        value, remainder = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+
+def decode_base62(code: str) -> Optional[int]:
+    """Возвращает число или None, если строка не является кодом base62"""
+    if not code or len(code) > 11:
+        return None
+    value = 0
+    for char in code:
+        index = _BASE62_INDEX.get(char)
+        if index is None:
+            return None
+        value = value * 62 + index
+    return value
+
+
+class LRUCache(Generic[K, V]):
+    """Простой LRU-кеш на OrderedDict; используется только из event loop"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: "OrderedDict[K, V]" = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SelfHostedShortener(ShortenerProvider):
+    """
+    Встроенный сокращатель: идентификаторы берутся блоками из последовательности
+    в хранилище (одно обновление на блок), код ссылки — это идентификатор в base62,
+    поэтому коды не пересекаются даже при нескольких процессах.
+    """
+
+    name = "self"
+
+    def __init__(
+        self,
+        db: Storage,
+        public_base_url: str,
+        cache_size: int,
+        allocation_batch: int = 100,
+    ) -> None:
+        super().__init__()
+        self.db = db
+        self.public_base_url = public_base_url.rstrip("/")
+        self.allocation_batch = allocation_batch
+        self.cache: LRUCache[int, str] = LRUCache(cache_size)
+        self._ids: Iterator[int] = iter(())
+        self._allocation_lock = asyncio.Lock()
+
+    async def _next_id(self) -> int:
+        async with self._allocation_lock:
+            link_id = next(self._ids, None)
+            if link_id is None:
+                # Неиспользованный остаток блока теряется при перезапуске — это лишь пропуск кодов
+                block = await asyncio.to_thread(
+                    self.db.allocate_sequence, SHORT_LINK_SEQUENCE, self.allocation_batch
+                )
+                self._ids = iter(block)
+                link_id = next(self._ids)
+            return link_id
+
+    def short_url_for(self, link_id: int) -> str:
+        return f"{self.public_base_url}/{encode_base62(link_id)}"
+
+    def link_id_for(self, short_url: str) -> Optional[int]:
+        """Идентификатор ссылки, если она выдана этим сокращателем"""
+        prefix = f"{self.public_base_url}/"
+        if not short_url.startswith(prefix):
+            return None
+        return decode_base62(short_url[len(prefix):])
+
+    async def shorten(self, long_url: str) -> Optional[str]:
+        try:
+            link_id = await self._next_id()
+            await asyncio.to_thread(self.db.add_short_link, link_id, long_url)
+        except Exception:
+            logger.exception("Exception during self-hosted shorten call")
+            return None
+        self.cache.put(link_id, long_url)
+        return self.short_url_for(link_id)
+
+    async def resolve(self, code: str) -> Optional[str]:
+        link_id = decode_base62(code)
+        if link_id is None:
+            return None
+        target = self.cache.get(link_id)
+        if target is None:
+            target = await asyncio.to_thread(self.db.get_short_link_target, link_id)
+            if target is not None:
+                self.cache.put(link_id, target)
+        return target
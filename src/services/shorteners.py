@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+
+import aiohttp
+
+from src.config import settings
+from src.services.clc_shortener import CLC_API_ENDPOINT, shorten_url
+from src.services.profiler import span
+from src.services.utm_builder import canonical_url
+from src.utils.single_flight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+
+def coalescing_key(long_url: str) -> str:
+    try:
+        return canonical_url(long_url)
+    except ValueError:
+        return long_url
+
+
+class ShortenerProvider(ABC):
+    """
+    Сервис сокращения ссылок. shorten возвращает короткую ссылку
+    или None при любой ошибке провайдера (ошибка уже залогирована).
+    """
+
+    name: str = "provider"
+
+    def __init__(self) -> None:
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Одна сессия на провайдера: соединения переиспользуются между запросами
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=REQUEST_TIMEOUT)
+        return self._session
+
+    @abstractmethod
+    async def shorten(self, long_url: str) -> Optional[str]:
+        ...
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class ClcShortener(ShortenerProvider):
+    name = "clc"
+
+    def __init__(self, api_key: str, api_endpoint: str = CLC_API_ENDPOINT) -> None:
+        super().__init__()
+        self.api_key = api_key
+        self.api_endpoint = api_endpoint
+
+    async def shorten(self, long_url: str) -> Optional[str]:
+        return await shorten_url(long_url, self.api_key, self._get_session(), self.api_endpoint)
+
+
+class YourlsShortener(ShortenerProvider):
+    """
+    Сокращатель с API в стиле YOURLS: GET/POST на yourls-api.php
+    с action=shorturl, format=json и ключом signature.
+    """
+
+    name = "yourls"
+
+    def __init__(self, api_url: str, signature: str) -> None:
+        super().__init__()
+        self.api_url = api_url
+        self.signature = signature
+
+    async def shorten(self, long_url: str) -> Optional[str]:
+        payload = {
+            "action": "shorturl",
+            "format": "json",
+            "signature": self.signature,
+            "url": long_url,
+        }
+        try:
+            async with self._get_session().post(self.api_url, data=payload) as response:
+                result = await response.json(content_type=None)
+        except Exception:
+            logger.exception("Exception during YOURLS shorten call")
+            return None
+
+        # YOURLS отвечает ошибкой «error:url», если ссылка уже сокращена, но отдаёт shorturl
+        short_url = result.get("shorturl") if isinstance(result, dict) else None
+        if not short_url:
+            logger.error("YOURLS API error %s: %s", response.status, result)
+            return None
+        return short_url
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных ответов провайдера"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class ShortenerStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.hedged = 0
+        self.winners: Counter = Counter()
+        self.failures = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedge_rate, 4),
+            "winners": dict(self.winners),
+            "failures": self.failures,
+        }
+
+
+class HedgedShortener(ShortenerProvider):
+    """
+    Отправляет запрос основному провайдеру. Если тот не ответил за свой p95
+    (или ответил ошибкой), параллельно запрашивает резервного и берёт первый
+    успешный ответ, отменяя оставшийся запрос. Одновременные запросы одной и
+    той же ссылки (с точностью до canonical_url) объединяются в один.
+    """
+
+    def __init__(
+        self,
+        primary: ShortenerProvider,
+        backup: Optional[ShortenerProvider],
+        initial_hedge_delay: float,
+        hedging_enabled: bool = True,
+    ) -> None:
+        super().__init__()
+        self.primary = primary
+        self.backup = backup
+        self.initial_hedge_delay = initial_hedge_delay
+        self.hedging_enabled = hedging_enabled
+        self.latency = LatencyTracker()
+        self.stats = ShortenerStats()
+        self.single_flight = SingleFlight()
+        self.name = primary.name if backup is None else f"{primary.name}+{backup.name}"
+
+    def hedge_delay(self) -> float:
+        p95 = self.latency.percentile(95)
+        return p95 if p95 is not None else self.initial_hedge_delay
+
+    @staticmethod
+    async def _call(provider: ShortenerProvider, long_url: str) -> Optional[str]:
+        # Исключение провайдера — такой же отказ, как None: дальше пробуем резервного
+        try:
+            return await provider.shorten(long_url)
+        except Exception:
+            logger.exception("Shortener provider %s raised", provider.name)
+            return None
+
+    async def _timed_primary(self, long_url: str, hedge_delay: float) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            result = await self._call(self.primary, long_url)
+        except asyncio.CancelledError:
+            # Отменённый запрос был не быстрее порога: учитываем его как порог,
+            # иначе p95 занижается (а полное время ожидания раздувало бы его с каждым хеджем)
+            self.latency.record(min(time.perf_counter() - started, hedge_delay))
+            raise
+        if result is not None:
+            self.latency.record(time.perf_counter() - started)
+        return result
+
+    async def shorten(self, long_url: str) -> Optional[str]:
+        with span("shortener"):
+            return await self.single_flight.do(coalescing_key(long_url), lambda: self._shorten(long_url))
+
+    async def _shorten(self, long_url: str) -> Optional[str]:
+        self.stats.requests += 1
+        hedge_delay = self.hedge_delay()
+        if self.backup is None:
+            result = await self._timed_primary(long_url, hedge_delay)
+            self._record_result(self.primary.name if result else None, hedged=False)
+            return result
+
+        tasks = {asyncio.create_task(self._timed_primary(long_url, hedge_delay)): self.primary.name}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay if self.hedging_enabled else None)
+            for task in done:
+                result = task.result()
+                if result is not None:
+                    self._record_result(tasks[task], hedged=False)
+                    return result
+
+            tasks[asyncio.create_task(self._call(self.backup, long_url))] = self.backup.name
+            pending = {task for task in tasks if not task.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result is not None:
+                        self._record_result(tasks[task], hedged=True)
+                        return result
+            self._record_result(None, hedged=True)
+            return None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _record_result(self, winner: Optional[str], hedged: bool) -> None:
+        if hedged:
+            self.stats.hedged += 1
+        if winner is None:
+            self.stats.failures += 1
+        else:
+            self.stats.winners[winner] += 1
+        logger.info(
+            "Shortener result: provider=%s hedged=%s hedge_rate=%.3f coalesced=%s",
+            winner or "none",
+            hedged,
+            self.stats.hedge_rate,
+            self.single_flight.coalesced,
+        )
+
+    async def close(self) -> None:
+        await self.primary.close()
+        if self.backup is not None:
+            await self.backup.close()
+
+
+def build_provider(name: str, self_hosted: Optional[ShortenerProvider] = None) -> Optional[ShortenerProvider]:
+    if not name:
+        return None
+    if name == ClcShortener.name:
+        return ClcShortener(settings.clc_api_key, settings.clc_api_endpoint)
+    if name == YourlsShortener.name:
+        return YourlsShortener(settings.yourls_api_url, settings.yourls_signature)
+    if name == "self":
+        # Встроенный сокращатель работает поверх хранилища и создаётся вместе с ним
+        if self_hosted is None:
+            raise ValueError("The self-hosted shortener needs a storage")
+        return self_hosted
+    raise ValueError(f"Unknown shortener provider: {name}")
+
+
+def build_shortener(self_hosted: Optional[ShortenerProvider] = None) -> HedgedShortener:
+    return HedgedShortener(
+        primary=build_provider(settings.shortener_primary, self_hosted),
+        backup=build_provider(settings.shortener_backup, self_hosted),
+        initial_hedge_delay=settings.shortener_hedge_delay_seconds,
+        hedging_enabled=settings.shortener_hedging_enabled,
+    )
@@ -0,0 +1,579 @@
+import heapq
+import itertools
+import re
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from src.config import settings
+from src.services.migrations import LATEST_VERSION
+from src.services.utm_builder import extract_utm_params
+from src.utils.utm import extract_action_slug
+
+
+# Списки пользователей: таблица, колонка времени для сортировки, выбираемые колонки
+USER_LISTS: Dict[str, Tuple[str, str, str]] = {
+    "active": ("users", "authorized_at", "user_id, username, authorized_at"),
+    "banned": ("banned_users", "banned_at", "user_id, username, banned_at, reason"),
+}
+# Сколько строк читается за раз при обходе списков
+ITER_BATCH_SIZE = 500
+# Сколько самых свежих совпадений ранжируется при поиске по истории
+SEARCH_CANDIDATE_LIMIT = 1000
+# Поля истории, по которым ищет search_history (как в индексе history_search)
+SEARCH_FIELDS = ("base_url", "slug", "utm_source", "utm_medium", "utm_campaign", "utm_content")
+
+UserRow = Mapping[str, object]
+# Строка задания, рассылки или счётчика: sqlite3.Row у SQLite, dict в памяти
+Row = Mapping[str, Any]
+
+
+class Storage(ABC):
+    """
+    Всё состояние бота: пользователи, блокировки, попытки входа, настройки,
+    история, очередь повторов, рассылки, короткие ссылки и клики.
+    Реализации: DatabaseManager (SQLite) и InMemoryStorage; выбирается
+    настройкой STORAGE_BACKEND через build_storage.
+    """
+
+    def ping(self, timeout: float) -> int:
+        """Версия схемы для проверки готовности; у хранилища без миграций она всегда последняя"""
+        return LATEST_VERSION
+
+    def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def is_user_authorized(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    def authorize_user(self, user_id: int, username: Optional[str]) -> None: ...
+
+    @abstractmethod
+    def is_user_banned(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    def ban_user(self, user_id: int, username: Optional[str], reason: str | None = None) -> None: ...
+
+    @abstractmethod
+    def delete_user(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    def count_users(self, kind: str) -> int: ...
+
+    @abstractmethod
+    def get_users_page(
+        self,
+        kind: str,
+        limit: int,
+        cursor: Optional[Tuple[str, int]] = None,
+        backwards: bool = False,
+    ) -> List[UserRow]: ...
+
+    def iter_users(self, kind: str, batch_size: int = ITER_BATCH_SIZE) -> Iterator[UserRow]:
+        _, time_column, _ = USER_LISTS[kind]
+        cursor = None
+        while True:
+            rows = self.get_users_page(kind, batch_size, cursor)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1][time_column], rows[-1]["user_id"])
+
+    @abstractmethod
+    def get_auth_attempts(self, user_id: int) -> int: ...
+
+    @abstractmethod
+    def increment_auth_attempts(self, user_id: int) -> int: ...
+
+    @abstractmethod
+    def reset_auth_attempts(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    def get_app_settings(self) -> Dict[str, str]: ...
+
+    @abstractmethod
+    def set_app_setting(self, key: str, value: str) -> None: ...
+
+    @abstractmethod
+    def add_history(self, user_id: int, base_url: str, utm_url: str, short_url: str) -> None: ...
+
+    @abstractmethod
+    def get_history(self, user_id: int, limit: int = 50) -> List[Tuple[str, str, str]]: ...
+
+    @abstractmethod
+    def iter_history_records(self, user_id: int, batch_size: int = ITER_BATCH_SIZE) -> Iterator[dict]: ...
+
+    @abstractmethod
+    def search_history(self, user_id: int, terms: str, limit: int, offset: int = 0) -> List[dict]: ...
+
+    @abstractmethod
+    def get_history_before(self, cutoff: str, limit: int) -> List[dict]: ...
+
+    @abstractmethod
+    def delete_history_ids(self, history_ids: Sequence[int]) -> int: ...
+
+    # Обслуживание файла базы; хранилищу без файла делать нечего
+    def incremental_vacuum_enabled(self) -> bool:
+        return False
+
+    def incremental_vacuum(self, pages: int) -> int:
+        return 0
+
+    def optimize(self) -> None:
+        pass
+
+    @abstractmethod
+    def allocate_sequence(self, name: str, count: int) -> range: ...
+
+    @abstractmethod
+    def add_short_link(self, link_id: int, target_url: str) -> None: ...
+
+    @abstractmethod
+    def get_short_link_target(self, link_id: int) -> Optional[str]: ...
+
+    @abstractmethod
+    def add_link_clicks(self, clicks: Dict[int, int], clicked_at: str) -> None: ...
+
+    @abstractmethod
+    def get_link_clicks(self, link_ids: Sequence[int]) -> Dict[int, int]: ...
+
+    @abstractmethod
+    def list_clicked_links(self) -> List[Row]: ...
+
+    @abstractmethod
+    def enqueue_shorten_job(
+        self, user_id: int, chat_id: int, base_url: str, utm_url: str, next_attempt_at: str
+    ) -> int: ...
+
+    @abstractmethod
+    def get_due_shorten_jobs(self, now: str, limit: int) -> List[Row]: ...
+
+    @abstractmethod
+    def reschedule_shorten_job(self, job_id: int, next_attempt_at: str, error: str) -> None: ...
+
+    @abstractmethod
+    def delete_shorten_job(self, job_id: int) -> None: ...
+
+    @abstractmethod
+    def get_shorten_queue_stats(self) -> Tuple[int, Optional[str]]: ...
+
+    @abstractmethod
+    def create_broadcast(self, text: str, created_by: int) -> int: ...
+
+    @abstractmethod
+    def get_broadcast(self, broadcast_id: int) -> Optional[Row]: ...
+
+    @abstractmethod
+    def list_running_broadcasts(self) -> List[Row]: ...
+
+    @abstractmethod
+    def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]: ...
+
+    @abstractmethod
+    def record_broadcast_batch(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked_user_ids: Sequence[int],
+    ) -> None: ...
+
+    @abstractmethod
+    def finish_broadcast(self, broadcast_id: int, status: str) -> None: ...
+
+
+# Как unicode61 remove_diacritics 2: регистр не важен, у латиницы снимаются диакритики
+_LATIN_FOLD = {
+    code: "".join(char for char in unicodedata.normalize("NFD", chr(code)) if not unicodedata.combining(char))
+    for code in range(0xC0, 0x250)
+}
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def _search_tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower().translate(_LATIN_FOLD))
+
+
+def _phrase_in(phrase: List[str], tokens: List[str]) -> bool:
+    """Слова фразы идут подряд, последнее — префикс (как "фраза"* в FTS5)"""
+    *head, last = phrase
+    for start in range(len(tokens) - len(phrase) + 1):
+        if tokens[start:start + len(head)] == head and tokens[start + len(head)].startswith(last):
+            return True
+    return False
+
+
+class InMemoryStorage(Storage):
+    """
+    Хранилище в памяти процесса с той же семантикой, что у SQLite: для
+    тестов и замеров обработчиков без дискового ввода-вывода. Данные не
+    переживают перезапуск. Поиск отбирает те же записи, но сортирует их по
+    свежести, а не по bm25.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._users: Dict[int, dict] = {}
+        self._banned: Dict[int, dict] = {}
+        self._attempts: Dict[int, int] = {}
+        # Как миграция SQLite: пароль из окружения до первой смены
+        self._settings: Dict[str, str] = {"bot_password": settings.bot_access_password}
+        self._history: Dict[int, dict] = {}
+        self._history_by_user: Dict[int, List[int]] = {}
+        # Поисковый индекс: слова каждой записи по полям, слово -> записи, отсортированные слова
+        self._search_tokens: Dict[int, Tuple[List[str], ...]] = {}
+        self._token_ids: Dict[str, Set[int]] = {}
+        self._sorted_tokens: List[str] = []
+        self._next_history_id = 1
+        # Как миграция коротких ссылок: коды начинаются с четырёх символов base62
+        self._sequences: Dict[str, int] = {"short_links": 62 ** 3}
+        self._short_links: Dict[int, str] = {}
+        self._link_clicks: Dict[int, dict] = {}
+        self._jobs: Dict[int, dict] = {}
+        self._next_job_id = 1
+        self._broadcasts: Dict[int, dict] = {}
+        self._next_broadcast_id = 1
+
+    def is_user_authorized(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def authorize_user(self, user_id: int, username: Optional[str]) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                self._users[user_id] = {
+                    "user_id": user_id,
+                    "username": username,
+                    "authorized_at": now,
+                    "bot_blocked_at": None,
+                }
+            else:
+                user["username"] = username
+                user["bot_blocked_at"] = None
+            self._attempts.pop(user_id, None)
+
+    def is_user_banned(self, user_id: int) -> bool:
+        return user_id in self._banned
+
+    def ban_user(self, user_id: int, username: Optional[str], reason: str | None = None) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self._banned.setdefault(
+                user_id, {"user_id": user_id, "username": username, "banned_at": now, "reason": reason}
+            )
+            self._attempts.pop(user_id, None)
+
+    def delete_user(self, user_id: int) -> bool:
+        with self._lock:
+            for history_id in self._history_by_user.pop(user_id, ()):
+                del self._history[history_id]
+                self._unindex(history_id)
+            self._attempts.pop(user_id, None)
+            deleted_from_users = self._users.pop(user_id, None) is not None
+            deleted_from_banned = self._banned.pop(user_id, None) is not None
+        return deleted_from_users or deleted_from_banned
+
+    def _user_table(self, kind: str) -> Dict[int, dict]:
+        table, _, _ = USER_LISTS[kind]
+        return self._users if table == "users" else self._banned
+
+    def count_users(self, kind: str) -> int:
+        return len(self._user_table(kind))
+
+    def get_users_page(
+        self,
+        kind: str,
+        limit: int,
+        cursor: Optional[Tuple[str, int]] = None,
+        backwards: bool = False,
+    ) -> List[UserRow]:
+        _, time_column, columns = USER_LISTS[kind]
+        names = [name.strip() for name in columns.split(",")]
+        with self._lock:
+            rows = list(self._user_table(kind).values())
+
+        def key(row: dict) -> Tuple[str, int]:
+            return row[time_column], row["user_id"]
+
+        if cursor is not None:
+            cursor = tuple(cursor)
+            rows = [row for row in rows if (key(row) > cursor if backwards else key(row) < cursor)]
+        # От новых к старым; backwards — страница перед курсором
+        select = heapq.nsmallest if backwards else heapq.nlargest
+        page = select(limit, rows, key=key)
+        if backwards:
+            page.reverse()
+        return [{name: row[name] for name in names} for row in page]
+
+    def get_auth_attempts(self, user_id: int) -> int:
+        return self._attempts.get(user_id, 0)
+
+    def increment_auth_attempts(self, user_id: int) -> int:
+        with self._lock:
+            attempts = self._attempts[user_id] = self._attempts.get(user_id, 0) + 1
+        return attempts
+
+    def reset_auth_attempts(self, user_id: int) -> None:
+        with self._lock:
+            self._attempts.pop(user_id, None)
+
+    def get_app_settings(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._settings)
+
+    def set_app_setting(self, key: str, value: str) -> None:
+        with self._lock:
+            self._settings[key] = value
+
+    def add_history(self, user_id: int, base_url: str, utm_url: str, short_url: str) -> None:
+        utm_params = extract_utm_params(utm_url)
+        record = {
+            "user_id": user_id,
+            "base_url": base_url,
+            "utm_url": utm_url,
+            "short_url": short_url,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        fields = {"base_url": base_url, "slug": extract_action_slug(base_url), **utm_params}
+        tokens = tuple(_search_tokens(fields.get(name) or "") for name in SEARCH_FIELDS)
+        with self._lock:
+            history_id = self._next_history_id
+            self._next_history_id += 1
+            self._history[history_id] = {"id": history_id, **record}
+            self._history_by_user.setdefault(user_id, []).append(history_id)
+            self._search_tokens[history_id] = tokens
+            for token in {token for column in tokens for token in column}:
+                ids = self._token_ids.get(token)
+                if ids is None:
+                    ids = self._token_ids[token] = set()
+                    insort(self._sorted_tokens, token)
+                ids.add(history_id)
+
+    def _unindex(self, history_id: int) -> None:
+        for token in {token for column in self._search_tokens.pop(history_id) for token in column}:
+            ids = self._token_ids[token]
+            ids.discard(history_id)
+            if not ids:
+                del self._token_ids[token]
+                del self._sorted_tokens[bisect_left(self._sorted_tokens, token)]
+
+    def _phrase_ids(self, phrase: List[str]) -> Set[int]:
+        *head, last = phrase
+        ids: Set[int] = set()
+        index = bisect_left(self._sorted_tokens, last)
+        while index < len(self._sorted_tokens) and self._sorted_tokens[index].startswith(last):
+            ids |= self._token_ids[self._sorted_tokens[index]]
+            index += 1
+        for token in head:
+            ids &= self._token_ids.get(token, set())
+        if head:
+            # Индекс знает только наличие слов; порядок внутри одного поля проверяем отдельно
+            ids = {
+                history_id
+                for history_id in ids
+                if any(_phrase_in(phrase, tokens) for tokens in self._search_tokens[history_id])
+            }
+        return ids
+
+    def get_history(self, user_id: int, limit: int = 50) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            ids = self._history_by_user.get(user_id, [])[-limit:] if limit > 0 else []
+            records = [self._history[history_id] for history_id in reversed(ids)]
+        return [(record["base_url"], record["utm_url"], record["short_url"]) for record in records]
+
+    def iter_history_records(self, user_id: int, batch_size: int = ITER_BATCH_SIZE) -> Iterator[dict]:
+        with self._lock:
+            ids = list(self._history_by_user.get(user_id, ()))
+        for start in range(0, len(ids), batch_size):
+            with self._lock:
+                batch = [dict(self._history[history_id]) for history_id in ids[start:start + batch_size]
+                         if history_id in self._history]
+            yield from batch
+
+    def search_history(self, user_id: int, terms: str, limit: int, offset: int = 0) -> List[dict]:
+        phrases = [_search_tokens(term) for term in terms.split()]
+        if not phrases:
+            return []
+        if not all(phrases):
+            # Пустая фраза в FTS5 ничего не находит
+            return []
+        with self._lock:
+            ids: Set[int] = set(self._history_by_user.get(user_id, ()))
+            for phrase in phrases:
+                if not ids:
+                    return []
+                ids &= self._phrase_ids(phrase)
+            newest = heapq.nlargest(min(offset + limit, SEARCH_CANDIDATE_LIMIT), ids)
+            return [dict(self._history[history_id]) for history_id in newest[offset:]]
+
+    def get_history_before(self, cutoff: str, limit: int) -> List[dict]:
+        with self._lock:
+            # Словарь хранит записи в порядке добавления, то есть по возрастанию id
+            old = (record for record in self._history.values() if record["created_at"] < cutoff)
+            return [dict(record) for record in itertools.islice(old, limit)]
+
+    def delete_history_ids(self, history_ids: Sequence[int]) -> int:
+        deleted = 0
+        with self._lock:
+            for history_id in history_ids:
+                record = self._history.pop(history_id, None)
+                if record is None:
+                    continue
+                self._history_by_user[record["user_id"]].remove(history_id)
+                self._unindex(history_id)
+                deleted += 1
+        return deleted
+
+    def allocate_sequence(self, name: str, count: int) -> range:
+        with self._lock:
+            if name not in self._sequences:
+                raise KeyError(f"Unknown sequence: {name}")
+            start = self._sequences[name]
+            self._sequences[name] = start + count
+        return range(start, start + count)
+
+    def add_short_link(self, link_id: int, target_url: str) -> None:
+        with self._lock:
+            if link_id in self._short_links:
+                raise ValueError(f"Short link {link_id} already exists")
+            self._short_links[link_id] = target_url
+
+    def get_short_link_target(self, link_id: int) -> Optional[str]:
+        return self._short_links.get(link_id)
+
+    def add_link_clicks(self, clicks: Dict[int, int], clicked_at: str) -> None:
+        with self._lock:
+            for link_id, count in clicks.items():
+                row = self._link_clicks.setdefault(link_id, {"link_id": link_id, "clicks": 0})
+                row["clicks"] += count
+                row["last_click_at"] = clicked_at
+
+    def get_link_clicks(self, link_ids: Sequence[int]) -> Dict[int, int]:
+        with self._lock:
+            return {
+                link_id: self._link_clicks[link_id]["clicks"] for link_id in link_ids if link_id in self._link_clicks
+            }
+
+    def list_clicked_links(self) -> List[Row]:
+        with self._lock:
+            return [
+                {"link_id": link_id, "clicks": row["clicks"], "target_url": self._short_links[link_id]}
+                for link_id, row in self._link_clicks.items()
+                if link_id in self._short_links
+            ]
+
+    def enqueue_shorten_job(
+        self, user_id: int, chat_id: int, base_url: str, utm_url: str, next_attempt_at: str
+    ) -> int:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._jobs[job_id] = {
+                "id": job_id,
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "base_url": base_url,
+                "utm_url": utm_url,
+                "attempts": 0,
+                "next_attempt_at": next_attempt_at,
+                "created_at": now,
+                "last_error": None,
+            }
+        return job_id
+
+    def get_due_shorten_jobs(self, now: str, limit: int) -> List[Row]:
+        with self._lock:
+            due = [job for job in self._jobs.values() if job["next_attempt_at"] <= now]
+            due = heapq.nsmallest(limit, due, key=lambda job: (job["next_attempt_at"], job["id"]))
+            return [dict(job) for job in due]
+
+    def reschedule_shorten_job(self, job_id: int, next_attempt_at: str, error: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["attempts"] += 1
+                job["next_attempt_at"] = next_attempt_at
+                job["last_error"] = error
+
+    def delete_shorten_job(self, job_id: int) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def get_shorten_queue_stats(self) -> Tuple[int, Optional[str]]:
+        with self._lock:
+            return len(self._jobs), min((job["created_at"] for job in self._jobs.values()), default=None)
+
+    def create_broadcast(self, text: str, created_by: int) -> int:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            broadcast_id = self._next_broadcast_id
+            self._next_broadcast_id += 1
+            self._broadcasts[broadcast_id] = {
+                "id": broadcast_id,
+                "text": text,
+                "created_by": created_by,
+                "created_at": now,
+                "status": "running",
+                "last_user_id": 0,
+                "sent": 0,
+                "failed": 0,
+                "blocked": 0,
+                "finished_at": None,
+            }
+        return broadcast_id
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Row]:
+        with self._lock:
+            row = self._broadcasts.get(broadcast_id)
+            return dict(row) if row is not None else None
+
+    def list_running_broadcasts(self) -> List[Row]:
+        with self._lock:
+            return [dict(row) for row in self._broadcasts.values() if row["status"] == "running"]
+
+    def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        with self._lock:
+            return heapq.nsmallest(
+                limit,
+                (
+                    user_id
+                    for user_id, user in self._users.items()
+                    if user_id > after_user_id and user["bot_blocked_at"] is None
+                ),
+            )
+
+    def record_broadcast_batch(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked_user_ids: Sequence[int],
+    ) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            for user_id in blocked_user_ids:
+                user = self._users.get(user_id)
+                if user is not None:
+                    user["bot_blocked_at"] = now
+            row = self._broadcasts.get(broadcast_id)
+            if row is not None:
+                row["last_user_id"] = last_user_id
+                row["sent"] += sent
+                row["failed"] += failed
+                row["blocked"] += len(blocked_user_ids)
+
+    def finish_broadcast(self, broadcast_id: int, status: str) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            row = self._broadcasts.get(broadcast_id)
+            if row is not None:
+                row["status"] = status
+                row["finished_at"] = now
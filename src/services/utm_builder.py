@@ -1,24 +1,116 @@
-from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from functools import lru_cache
+from typing import Iterable, List, Mapping, NamedTuple, Optional, Tuple
+from urllib.parse import quote, unquote_plus, urlsplit, urlunsplit
+
+
+UTM_KEYS: Tuple[str, ...] = ("utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term")
+_UTM_KEYS_SET = frozenset(UTM_KEYS)
+# Символы, которые допустимо оставлять без кодирования в значении параметра запроса
+_SAFE_VALUE_CHARS = "-._~!$'()*,;:@/"
+
+
+class ParsedURL(NamedTuple):
+    """
+    Ссылка, один раз разобранная на части.
+    В query хранятся сырые (неизменённые) пары «ключ=значение» без UTM-параметров,
+    в utm — раскодированные UTM-параметры в порядке появления.
+    """
+
+    scheme: str
+    netloc: str
+    path: str
+    query: Tuple[str, ...]
+    fragment: str
+    utm: Tuple[Tuple[str, str], ...]
+
+
+def parse_url(url: str) -> ParsedURL:
+    """
+    Разбирает ссылку один раз: отделяет UTM-параметры от остальных,
+    сохраняя повторяющиеся параметры, их порядок и исходное кодирование.
+    """
+    parts = urlsplit(url.strip())
+    query: List[str] = []
+    utm: List[Tuple[str, str]] = []
+    if parts.query:
+        for pair in parts.query.split("&"):
+            if not pair:
+                continue
+            key, _, value = pair.partition("=")
+            decoded_key = unquote_plus(key)
+            if decoded_key in _UTM_KEYS_SET:
+                utm.append((decoded_key, unquote_plus(value)))
+            else:
+                query.append(pair)
+    return ParsedURL(
+        scheme=parts.scheme.lower(),
+        netloc=_normalize_netloc(parts.netloc),
+        path=parts.path,
+        query=tuple(query),
+        fragment=parts.fragment,
+        utm=tuple(utm),
+    )
+
+
+def _normalize_netloc(netloc: str) -> str:
+    userinfo, at, host = netloc.rpartition("@")
+    return f"{userinfo}{at}{host.lower()}"
+
+
+@lru_cache(maxsize=4096)
+def _encode_value(value: str) -> str:
+    return quote(str(value), safe=_SAFE_VALUE_CHARS)
+
+
+def build_from_parsed(parsed: ParsedURL, utm_params: Mapping[str, Optional[str]]) -> str:
+    """
+    Собирает каноническую ссылку из разобранной базовой ссылки.
+    Существующие UTM-параметры заменяются, пустые значения пропускаются,
+    UTM-параметры всегда идут после остальных в фиксированном порядке.
+    Одинаковые входные данные дают побайтно одинаковую ссылку, поэтому
+    результат можно использовать как ключ кеша.
+    """
+    pieces = list(parsed.query)
+    for key in UTM_KEYS:
+        value = utm_params.get(key)
+        if value:
+            pieces.append(f"{key}={_encode_value(value)}")
+    return urlunsplit((parsed.scheme, parsed.netloc, parsed.path, "&".join(pieces), parsed.fragment))
 
 
 def build_utm_url(base_url: str, utm_source: str, utm_medium: str, utm_campaign: str, utm_content: str = None) -> str:
     """
     Формирует ссылку с добавленными UTM-параметрами.
-    Если в базовой ссылке уже есть параметры, добавляет новые через '&'.
-    """
-    separator = '&' if '?' in base_url else '?'
-    # Избежать двойного разделителя, если ссылка уже заканчивается на '?' или '&'
-    if base_url.endswith('?') or base_url.endswith('&'):
-        separator = ''
-    
-    # Формируем базовые UTM-параметры
-    utm_params = f"utm_source={utm_source}&utm_medium={utm_medium}&utm_campaign={utm_campaign}"
-    
-    # Добавляем utm_content, если он передан
-    if utm_content:
-        utm_params += f"&utm_content={utm_content}"
-    
-    return f"{base_url}{separator}{utm_params}"
+    Значения кодируются, уже существующие UTM-параметры заменяются,
+    якорь (#fragment) и прочие параметры запроса сохраняются.
+    """
+    return build_from_parsed(
+        parse_url(base_url),
+        {
+            "utm_source": utm_source,
+            "utm_medium": utm_medium,
+            "utm_campaign": utm_campaign,
+            "utm_content": utm_content,
+        },
+    )
+
+
+def build_utm_urls(base_url: str, utm_params_list: Iterable[Mapping[str, Optional[str]]]) -> List[str]:
+    """
+    Пакетная сборка: базовая ссылка разбирается один раз,
+    затем для каждого набора UTM-параметров собирается своя ссылка.
+    """
+    parsed = parse_url(base_url)
+    return [build_from_parsed(parsed, utm_params) for utm_params in utm_params_list]
+
+
+def canonical_url(url: str) -> str:
+    """
+    Приводит ссылку к каноническому виду (регистр схемы и хоста,
+    порядок и кодирование UTM-параметров) для использования в качестве ключа.
+    """
+    parsed = parse_url(url)
+    return build_from_parsed(parsed, dict(parsed.utm))
 
 
 def build_utm_url_advanced(base_url: str, utm_params: dict) -> str:
@@ -26,75 +118,49 @@ def build_utm_url_advanced(base_url: str, utm_params: dict) -> str:
     Расширенная версия для формирования ссылки с UTM-параметрами.
     Принимает словарь с UTM-параметрами.
     """
-    parsed = urlparse(base_url)
-    query_params = dict(parse_qsl(parsed.query))
-    
-    # Добавляем или обновляем UTM-параметры
+    parsed = parse_url(base_url)
+    merged = dict(parsed.utm)
     for key, value in utm_params.items():
         if value:  # Добавляем только если значение не пустое
-            query_params[key] = value
-    
-    new_query = urlencode(query_params, doseq=True)
-    
-    return urlunparse((
-        parsed.scheme,
-        parsed.netloc,
-        parsed.path,
-        parsed.params,
-        new_query,
-        parsed.fragment
-    ))
+            merged[key] = value
+
+    # Не-UTM ключи из словаря заменяют одноимённые параметры запроса
+    extra_keys = [key for key in merged if key not in _UTM_KEYS_SET]
+    if extra_keys:
+        kept = tuple(
+            pair for pair in parsed.query
+            if unquote_plus(pair.partition("=")[0]) not in extra_keys
+        )
+        extra = tuple(
+            f"{quote(str(key), safe='')}={_encode_value(merged[key])}" for key in extra_keys
+        )
+        parsed = parsed._replace(query=kept + extra)
+    return build_from_parsed(parsed, merged)
 
 
 def extract_utm_params(url: str) -> dict:
     """
     Извлекает UTM-параметры из ссылки.
     """
-    parsed = urlparse(url)
-    query_params = dict(parse_qsl(parsed.query))
-    
-    utm_params = {}
-    for key in ['utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term']:
-        if key in query_params:
-            utm_params[key] = query_params[key]
-    
-    return utm_params
+    return dict(parse_url(url).utm)
 
 
 def remove_utm_params(url: str) -> str:
     """
     Удаляет все UTM-параметры из ссылки.
     """
-    parsed = urlparse(url)
-    query_params = dict(parse_qsl(parsed.query))
-    
-    # Удаляем UTM-параметры
-    utm_keys = ['utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term']
-    for key in utm_keys:
-        query_params.pop(key, None)
-    
-    new_query = urlencode(query_params, doseq=True)
-    
-    return urlunparse((
-        parsed.scheme,
-        parsed.netloc,
-        parsed.path,
-        parsed.params,
-        new_query,
-        parsed.fragment
-    ))
+    return build_from_parsed(parse_url(url), {})
 
 
 def is_utm_url(url: str) -> bool:
     """
     Проверяет, содержит ли ссылка UTM-параметры.
     """
-    utm_params = extract_utm_params(url)
-    return len(utm_params) > 0
+    return bool(parse_url(url).utm)
 
 
 def validate_utm_params(utm_source: str = None, utm_medium: str = None, utm_campaign: str = None) -> bool:
     """
     Проверяет обязательные UTM-параметры на наличие значений.
     """
-    return all([utm_source, utm_medium, utm_campaign])
\ No newline at end of file
+    return all([utm_source, utm_medium, utm_campaign])
@@ -1,14 +1,180 @@
+import asyncio
 import json
 import os
-from typing import Dict, List, Tuple
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import logging
 
+from src.config import settings
+from src.services.catalog_search import CatalogSearchIndex
+
 logger = logging.getLogger(__name__)
 
+# Обязательные группы внутри mediums и campaigns
+REQUIRED_GROUPS = {
+    "mediums": ("publications", "mailings", "stories", "channels"),
+    "campaigns": ("spb", "msk", "tr", "regions", "foreign"),
+}
+FileSignature = Tuple[int, int]
+# Ключ категории -> (раздел каталога, группа внутри раздела)
+CATEGORY_MAP: Dict[str, Tuple[str, Optional[str]]] = {
+    "source": ("sources", None),
+    "medium_publications": ("mediums", "publications"),
+    "medium_mailings": ("mediums", "mailings"),
+    "medium_stories": ("mediums", "stories"),
+    "medium_channels": ("mediums", "channels"),
+    "campaign_spb": ("campaigns", "spb"),
+    "campaign_msk": ("campaigns", "msk"),
+    "campaign_tr": ("campaigns", "tr"),
+    "campaign_regions": ("campaigns", "regions"),
+    "campaign_foreign": ("campaigns", "foreign"),
+}
+CATALOG_PAGE_SIZE = 20
+
+
+class CatalogEntry(NamedTuple):
+    entry_id: int
+    category: str
+    name: str
+    value: str
+
+
+class CatalogPage(NamedTuple):
+    entries: List[CatalogEntry]
+    page: int
+    pages: int
+    total: int
+    query: Optional[str]
+
+
+class EntryIds:
+    """
+    Короткие числовые идентификаторы меток для callback_data (лимит 64 байта).
+    Идентификатор закрепляется за парой (категория, значение) до перезапуска
+    процесса и не переиспользуется, поэтому старая клавиатура никогда не
+    выберет чужую метку: удалённая просто не находится. Общий для всех
+    поколений индекса; новое поколение собирается в отдельном потоке.
+    """
+
+    def __init__(self) -> None:
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def get(self, category: str, value: str) -> Optional[int]:
+        return self._ids.get((category, value))
+
+    def assign(self, category: str, value: str) -> int:
+        with self._lock:
+            entry_id = self._ids.get((category, value))
+            if entry_id is None:
+                entry_id = self._ids[(category, value)] = self._next_id
+                self._next_id += 1
+            return entry_id
+
+
+class CatalogIndex:
+    """Метки каталога по идентификаторам и категориям и поиск по ним"""
+
+    def __init__(self, ids: Optional[EntryIds] = None) -> None:
+        self._ids = ids if ids is not None else EntryIds()
+        self._entries: Dict[int, CatalogEntry] = {}
+        self._by_category: Dict[str, List[CatalogEntry]] = {}
+        self.search_index = CatalogSearchIndex()
+
+    def _entry_for(self, category: str, name: str, value: str) -> CatalogEntry:
+        return CatalogEntry(self._ids.assign(category, value), category, name, value)
+
+    def rebuilt(self, data: Dict) -> "CatalogIndex":
+        """
+        Новый индекс для data с теми же идентификаторами меток. Текущий индекс
+        не меняется, поэтому сборку можно вести вне event loop.
+        """
+        index = CatalogIndex(self._ids)
+        for category, (main_key, sub_key) in CATEGORY_MAP.items():
+            section = data.get(main_key, {} if sub_key else [])
+            items = section.get(sub_key, []) if sub_key else section
+            category_entries = [self._entry_for(category, name, value) for name, value in items]
+            index._by_category[category] = category_entries
+            for entry in category_entries:
+                index._entries[entry.entry_id] = entry
+                index.search_index.add(entry.entry_id, entry.name, entry.value)
+        return index
+
+    def add(self, category: str, name: str, value: str) -> CatalogEntry:
+        entry = self._entry_for(category, name, value)
+        self._entries[entry.entry_id] = entry
+        self._by_category.setdefault(category, []).append(entry)
+        self.search_index.add(entry.entry_id, name, value)
+        return entry
+
+    def remove(self, category: str, value: str) -> None:
+        entry_id = self._ids.get(category, value)
+        if entry_id is None or self._entries.pop(entry_id, None) is None:
+            return
+        self.search_index.remove(entry_id)
+        self._by_category[category] = [
+            entry for entry in self._by_category.get(category, []) if entry.entry_id != entry_id
+        ]
+
+    def get(self, entry_id: int) -> Optional[CatalogEntry]:
+        return self._entries.get(entry_id)
+
+    def lookup(self, category: str, value: str) -> Optional[CatalogEntry]:
+        entry_id = self._ids.get(category, value)
+        return self._entries.get(entry_id) if entry_id is not None else None
+
+    def find(self, query: str, category: Optional[str] = None, limit: Optional[int] = None) -> List[CatalogEntry]:
+        """Метки по префиксам слов запроса с допуском опечаток, лучшие совпадения первыми"""
+        found = []
+        for entry_id in self.search_index.search(query):
+            entry = self._entries[entry_id]
+            if category is None or entry.category == category:
+                found.append(entry)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def entries(self, category: str, query: Optional[str] = None) -> List[CatalogEntry]:
+        if not query:
+            return self._by_category.get(category, [])
+        return self.find(query, category)
+
+
+def _validate_items(items, path: str) -> None:
+    if not isinstance(items, list):
+        raise ValueError(f"{path} must be a list")
+    for item in items:
+        if (
+            not isinstance(item, list)
+            or len(item) != 2
+            or not all(isinstance(part, str) and part for part in item)
+        ):
+            raise ValueError(f"{path} contains invalid item: {item!r}")
+
+
+def validate_catalog(data) -> None:
+    """Проверяет структуру каталога меток, при ошибке выбрасывает ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("catalog root must be an object")
+    _validate_items(data.get("sources"), "sources")
+    for main_key, groups in REQUIRED_GROUPS.items():
+        section = data.get(main_key)
+        if not isinstance(section, dict):
+            raise ValueError(f"{main_key} must be an object")
+        for group in groups:
+            _validate_items(section.get(group), f"{main_key}.{group}")
+
+
 class UTMManager:
     def __init__(self, data_file: str = "data/utm_data.json"):
         self.data_file = data_file
         self.data_dir = os.path.dirname(data_file)
+        # Номер версии каталога: увеличивается при каждой подмене данных
+        self.version = 0
+        self._file_signature: Optional[FileSignature] = None
+        self.index = CatalogIndex()
         self.ensure_data_file_exists()
         self.load_data()
 
@@ -38,24 +204,97 @@ class UTMManager:
         except Exception as e:
             logger.error(f"Error creating data file: {e}")
 
+    def _stat_signature(self) -> Optional[FileSignature]:
+        try:
+            stat = os.stat(self.data_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_file(self) -> Tuple[Dict, Optional[FileSignature]]:
+        """Читает и проверяет файл каталога, возвращает данные и подпись файла"""
+        signature = self._stat_signature()
+        with open(self.data_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        validate_catalog(data)
+        return data, signature
+
+    def _load_file(self) -> Tuple[CatalogIndex, Dict, Optional[FileSignature]]:
+        """Читает файл и собирает по нему новый индекс; вызывается в отдельном потоке"""
+        data, signature = self._read_file()
+        return self.index.rebuilt(data), data, signature
+
+    def _swap_data(self, index: CatalogIndex, data: Dict, signature: Optional[FileSignature]) -> None:
+        # Только присваивания — читатели видят либо старый, либо новый каталог целиком
+        self.index = index
+        self.data = data
+        self._file_signature = signature
+        self.version += 1
+
     def load_data(self):
         """Загружает данные из JSON файла"""
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
+            data, signature = self._read_file()
         except Exception as e:
             logger.error(f"Error loading data: {e}")
-            self.data = {
+            data = {
                 "sources": [],
                 "mediums": {"publications": [], "mailings": [], "stories": [], "channels": []},
                 "campaigns": {"spb": [], "msk": [], "tr": [], "regions": [], "foreign": []}
             }
+            signature = self._stat_signature()
+        self._swap_data(self.index.rebuilt(data), data, signature)
+
+    async def reload_if_changed(self) -> bool:
+        """
+        Перечитывает каталог, если файл изменился (по mtime и размеру).
+        Разбор и сборка индекса выполняются в отдельном потоке, в event loop
+        только подменяются ссылки. Невалидный файл игнорируется.
+        """
+        signature = self._stat_signature()
+        if signature is None or signature == self._file_signature:
+            return False
+        version = self.version
+        try:
+            index, data, signature = await asyncio.to_thread(self._load_file)
+        except Exception as e:
+            logger.error(f"Catalog file changed but could not be loaded, keeping version {self.version}: {e}")
+            # Запоминаем подпись, чтобы не разбирать тот же битый файл повторно
+            self._file_signature = signature
+            return False
+        if self.version != version:
+            # Пока шла сборка, каталог изменили из бота: сохранённый файл новее прочитанного
+            return False
+        self._swap_data(index, data, signature)
+        logger.info(f"UTM catalog reloaded from {self.data_file}, version {self.version}")
+        return True
+
+    async def watch(self, interval_seconds: float) -> None:
+        """Фоновая проверка файла каталога на изменения"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.reload_if_changed()
+            except Exception:
+                logger.exception("Catalog watcher iteration failed")
 
     def save_data(self):
         """Сохраняет данные в JSON файл"""
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            # Запись через временный файл и os.replace: другие процессы
+            # и наблюдатель никогда не увидят наполовину записанный файл
+            fd, tmp_path = tempfile.mkstemp(dir=self.data_dir or ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, ensure_ascii=False, indent=2)
+                if os.path.exists(self.data_file):
+                    os.chmod(tmp_path, os.stat(self.data_file).st_mode)
+                os.replace(tmp_path, self.data_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._file_signature = self._stat_signature()
+            self.version += 1
             return True
         except Exception as e:
             logger.error(f"Error saving data: {e}")
@@ -78,62 +317,53 @@ class UTMManager:
 
     def get_category_data(self, category_key: str) -> List[Tuple[str, str]]:
         """Возвращает данные для конкретной категории"""
-        category_map = {
-            "source": ("sources", None),
-            "medium_publications": ("mediums", "publications"),
-            "medium_mailings": ("mediums", "mailings"),
-            "medium_stories": ("mediums", "stories"),
-            "medium_channels": ("mediums", "channels"),
-            "campaign_spb": ("campaigns", "spb"),
-            "campaign_msk": ("campaigns", "msk"),
-            "campaign_tr": ("campaigns", "tr"),
-            "campaign_regions": ("campaigns", "regions"),
-            "campaign_foreign": ("campaigns", "foreign")
-        }
-        
-        if category_key in category_map:
-            main_key, sub_key = category_map[category_key]
+        if category_key in CATEGORY_MAP:
+            main_key, sub_key = CATEGORY_MAP[category_key]
             if sub_key:
                 return self.data[main_key][sub_key]
             else:
                 return self.data[main_key]
         return []
 
+    def get_page(
+        self,
+        category_key: str,
+        page: int,
+        query: Optional[str] = None,
+        page_size: int = CATALOG_PAGE_SIZE,
+    ) -> CatalogPage:
+        """
+        Возвращает страницу меток категории. С запросом — только метки, у которых
+        каждое слово запроса совпадает с началом слова названия или значения
+        (допускаются опечатки); точные совпадения идут первыми.
+        """
+        entries = self.index.entries(category_key, query)
+        pages = max(1, -(-len(entries) // page_size))
+        page = min(max(page, 0), pages - 1)
+        start = page * page_size
+        return CatalogPage(entries[start:start + page_size], page, pages, len(entries), query)
+
     def add_item(self, category_key: str, name: str, value: str) -> bool:
         """Добавляет новый элемент в категорию"""
         try:
-            category_map = {
-                "source": ("sources", None),
-                "medium_publications": ("mediums", "publications"),
-                "medium_mailings": ("mediums", "mailings"),
-                "medium_stories": ("mediums", "stories"),
-                "medium_channels": ("mediums", "channels"),
-                "campaign_spb": ("campaigns", "spb"),
-                "campaign_msk": ("campaigns", "msk"),
-                "campaign_tr": ("campaigns", "tr"),
-                "campaign_regions": ("campaigns", "regions"),
-                "campaign_foreign": ("campaigns", "foreign")
-            }
-            
-            if category_key not in category_map:
+            if category_key not in CATEGORY_MAP:
                 return False
             
-            main_key, sub_key = category_map[category_key]
+            main_key, sub_key = CATEGORY_MAP[category_key]
             item = [name, value]
             
+            # Проверяем на дубликаты
+            if self.index.lookup(category_key, value) is not None:
+                return False
             if sub_key:
-                # Проверяем на дубликаты
-                existing_items = self.data[main_key][sub_key]
-                if any(existing_item[1] == value for existing_item in existing_items):
-                    return False
                 self.data[main_key][sub_key].append(item)
             else:
-                # Проверяем на дубликаты
-                if any(existing_item[1] == value for existing_item in self.data[main_key]):
-                    return False
                 self.data[main_key].append(item)
             
-            return self.save_data()
+            if not self.save_data():
+                return False
+            self.index.add(category_key, name, value)
+            return True
         except Exception as e:
             logger.error(f"Error adding item: {e}")
             return False
@@ -141,23 +371,10 @@ class UTMManager:
     def delete_item(self, category_key: str, value: str) -> bool:
         """Удаляет элемент из категории"""
         try:
-            category_map = {
-                "source": ("sources", None),
-                "medium_publications": ("mediums", "publications"),
-                "medium_mailings": ("mediums", "mailings"),
-                "medium_stories": ("mediums", "stories"),
-                "medium_channels": ("mediums", "channels"),
-                "campaign_spb": ("campaigns", "spb"),
-                "campaign_msk": ("campaigns", "msk"),
-                "campaign_tr": ("campaigns", "tr"),
-                "campaign_regions": ("campaigns", "regions"),
-                "campaign_foreign": ("campaigns", "foreign")
-            }
-            
-            if category_key not in category_map:
+            if category_key not in CATEGORY_MAP:
                 return False
             
-            main_key, sub_key = category_map[category_key]
+            main_key, sub_key = CATEGORY_MAP[category_key]
             
             if sub_key:
                 self.data[main_key][sub_key] = [
@@ -170,10 +387,13 @@ class UTMManager:
                     if item[1] != value
                 ]
             
-            return self.save_data()
+            if not self.save_data():
+                return False
+            self.index.remove(category_key, value)
+            return True
         except Exception as e:
             logger.error(f"Error deleting item: {e}")
             return False
 
 # Глобальный экземпляр менеджера
-utm_manager = UTMManager()
\ No newline at end of file
+utm_manager = UTMManager(settings.utm_data_path)
\ No newline at end of file
@@ -1,4 +1,6 @@
-from typing import Dict, Optional, Set
+from typing import Any, Dict, Optional, Set
+
+from src.utils.keyed_lock import KeyedLock
 
 
 UserSessionData = Dict[str, Optional[str]]
@@ -7,10 +9,29 @@ UtmEditingStorage = Dict[int, Dict[str, Optional[str]]]
 PendingAuthUsers = Set[int]
 PendingPasswordChangeUsers = Set[int]
 PendingUserDeletion = Set[int]
+PendingBroadcastUsers = Set[int]
+BroadcastDrafts = Dict[int, str]
+PendingSettingEdits = Dict[int, str]
+SearchQueries = Dict[int, str]
+CatalogFilters = Dict[int, Dict[str, Optional[str]]]
+MatrixSessions = Dict[int, Dict[str, Any]]
 
 # In-memory storages. For now simple dicts are sufficient.
+# Per-user lock for sections that read and rewrite a user's session. It is held
+# only around the state itself, never across Telegram or shortener calls, so
+# other updates of the same user and identical in-flight requests are not blocked.
+session_locks = KeyedLock()
 user_data: UserDataStorage = {}
 utm_editing_data: UtmEditingStorage = {}
 pending_password_users: PendingAuthUsers = set()
 pending_password_change_users: PendingPasswordChangeUsers = set()
 pending_user_deletion: PendingUserDeletion = set()
+pending_broadcast_users: PendingBroadcastUsers = set()
+broadcast_drafts: BroadcastDrafts = {}
+# Ключ параметра из меню «Параметры работы», для которого ждём новое значение
+pending_setting_edits: PendingSettingEdits = {}
+search_queries: SearchQueries = {}
+# Поиск по клавиатуре каталога: kind, category, query и флаг awaiting ("1", пока ждём текст)
+catalog_filters: CatalogFilters = {}
+# Матрица ссылок: base_url (None, пока ждём ссылку), шаг, вкладка, страница и выбранные значения по шагам
+matrix_sessions: MatrixSessions = {}
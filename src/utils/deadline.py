@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised by within_deadline when the update's budget ran out during a stage"""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget of one update; stages that ran out of it are listed in exceeded"""
+
+    __slots__ = ("seconds", "expires_at", "exceeded")
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.exceeded: List[str] = []
+
+    def remaining(self, reserve: float = 0.0) -> float:
+        return max(0.0, self.expires_at - time.monotonic() - reserve)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[Deadline]:
+    """Make a fresh budget current for the code (and tasks it spawns) inside the block"""
+    deadline = Deadline(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+async def within_deadline(awaitable: Awaitable[T], stage: str, reserve: float = 0.0) -> T:
+    """
+    Await a stage with whatever is left of the current budget, keeping
+    reserve seconds for the stages after it. Without a current deadline
+    the awaitable runs unbounded.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, deadline.remaining(reserve))
+    except asyncio.TimeoutError:
+        deadline.exceeded.append(stage)
+        raise DeadlineExceeded(stage) from None
+
+
+class DeadlineStats:
+    """Per-handler counts of updates run under a deadline and of those that hit it"""
+
+    def __init__(self) -> None:
+        self.updates: Counter = Counter()
+        self.hits: Counter = Counter()
+        self.stage_hits: Counter = Counter()
+
+    def record(self, handler: str, deadline: Deadline) -> None:
+        self.updates[handler] += 1
+        if deadline.exceeded:
+            self.hits[handler] += 1
+            for stage in set(deadline.exceeded):
+                self.stage_hits[(handler, stage)] += 1
+
+    def hit_rate(self, handler: str) -> Optional[float]:
+        total = self.updates[handler]
+        return self.hits[handler] / total if total else None
+
+    def snapshot(self) -> Tuple[Dict[str, int], Dict[str, int], Dict[Tuple[str, str], int]]:
+        return dict(self.updates), dict(self.hits), dict(self.stage_hits)
+
+
+deadline_stats = DeadlineStats()
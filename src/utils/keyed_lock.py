@@ -0,0 +1,57 @@
+import asyncio
+from typing import Dict, Hashable
+
+
+class _Hold:
+    __slots__ = ("_owner", "_key", "_lock")
+
+    def __init__(self, owner: "KeyedLock", key: Hashable) -> None:
+        self._owner = owner
+        self._key = key
+        self._lock: asyncio.Lock
+
+    async def __aenter__(self) -> None:
+        entries = self._owner._entries
+        entry = entries.get(self._key)
+        if entry is None:
+            entry = entries[self._key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._lock = entry[0]
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            self._owner._leave(self._key)
+            raise
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._lock.release()
+        self._owner._leave(self._key)
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on first use and dropped as soon as
+    nobody holds or waits for it, so the table only contains active keys.
+    Waiters for the same key are served in FIFO order; different keys never
+    block each other.
+    """
+
+    def __init__(self) -> None:
+        # key -> [lock, number of holders and waiters]
+        self._entries: Dict[Hashable, list] = {}
+
+    def hold(self, key: Hashable) -> _Hold:
+        return _Hold(self, key)
+
+    def _leave(self, key: Hashable) -> None:
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._entries[key]
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts
+    the call, later callers await the same task and get the same result or
+    exception. A key is only shared while its call is running, so a failure
+    reaches everyone who was waiting for it but the next call starts afresh.
+    A waiter that is cancelled leaves the others alone; the call itself is
+    cancelled only when nobody waits for it any more.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        # A finished call may still be listed until its done callback runs
+        if call is None or call.task.done():
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                # The task is done only on the next loop step: a caller arriving
+                # before that must start a new call, not join the cancelled one
+                self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
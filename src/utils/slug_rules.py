@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import SplitResult, parse_qs, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+# Host key whose rules apply to every host after its own rules
+DEFAULT_HOST = "*"
+DEFAULT_RULES: Dict[str, List[Dict[str, object]]] = {
+    DEFAULT_HOST: [{"path": r"/actions/([^/]+)"}, {"segment": -1}],
+}
+SLUG_CACHE_SIZE = 65536
+
+Matcher = Callable[[SplitResult], Optional[str]]
+FileSignature = Tuple[int, int]
+
+
+def _path_matcher(pattern: str) -> Matcher:
+    regex = re.compile(pattern)
+    group = "slug" if "slug" in regex.groupindex else (1 if regex.groups else 0)
+
+    def match(parts: SplitResult) -> Optional[str]:
+        found = regex.search(parts.path)
+        return found.group(group) if found else None
+
+    return match
+
+
+def _query_matcher(name: str) -> Matcher:
+    def match(parts: SplitResult) -> Optional[str]:
+        if not parts.query:
+            return None
+        values = parse_qs(parts.query).get(name)
+        return values[0] if values else None
+
+    return match
+
+
+def _segment_matcher(index: int) -> Matcher:
+    def match(parts: SplitResult) -> Optional[str]:
+        segments = [segment for segment in parts.path.split("/") if segment]
+        try:
+            return segments[index]
+        except IndexError:
+            return None
+
+    return match
+
+
+def compile_rule(rule: Mapping[str, object]) -> Matcher:
+    """
+    Turn one rule into a matcher. Supported rules:
+    {"path": "<regex>"} (named group "slug", else the first group),
+    {"query": "<param>"} and {"segment": <index into path segments>}.
+    """
+    if not isinstance(rule, Mapping) or len(rule) != 1:
+        raise ValueError(f"rule must be an object with exactly one key: {rule!r}")
+    kind, argument = next(iter(rule.items()))
+    if kind == "path" and isinstance(argument, str):
+        try:
+            return _path_matcher(argument)
+        except re.error as exc:
+            raise ValueError(f"invalid path pattern {argument!r}: {exc}") from exc
+    if kind == "query" and isinstance(argument, str) and argument:
+        return _query_matcher(argument)
+    if kind == "segment" and isinstance(argument, int) and not isinstance(argument, bool):
+        return _segment_matcher(argument)
+    raise ValueError(f"unsupported rule: {rule!r}")
+
+
+def normalize_host(host: str) -> str:
+    host = host.lower().rstrip(".")
+    return host[4:] if host.startswith("www.") else host
+
+
+def compile_rules(table: Mapping[str, Sequence[Mapping[str, object]]]) -> Dict[str, Tuple[Matcher, ...]]:
+    """Validate a host -> rules table and compile it, raising ValueError on errors"""
+    if not isinstance(table, Mapping):
+        raise ValueError("slug rules root must be an object")
+    compiled: Dict[str, Tuple[Matcher, ...]] = {}
+    for host, rules in table.items():
+        if not isinstance(rules, list):
+            raise ValueError(f"rules for {host!r} must be a list")
+        key = host if host == DEFAULT_HOST else normalize_host(host)
+        compiled[key] = tuple(compile_rule(rule) for rule in rules)
+    return compiled
+
+
+class SlugRules:
+    """
+    Per-host slug extraction rules. Rules for a host are tried in order,
+    then those of its parent domains, then the DEFAULT_HOST rules; the
+    first non-empty match wins. Results are kept in an LRU cache that is
+    replaced together with the rules on reload.
+    """
+
+    def __init__(self, table: Optional[Mapping] = None, cache_size: int = SLUG_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self.path: Optional[str] = None
+        self._file_signature: Optional[FileSignature] = None
+        self._swap(compile_rules(table if table is not None else DEFAULT_RULES))
+
+    def _swap(self, compiled: Dict[str, Tuple[Matcher, ...]]) -> None:
+        host_cache: Dict[str, Tuple[Matcher, ...]] = {}
+        default = compiled.get(DEFAULT_HOST, ())
+
+        def matchers_for(host: str) -> Tuple[Matcher, ...]:
+            matchers = host_cache.get(host)
+            if matchers is None:
+                chain: List[Matcher] = []
+                labels = host.split(".")
+                for start in range(len(labels)):
+                    chain.extend(compiled.get(".".join(labels[start:]), ()))
+                matchers = host_cache[host] = tuple(chain) + default
+            return matchers
+
+        def extract(url: str) -> str:
+            try:
+                parts = urlsplit(url)
+                for matcher in matchers_for(normalize_host(parts.hostname or "")):
+                    slug = matcher(parts)
+                    if slug:
+                        return slug
+            except Exception as exc:  # pragma: no cover - defensive logging
+                logger.error("Error extracting action slug from %s: %s", url, exc)
+            return "event"
+
+        # One assignment: callers see either the old or the new rules with their own cache
+        self._extract = lru_cache(maxsize=self.cache_size)(extract)
+
+    def extract(self, url: str) -> str:
+        return self._extract(url)
+
+    def _stat_signature(self) -> Optional[FileSignature]:
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_file(self) -> Tuple[Dict[str, Tuple[Matcher, ...]], Optional[FileSignature]]:
+        signature = self._stat_signature()
+        with open(self.path, "r", encoding="utf-8") as rules_file:
+            table = json.load(rules_file)
+        return compile_rules(table), signature
+
+    def load(self, path: str) -> bool:
+        """
+        Use rules from a JSON file ({"host": [rule, ...]}). A missing file
+        keeps the built-in rules, an invalid one keeps the current rules.
+        """
+        self.path = path
+        return self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        signature = self._stat_signature()
+        if signature is None or signature == self._file_signature:
+            return False
+        try:
+            compiled, signature = self._read_file()
+        except (OSError, ValueError) as exc:
+            logger.error("Slug rules in %s could not be loaded, keeping current rules: %s", self.path, exc)
+            # Remember the signature so the same broken file is not parsed again
+            self._file_signature = signature
+            return False
+        self._swap(compiled)
+        self._file_signature = signature
+        logger.info("Slug rules reloaded from %s: %s hosts", self.path, len(compiled))
+        return True
+
+    async def watch(self, interval_seconds: float) -> None:
+        """Background check of the rules file for changes"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                self.reload_if_changed()
+            except Exception:
+                logger.exception("Slug rules watcher iteration failed")
+
+
+slug_rules = SlugRules()
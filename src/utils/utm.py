@@ -1,33 +1,14 @@
 import datetime
-import logging
-import re
 from typing import Optional
-from urllib.parse import urlparse
 
-
-logger = logging.getLogger(__name__)
-
-
-ACTION_PATTERN = re.compile(r"/actions/([^/]+)")
+from src.utils.slug_rules import slug_rules
 
 
 def extract_action_slug(url: str) -> str:
     """
-    Extract slug portion of a GorBilet URL for utm_content.
+    Extract the slug for utm_content using the per-host rules in slug_rules.
     """
-    try:
-        parsed = urlparse(url)
-        match = ACTION_PATTERN.search(parsed.path)
-        if match:
-            return match.group(1)
-
-        segments = [segment for segment in parsed.path.split("/") if segment]
-        if segments:
-            return segments[-1]
-    except Exception as exc:  # pragma: no cover - defensive logging
-        logger.error("Error extracting action slug from %s: %s", url, exc)
-
-    return "event"
+    return slug_rules.extract(url)
 
 
 def build_utm_content_with_date(base_slug: str, date_str: Optional[str] = None) -> str:
@@ -44,3 +25,13 @@ def build_utm_content_with_date(base_slug: str, date_str: Optional[str] = None)
         formatted_date = date_str.replace("-", "")
 
     return f"{base_slug}-{formatted_date}"
+
+
+def format_generation_result(base_url: str, full_url: str, short_url: str) -> str:
+    """
+    Build the message text with the original, UTM-tagged and shortened links.
+    """
+    lines = ["✅ Результаты генерации ссылок:", f"🔗 Исходная:\n{base_url}"]
+    lines.append("\n🧩 С UTM:\n" + full_url)
+    lines.append("✂️ Сокращённая:\n" + short_url)
+    return "\n\n".join(lines)
@@ -0,0 +1,78 @@
+import atexit
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+
+# Settings are read at import time: give the tests their own values and
+# keep every file the bot writes inside a throwaway directory
+_scratch = tempfile.mkdtemp(prefix="utm-bot-tests-")
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
+os.environ.setdefault("BOT_TOKEN", "123456:TEST-token")
+os.environ.setdefault("CLC_API_KEY", "test-key")
+os.environ.setdefault("BOT_ACCESS_PASSWORD", "test-password")
+os.environ.setdefault("DATABASE_PATH", os.path.join(_scratch, "bot_state.sqlite3"))
+os.environ.setdefault("HISTORY_ARCHIVE_DIR", os.path.join(_scratch, "archive"))
+
+from src.services.database import DatabaseManager  # noqa: E402
+from src.services.storage import InMemoryStorage  # noqa: E402
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def engine(request, tmp_path):
+    """Every Storage implementation; tests that use it form the conformance suite"""
+    if request.param == "memory":
+        yield InMemoryStorage()
+        return
+    db = DatabaseManager(str(tmp_path / "state.sqlite3"))
+    yield db
+    db.close()
+
+
+# Schema of the bot before migrations existed (user_version 0), with full URLs in history
+LEGACY_SCHEMA = """
+CREATE TABLE users (user_id INTEGER PRIMARY KEY, authorized_at TEXT NOT NULL);
+CREATE TABLE banned_users (user_id INTEGER PRIMARY KEY, banned_at TEXT NOT NULL, reason TEXT);
+CREATE TABLE auth_attempts (user_id INTEGER PRIMARY KEY, attempts INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE app_settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    base_url TEXT NOT NULL,
+    utm_url TEXT NOT NULL,
+    short_url TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+"""
+LEGACY_HISTORY = [
+    # Rebuildable by the canonical builder
+    (3, 1, "https://www.gorbilet.com/actions/hamlet/",
+     "https://www.gorbilet.com/actions/hamlet/?utm_source=vk&utm_medium=post&utm_campaign=spring&utm_content=hamlet",
+     "https://s.ex/a", "2024-01-01T00:00:00"),
+    # Old concatenation: fragment in the middle, so the full URL has to be kept
+    (7, 1, "https://www.gorbilet.com/actions/onegin/#top",
+     "https://www.gorbilet.com/actions/onegin/#top?utm_source=tg&utm_medium=post&utm_campaign=spring",
+     "https://s.ex/b", "2024-01-02T00:00:00"),
+    (9, 2, "https://www.gorbilet.com/actions/hamlet/",
+     "https://www.gorbilet.com/actions/hamlet/?utm_source=vk&utm_medium=post&utm_campaign=spring&utm_content=hamlet",
+     "https://s.ex/c", "2024-01-03T00:00:00"),
+]
+
+
+@pytest.fixture
+def legacy_db_path(tmp_path):
+    """A database file as the bot left it before migrations existed"""
+    path = tmp_path / "legacy.sqlite3"
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    connection.executemany("INSERT INTO users (user_id, authorized_at) VALUES (?, '2024-01-01')", [(1,), (2,)])
+    connection.executemany(
+        "INSERT INTO history (id, user_id, base_url, utm_url, short_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        LEGACY_HISTORY,
+    )
+    connection.commit()
+    connection.close()
+    return path
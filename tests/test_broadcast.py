@@ -0,0 +1,125 @@
+import asyncio
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from src.services.broadcast import Broadcaster
+from src.services.storage import InMemoryStorage
+
+
+class FakeBroadcastDb:
+    def __init__(self, users):
+        self.users = users
+        self.row = {"id": 1, "text": "hello", "last_user_id": 0, "sent": 0, "failed": 0, "blocked": 0, "created_by": 1}
+
+    def get_broadcast(self, broadcast_id):
+        return dict(self.row)
+
+    def get_broadcast_recipients(self, after_user_id, limit):
+        return [user_id for user_id in self.users if user_id > after_user_id][:limit]
+
+    def record_broadcast_batch(self, broadcast_id, last_user_id, sent, failed, blocked_user_ids):
+        self.row["last_user_id"] = last_user_id
+        self.row["sent"] += sent
+
+    def finish_broadcast(self, broadcast_id, status):
+        self.row["status"] = status
+
+
+class CountingBot:
+    """Remembers the peak number of concurrent sends per batch of recipients"""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.in_flight = 0
+        self.peaks = {}
+        self.on_send = None
+
+    async def send_message(self, chat_id, text):
+        if chat_id == 1:
+            # Report to the author at the end of the broadcast
+            return
+        batch = (chat_id - 2) // self.batch_size
+        self.in_flight += 1
+        self.peaks[batch] = max(self.peaks.get(batch, 0), self.in_flight)
+        if self.on_send is not None:
+            self.on_send(chat_id)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+
+def test_max_in_flight_change_applies_to_running_broadcast():
+    db = FakeBroadcastDb(users=list(range(2, 2 + 60)))
+    broadcaster = Broadcaster(db, rate=0, batch_size=20, max_in_flight=2)
+    bot = CountingBot(batch_size=20)
+
+    def raise_limit(chat_id):
+        # The tunable is changed while the first batch is being sent
+        if chat_id == 2:
+            broadcaster.max_in_flight = 10
+
+    bot.on_send = raise_limit
+    asyncio.run(broadcaster.run(bot, 1))
+
+    assert db.row["status"] == "done"
+    assert db.row["sent"] == 60
+    assert bot.peaks[0] == 2
+    assert bot.peaks[1] == 10
+    assert bot.peaks[2] == 10
+
+
+class RecordingBot:
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.delivered = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(SendMessage(chat_id=chat_id, text=text), "bot was blocked by the user")
+        self.delivered.append(chat_id)
+
+
+def test_broadcast_reaches_users_of_the_memory_backend():
+    storage = InMemoryStorage()
+    for user_id in (10, 20, 30):
+        storage.authorize_user(user_id, None)
+    broadcaster = Broadcaster(storage, rate=0, batch_size=2, max_in_flight=2)
+
+    async def scenario(bot):
+        broadcast_id = await broadcaster.start(bot, "hello", created_by=10)
+        await broadcaster._tasks[broadcast_id]
+        return storage.get_broadcast(broadcast_id)
+
+    bot = RecordingBot(blocked={20})
+    row = asyncio.run(scenario(bot))
+    # The last delivery is the summary for the author
+    assert bot.delivered == [10, 30, 10]
+    assert (row["status"], row["sent"], row["blocked"]) == ("done", 2, 1)
+
+    second = RecordingBot()
+    asyncio.run(scenario(second))
+    assert second.delivered == [10, 30, 10]
+
+
+class FailingBroadcastDb(FakeBroadcastDb):
+    def record_broadcast_batch(self, broadcast_id, last_user_id, sent, failed, blocked_user_ids):
+        raise RuntimeError("database is locked")
+
+
+def test_broadcast_that_hits_an_error_is_logged_and_marked_failed(caplog):
+    db = FailingBroadcastDb(users=[2, 3, 4])
+    broadcaster = Broadcaster(db, rate=0, batch_size=2, max_in_flight=2)
+    bot = RecordingBot()
+
+    async def scenario():
+        broadcaster._spawn(bot, 1)
+        await broadcaster._tasks[1]
+        return broadcaster.running()
+
+    with caplog.at_level("ERROR", logger="src.services.broadcast"):
+        assert asyncio.run(scenario()) is None
+
+    assert db.row["status"] == "failed"
+    assert bot.delivered == [2, 3]
+    assert "Broadcast 1 failed" in caplog.text
+    assert "database is locked" in caplog.text
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+from src.services.utm_manager import CatalogIndex, UTMManager
+
+
+def _catalog(sources):
+    return {
+        "sources": [list(source) for source in sources],
+        "mediums": {"publications": [], "mailings": [], "stories": [], "channels": []},
+        "campaigns": {"spb": [], "msk": [], "tr": [], "regions": [], "foreign": []},
+    }
+
+
+def _write(path, data):
+    # A different size is enough for the watcher to notice even within one mtime tick
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    path = tmp_path / "utm_data.json"
+    _write(path, _catalog([("ВКонтакте", "vk"), ("Телеграм", "tg")]))
+    return UTMManager(str(path))
+
+
+def test_reload_swaps_in_a_new_index_and_keeps_entry_ids(manager, tmp_path):
+    vk = manager.index.lookup("source", "vk")
+    old_index = manager.index
+    _write(tmp_path / "utm_data.json", _catalog([("ВКонтакте", "vk"), ("Одноклассники", "ok")]))
+
+    assert asyncio.run(manager.reload_if_changed())
+
+    assert manager.index is not old_index
+    assert manager.index.lookup("source", "vk") == vk
+    assert manager.index.lookup("source", "tg") is None
+    assert [entry.value for entry in manager.index.find("однокл")] == ["ok"]
+    # The previous generation is left intact for readers that still hold it
+    assert old_index.lookup("source", "tg") is not None
+    assert old_index.find("однокл") == []
+
+
+def test_index_is_built_off_the_event_loop(manager, tmp_path, monkeypatch):
+    threads = []
+    rebuilt = CatalogIndex.rebuilt
+
+    def record_thread(self, data):
+        threads.append(threading.current_thread())
+        return rebuilt(self, data)
+
+    monkeypatch.setattr(CatalogIndex, "rebuilt", record_thread)
+    _write(tmp_path / "utm_data.json", _catalog([("Дзен", "dzen")]))
+
+    async def reload():
+        assert await manager.reload_if_changed()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(reload())
+    assert threads and loop_thread not in threads
+
+
+def test_label_added_during_a_reload_is_not_lost(manager, tmp_path, monkeypatch):
+    building = threading.Event()
+    release = threading.Event()
+    rebuilt = CatalogIndex.rebuilt
+
+    def slow_rebuild(self, data):
+        building.set()
+        release.wait(5)
+        return rebuilt(self, data)
+
+    monkeypatch.setattr(CatalogIndex, "rebuilt", slow_rebuild)
+    _write(tmp_path / "utm_data.json", _catalog([("ВКонтакте", "vk"), ("Телеграм", "tg"), ("Дзен", "dzen")]))
+
+    async def scenario():
+        reload = asyncio.create_task(manager.reload_if_changed())
+        await asyncio.to_thread(building.wait, 5)
+        # An admin adds a label from the bot while the file is being indexed
+        assert manager.add_item("source", "Рутуб", "rutube")
+        release.set()
+        return await reload
+
+    assert asyncio.run(scenario()) is False
+    assert manager.index.lookup("source", "rutube") is not None
+    assert ["Рутуб", "rutube"] in manager.data["sources"]
+    assert not asyncio.run(manager.reload_if_changed())
+
+
+def test_broken_file_keeps_the_current_catalog(manager, tmp_path):
+    index = manager.index
+    (tmp_path / "utm_data.json").write_text("{not json", encoding="utf-8")
+
+    assert not asyncio.run(manager.reload_if_changed())
+    assert manager.index is index
+    assert manager.index.lookup("source", "vk") is not None
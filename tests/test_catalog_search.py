@@ -0,0 +1,113 @@
+"""CatalogSearchIndex against a brute-force model on seeded random catalogs"""
+import random
+
+import pytest
+
+from src.services.catalog_search import CatalogSearchIndex, prefix_distance, tokenize
+
+
+LABELS = [
+    ("Москва", "msk"),
+    ("Спектакли", "spektakl"),
+    ("Рассылка", "rassilka"),
+    ("Карелия", "kareliya"),
+    ("Аквапарк", "akvapark"),
+    ("Театр", "teatr"),
+]
+WORDS = ["спектакли", "театр", "москва", "ёлка", "карелия", "рассылка", "post", "clip", "msk", "kareliya"]
+
+
+def _catalog(rng, size):
+    entries = {}
+    for entry_id in range(1, size + 1):
+        words = rng.sample(WORDS, rng.randint(1, 3))
+        entries[entry_id] = (" ".join(word.capitalize() for word in words), "_".join(words) + f"_{entry_id}")
+    return entries
+
+
+def _index(entries):
+    index = CatalogSearchIndex()
+    for entry_id, (name, value) in entries.items():
+        index.add(entry_id, name, value)
+    return index
+
+
+def _prefix_model(entries, query):
+    terms = tokenize(query)
+    return {
+        entry_id
+        for entry_id, (name, value) in entries.items()
+        if terms and all(any(token.startswith(term) for token in tokenize(name + " " + value)) for term in terms)
+    }
+
+
+def _random_query(rng):
+    words = rng.sample(WORDS, rng.randint(1, 2))
+    return " ".join(word[: rng.randint(1, len(word))] for word in words)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_exact_hits_match_the_model_and_rank_first(seed):
+    rng = random.Random(seed)
+    entries = _catalog(rng, 60)
+    index = _index(entries)
+    for _ in range(10):
+        query = _random_query(rng)
+        expected = _prefix_model(entries, query)
+        found = index.search(query)
+        assert set(found[: len(expected)]) == expected
+        if expected:
+            # Exact hits fill the limit, so typo matches are not even looked up
+            assert set(index.search(query, limit=len(expected))) == expected
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_incremental_updates_match_a_fresh_index(seed):
+    rng = random.Random(seed)
+    entries = _catalog(rng, 40)
+    index = _index(entries)
+    for entry_id in rng.sample(sorted(entries), 15):
+        index.remove(entry_id)
+        del entries[entry_id]
+    for entry_id, (name, value) in _catalog(rng, 50).items():
+        if entry_id in entries or rng.random() < 0.3:
+            entries[entry_id] = (name, value)
+            index.add(entry_id, name, value)
+
+    fresh = _index(entries)
+    assert len(index) == len(entries)
+    for query in ("спек", "масква", "karelia", "post msk", "ел", "расылка"):
+        assert index.search(query) == fresh.search(query)
+
+
+def test_removing_every_entry_leaves_no_tokens():
+    index = _index(_catalog(random.Random(0), 30))
+    for entry_id in range(1, 31):
+        index.remove(entry_id)
+    index.remove(99)
+    assert len(index) == 0
+    assert index.search("спектакли") == []
+    assert not index._token_entries and not index._sorted_tokens and not index._trigram_tokens
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [("масква", 1), ("спектакди", 2), ("расылка", 3), ("karelia", 4), ("akvapakr", 5)],
+)
+def test_typos_find_the_intended_entry_first(query, expected):
+    index = _index(dict(enumerate(LABELS, start=1)))
+    assert index.search(query, limit=1) == [expected]
+
+
+def test_yo_and_case_are_folded():
+    index = CatalogSearchIndex()
+    index.add(1, "Ёлка в Москве", "elka_msk")
+    assert index.search("елка") == index.search("ЁЛКА") == [1]
+
+
+@pytest.mark.parametrize(
+    "query, token, limit, expected",
+    [("mosk", "moskva", 1, 0), ("masq", "moskva", 1, None), ("masq", "moskva", 2, 2), ("", "x", 0, 0)],
+)
+def test_prefix_distance(query, token, limit, expected):
+    assert prefix_distance(query, token, limit) == expected
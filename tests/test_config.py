@@ -0,0 +1,24 @@
+import pytest
+from pydantic import ValidationError
+
+from src.config import MIN_GENERATION_DEADLINE_SECONDS, Settings
+from src.handlers.utm_generation import REPLY_RESERVE_SECONDS, WRITE_RESERVE_SECONDS
+
+
+def test_generation_minimum_leaves_time_for_the_shortener():
+    assert MIN_GENERATION_DEADLINE_SECONDS >= WRITE_RESERVE_SECONDS + REPLY_RESERVE_SECONDS + 1.0
+
+
+@pytest.mark.parametrize("seconds", [0.5, 2.5, MIN_GENERATION_DEADLINE_SECONDS - 0.1])
+def test_generation_deadline_below_the_reserves_is_rejected(seconds):
+    with pytest.raises(ValidationError, match="generation_deadline_seconds"):
+        Settings(generation_deadline_seconds=seconds)
+
+
+@pytest.mark.parametrize("seconds", [0, MIN_GENERATION_DEADLINE_SECONDS, 10.0])
+def test_generation_deadline_accepts_zero_and_sane_budgets(seconds):
+    assert Settings(generation_deadline_seconds=seconds).generation_deadline_seconds == seconds
+
+
+def test_history_archiving_is_opt_in():
+    assert Settings.model_fields["history_retention_days"].default == 0
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+
+from src.handlers import utm_generation
+from src.utils.deadline import deadline_scope
+
+
+class SlowMessage:
+    """Stands in for aiogram's Message: answer() takes reply_delay seconds"""
+
+    class Chat:
+        id = 42
+
+    chat = Chat()
+
+    def __init__(self, reply_delay: float) -> None:
+        self.reply_delay = reply_delay
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None):
+        await asyncio.sleep(self.reply_delay)
+        self.answers.append(text)
+
+
+class StubShortener:
+    name = "stub"
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+
+    async def shorten(self, long_url):
+        await asyncio.sleep(self.latency)
+        return "https://s.ex/abc"
+
+
+class StubHistory:
+    def __init__(self) -> None:
+        self.delay = 0.0
+        self.rows = []
+
+    def add_history(self, user_id, base_url, full_url, short_url):
+        time.sleep(self.delay)
+        self.rows.append((user_id, short_url))
+
+
+class StubRetryQueue:
+    def __init__(self) -> None:
+        self.jobs = []
+
+    async def enqueue(self, user_id, chat_id, base_url, full_url):
+        self.jobs.append((user_id, full_url))
+
+
+SESSION = {
+    "base_url": "https://www.gorbilet.com/actions/hamlet/",
+    "utm_source": "vk",
+    "utm_medium": "post",
+    "utm_campaign": "spring",
+}
+
+
+@pytest.fixture
+def generation():
+    return StubHistory(), StubRetryQueue()
+
+
+def _generate(generation, shortener_latency, reply_delay, budget):
+    history, retry_queue = generation
+    message = SlowMessage(reply_delay)
+
+    async def scenario():
+        with deadline_scope(budget) as deadline:
+            await utm_generation.generate_short_link(
+                7, SESSION, history, StubShortener(shortener_latency), retry_queue, message=message
+            )
+        return deadline
+
+    return message, asyncio.run(scenario())
+
+
+def test_reply_is_sent_when_the_budget_is_already_spent(monkeypatch, generation):
+    _, retry_queue = generation
+    message, deadline = _generate(generation, shortener_latency=0.01, reply_delay=0.0, budget=0.0)
+
+    assert deadline.exceeded == ["shortener", "retry_queue"]
+    # The job write was due to be cancelled before it started; it must still land
+    assert len(retry_queue.jobs) == 1
+    assert len(message.answers) == 1
+    assert "Короткую ссылку пришлю автоматически" in message.answers[0]
+
+
+def test_reply_after_success_is_not_cut_by_the_budget(monkeypatch, generation):
+    history, _ = generation
+    monkeypatch.setattr(utm_generation, "WRITE_RESERVE_SECONDS", 0.0)
+    monkeypatch.setattr(utm_generation, "REPLY_RESERVE_SECONDS", 0.0)
+    message, deadline = _generate(generation, shortener_latency=0.0, reply_delay=0.2, budget=0.1)
+
+    assert deadline.exceeded == []
+    assert history.rows == [(7, "https://s.ex/abc")]
+    assert len(message.answers) == 1 and "https://s.ex/abc" in message.answers[0]
+
+
+def test_slow_history_write_still_lands(monkeypatch, generation):
+    history, _ = generation
+    history.delay = 0.3
+    monkeypatch.setattr(utm_generation, "WRITE_RESERVE_SECONDS", 0.05)
+    monkeypatch.setattr(utm_generation, "REPLY_RESERVE_SECONDS", 0.05)
+    message, deadline = _generate(generation, shortener_latency=0.0, reply_delay=0.0, budget=0.2)
+
+    assert deadline.exceeded == ["history"]
+    assert history.rows == [(7, "https://s.ex/abc")]
+    assert len(message.answers) == 1 and "https://s.ex/abc" in message.answers[0]
@@ -0,0 +1,95 @@
+"""KeyedLock under concurrency"""
+import asyncio
+import random
+
+import pytest
+
+from src.utils.keyed_lock import KeyedLock
+
+
+async def _record(locks, key, log, name, delay=0.01):
+    async with locks.hold(key):
+        log.append(("enter", name))
+        await asyncio.sleep(delay)
+        log.append(("exit", name))
+
+
+def test_same_key_is_serialized_in_fifo_order():
+    async def scenario():
+        locks, log = KeyedLock(), []
+        await asyncio.gather(*(_record(locks, "user", log, name) for name in range(5)))
+        return locks, log
+
+    locks, log = asyncio.run(scenario())
+    assert log == [(step, name) for name in range(5) for step in ("enter", "exit")]
+    assert len(locks) == 0
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    async def scenario():
+        locks, log = KeyedLock(), []
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(_record(locks, key, log, key, delay=0.1) for key in range(50)))
+        return locks, log, loop.time() - started
+
+    locks, log, elapsed = asyncio.run(scenario())
+    assert [step for step, _ in log[:50]] == ["enter"] * 50
+    assert elapsed < 0.5
+    assert len(locks) == 0
+
+
+def test_entries_are_reaped_after_errors_and_cancelled_waiters():
+    async def scenario():
+        locks = KeyedLock()
+        with pytest.raises(RuntimeError):
+            async with locks.hold("user"):
+                raise RuntimeError("handler failed")
+        assert len(locks) == 0
+
+        holder_entered, release = asyncio.Event(), asyncio.Event()
+
+        async def holder():
+            async with locks.hold("user"):
+                holder_entered.set()
+                await release.wait()
+
+        holding = asyncio.create_task(holder())
+        await holder_entered.wait()
+        waiter = asyncio.create_task(_record(locks, "user", [], "waiter"))
+        await asyncio.sleep(0)
+        assert locks.locked("user") and locks._entries["user"][1] == 2
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert locks._entries["user"][1] == 1
+        release.set()
+        await holding
+        assert len(locks) == 0 and not locks.locked("user")
+
+    asyncio.run(scenario())
+
+
+def test_read_modify_write_sections_of_one_user_stay_intact():
+    users, events_per_user = 300, 30
+    locks, state = KeyedLock(), {}
+
+    async def update(user_id, value):
+        # Read-modify-write with awaits in between: without the lock values get lost
+        async with locks.hold(user_id):
+            current = state.get(user_id, ())
+            await asyncio.sleep(0)
+            state[user_id] = current + (value,)
+            await asyncio.sleep(0)
+
+    events = [(user_id, index) for user_id in range(users) for index in range(events_per_user)]
+    random.Random(0).shuffle(events)
+
+    async def scenario():
+        await asyncio.gather(*(update(user_id, value) for user_id, value in events))
+
+    asyncio.run(scenario())
+    assert len(state) == users
+    assert all(sorted(values) == list(range(events_per_user)) for values in state.values())
+    assert len(locks) == 0
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+from src.handlers.commands import _build_history_csv
+from src.services.database import DatabaseManager
+from src.services.history_archive import HistoryArchive
+from src.services.maintenance import VACUUM_MAX_STEPS, HistoryMaintenance
+
+
+class FakeVacuumDb:
+    def __init__(self, free_pages: int, incremental: bool = True) -> None:
+        self.free_pages = free_pages
+        self.incremental = incremental
+        self.steps = 0
+        self.optimized = False
+
+    def incremental_vacuum_enabled(self) -> bool:
+        return self.incremental
+
+    def incremental_vacuum(self, pages: int) -> int:
+        self.steps += 1
+        self.free_pages = max(0, self.free_pages - pages)
+        return self.free_pages
+
+    def optimize(self) -> None:
+        self.optimized = True
+
+
+def _maintenance(db) -> HistoryMaintenance:
+    return HistoryMaintenance(db, archive=None, retention_days=0, interval_seconds=3600)
+
+
+def test_vacuum_stops_when_nothing_is_left():
+    db = FakeVacuumDb(free_pages=2500)
+    assert _maintenance(db).reclaim_space() == 3
+    assert db.free_pages == 0
+
+
+def test_vacuum_steps_are_capped_per_run():
+    db = FakeVacuumDb(free_pages=10**9)
+    maintenance = _maintenance(db)
+    maintenance.run_once()
+    assert db.steps == VACUUM_MAX_STEPS
+    assert db.optimized
+
+
+def test_vacuum_skipped_without_incremental_auto_vacuum():
+    db = FakeVacuumDb(free_pages=5000, incremental=False)
+    assert _maintenance(db).reclaim_space() == 0
+    assert db.steps == 0
+
+
+def test_cancelling_run_forever_stops_the_worker_thread():
+    started = threading.Event()
+
+    class SlowDb(FakeVacuumDb):
+        def incremental_vacuum(self, pages: int) -> int:
+            started.set()
+            threading.Event().wait(0.01)
+            return super().incremental_vacuum(pages)
+
+    db = SlowDb(free_pages=10**9)
+    maintenance = _maintenance(db)
+
+    async def run_and_cancel():
+        task = asyncio.create_task(maintenance.run_forever())
+        await asyncio.to_thread(started.wait)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run_and_cancel())
+    # asyncio.run waits for the default executor, so the thread has finished here
+    assert 0 < db.steps < VACUUM_MAX_STEPS
+    assert not db.optimized
+
+
+def test_sqlite_database_uses_incremental_auto_vacuum(tmp_path):
+    db = DatabaseManager(str(tmp_path / "state.sqlite3"))
+    try:
+        assert db.incremental_vacuum_enabled()
+        assert _maintenance(db).reclaim_space() >= 1
+    finally:
+        db.close()
+
+
+def _archived(user_id, record_id, month):
+    return {
+        "id": record_id,
+        "user_id": user_id,
+        "base_url": f"https://www.gorbilet.com/actions/{record_id}/",
+        "utm_url": f"https://www.gorbilet.com/actions/{record_id}/?utm_source=vk",
+        "short_url": f"https://s.ex/{record_id}",
+        "created_at": f"{month}-01T00:00:00",
+    }
+
+
+def test_deleted_user_does_not_get_archived_history_back(engine, tmp_path):
+    archive = HistoryArchive(str(tmp_path / "archive"))
+    archive.append([_archived(1, 1, "2024-01"), _archived(2, 2, "2024-01"), _archived(1, 3, "2024-02")])
+    engine.authorize_user(1, "alice")
+    new_url = "https://www.gorbilet.com/actions/new/"
+    engine.add_history(1, new_url, new_url + "?utm_source=vk", "https://s.ex/new")
+    maintenance = HistoryMaintenance(engine, archive, retention_days=0, interval_seconds=3600)
+
+    assert maintenance.delete_user(1)
+    assert not maintenance.delete_user(1)
+    engine.authorize_user(1, "alice")
+
+    assert list(archive.iter_records(1)) == []
+    assert [record["id"] for record in archive.iter_records(2)] == [2]
+    assert archive.months() == ["2024-01", "2024-02"]
+    assert _build_history_csv(engine, 1).decode("utf-8-sig").splitlines() == [
+        "created_at,base_url,utm_url,short_url"
+    ]
+
+
+def test_archiving_pass_and_user_deletion_do_not_interleave(engine, tmp_path):
+    archive = HistoryArchive(str(tmp_path / "archive"))
+    for user_id in (1, 2):
+        engine.add_history(user_id, "https://a/", "https://a/?utm_source=vk", f"https://s.ex/{user_id}")
+    # A negative retention puts the cutoff in the future, so every row is expired
+    maintenance = HistoryMaintenance(engine, archive, retention_days=-1, interval_seconds=3600)
+    read, release = threading.Event(), threading.Event()
+    original_append = archive.append
+
+    def slow_append(records):
+        # The batch is read; the user is deleted before it reaches the archive
+        read.set()
+        release.wait(5)
+        return original_append(records)
+
+    archive.append = slow_append
+    archiver = threading.Thread(target=maintenance.archive_expired_history)
+    archiver.start()
+    read.wait(5)
+    deleter = threading.Thread(target=maintenance.delete_user, args=(1,))
+    deleter.start()
+    release.set()
+    archiver.join(5)
+    deleter.join(5)
+
+    assert list(archive.iter_records(1)) == []
+    assert [record["user_id"] for record in archive.iter_records(2)] == [2]
@@ -0,0 +1,162 @@
+import sqlite3
+
+import pytest
+
+from src.services import migrations
+from src.services.database import DatabaseManager
+from src.services.migrations import LATEST_VERSION, MIGRATIONS
+
+
+def _schema(path):
+    """Columns of every table and the names of all indexes"""
+    connection = sqlite3.connect(path)
+    try:
+        tables = [
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                " AND name NOT LIKE 'history_search_%'"
+            )
+        ]
+        columns = {
+            table: {row[1] for row in connection.execute(f"PRAGMA table_info({table})")} for table in tables
+        }
+        indexes = {
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'"
+            )
+        }
+        return columns, indexes
+    finally:
+        connection.close()
+
+
+def _user_version(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def _open_at(path, version, monkeypatch):
+    """Opens the database with only the first `version` migrations known, as an older release would"""
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:version])
+        patch.setattr(migrations, "LATEST_VERSION", version)
+        return DatabaseManager(str(path))
+
+
+@pytest.fixture
+def fresh_schema(tmp_path):
+    path = tmp_path / "fresh.sqlite3"
+    DatabaseManager(str(path)).close()
+    return _schema(path)
+
+
+def test_migrations_are_numbered_in_order():
+    assert [migration.version for migration in MIGRATIONS] == list(range(1, LATEST_VERSION + 1))
+
+
+def test_upgrade_from_the_unversioned_layout(legacy_db_path, fresh_schema):
+    db = DatabaseManager(str(legacy_db_path))
+    try:
+        assert db.is_user_authorized(1)
+        assert [record["short_url"] for record in db.search_history(1, "hamlet", 10)] == ["https://s.ex/a"]
+        assert db.get_app_settings()["bot_password"]
+    finally:
+        db.close()
+
+    assert _user_version(legacy_db_path) == LATEST_VERSION
+    assert _schema(legacy_db_path) == fresh_schema
+
+
+def test_upgrade_of_interned_history_from_before_slugs(tmp_path, fresh_schema):
+    # An unversioned database that already had interned history, but no slug_id
+    path = tmp_path / "interned.sqlite3"
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, authorized_at TEXT NOT NULL);
+        CREATE TABLE urls (id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, url TEXT NOT NULL);
+        CREATE UNIQUE INDEX idx_urls_hash ON urls(hash);
+        CREATE TABLE utm_values (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);
+        CREATE TABLE history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            base_url_id INTEGER NOT NULL REFERENCES urls(id),
+            utm_url_id INTEGER REFERENCES urls(id),
+            short_url_id INTEGER NOT NULL REFERENCES urls(id),
+            source_id INTEGER REFERENCES utm_values(id),
+            medium_id INTEGER REFERENCES utm_values(id),
+            campaign_id INTEGER REFERENCES utm_values(id),
+            content_id INTEGER REFERENCES utm_values(id),
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX idx_history_user ON history(user_id, id);
+        CREATE INDEX idx_history_base_url ON history(base_url_id);
+        CREATE INDEX idx_history_short_url ON history(short_url_id);
+        CREATE INDEX idx_history_utm_url ON history(utm_url_id) WHERE utm_url_id IS NOT NULL;
+        INSERT INTO users VALUES (1, 'alice', '2024-01-01');
+        INSERT INTO urls VALUES (1, 11, 'https://www.gorbilet.com/actions/hamlet/'), (2, 12, 'https://s.ex/a');
+        INSERT INTO utm_values VALUES (1, 'vk');
+        INSERT INTO history (id, user_id, base_url_id, short_url_id, source_id, created_at)
+        VALUES (5, 1, 1, 2, 1, '2024-01-01T00:00:00');
+        """
+    )
+    connection.close()
+
+    db = DatabaseManager(str(path))
+    try:
+        # The search backfill recovers the slug of rows written before slug_id
+        assert [record["id"] for record in db.search_history(1, "hamlet", 10)] == [5]
+    finally:
+        db.close()
+    assert _schema(path) == fresh_schema
+
+
+@pytest.mark.parametrize("version", range(1, LATEST_VERSION))
+def test_upgrade_from_every_intermediate_version(tmp_path, monkeypatch, fresh_schema, version):
+    path = tmp_path / "state.sqlite3"
+    _open_at(path, version, monkeypatch).close()
+    if version >= 2:
+        # Written with the columns of that version: today's code expects the latest schema
+        connection = sqlite3.connect(path)
+        connection.execute("INSERT INTO users (user_id, username, authorized_at) VALUES (1, 'alice', '2024-01-01')")
+        connection.commit()
+        connection.close()
+    assert _user_version(path) == version
+
+    db = DatabaseManager(str(path))
+    try:
+        if version >= 2:
+            assert db.is_user_authorized(1)
+        base_url = "https://www.gorbilet.com/actions/hamlet/"
+        db.add_history(1, base_url, f"{base_url}?utm_source=vk", "https://s.ex/a")
+        assert [record["short_url"] for record in db.search_history(1, "hamlet", 10)] == ["https://s.ex/a"]
+    finally:
+        db.close()
+    assert _user_version(path) == LATEST_VERSION
+    assert _schema(path) == fresh_schema
+
+
+def test_rerunning_every_migration_changes_nothing(legacy_db_path, fresh_schema):
+    DatabaseManager(str(legacy_db_path)).close()
+    db = DatabaseManager(str(legacy_db_path))
+    before = ([dict(row) for row in db.iter_history_records(1)], db.get_app_settings())
+    db.close()
+
+    # As if user_version had been lost: every step runs again over the migrated schema
+    connection = sqlite3.connect(legacy_db_path)
+    connection.execute("PRAGMA user_version = 0")
+    connection.close()
+    db = DatabaseManager(str(legacy_db_path))
+    try:
+        assert ([dict(row) for row in db.iter_history_records(1)], db.get_app_settings()) == before
+        # The search index is not filled a second time
+        assert len(db.search_history(1, "hamlet", 10)) == 1
+    finally:
+        db.close()
+    assert _user_version(legacy_db_path) == LATEST_VERSION
+    assert _schema(legacy_db_path) == fresh_schema
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from src.services.database import DatabaseManager, ReadConnectionPool
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path / "state.sqlite3"), read_pool_size=2)
+    yield db
+    db.close()
+
+
+def test_pool_connections_refuse_writes(db):
+    connection = db._readers.acquire()
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            connection.execute("INSERT INTO app_settings (key, value) VALUES ('k', 'v')")
+    finally:
+        db._readers.release(connection)
+
+
+def test_reads_do_not_wait_for_the_writer(db):
+    db.authorize_user(1, "alice")
+    results = []
+    with db._lock:
+        # A long write holds the writer; a read from another thread still completes
+        reader = threading.Thread(target=lambda: results.append(db.is_user_authorized(1)))
+        reader.start()
+        reader.join(timeout=5)
+        assert not reader.is_alive()
+    assert results == [True]
+
+
+def test_pool_never_opens_more_than_size_connections(tmp_path):
+    DatabaseManager(str(tmp_path / "state.sqlite3")).close()
+    pool = ReadConnectionPool(tmp_path / "state.sqlite3", size=2)
+    first, second = pool.acquire(), pool.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (pool.release(pool.acquire()), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+
+    pool.release(first)
+    assert acquired.wait(5)
+    waiter.join()
+    # The released connection is reused instead of a new one being opened
+    assert pool.acquire() is first
+    pool.release(first)
+    pool.release(second)
+    pool.close()
+
+
+def test_connection_returned_after_close_is_closed(tmp_path):
+    DatabaseManager(str(tmp_path / "state.sqlite3")).close()
+    pool = ReadConnectionPool(tmp_path / "state.sqlite3", size=2)
+    idle, busy = pool.acquire(), pool.acquire()
+    pool.release(idle)
+
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle.execute("SELECT 1")
+    busy.execute("SELECT 1")
+
+    pool.release(busy)
+    with pytest.raises(sqlite3.ProgrammingError):
+        busy.execute("SELECT 1")
+
+
+def test_close_waits_for_the_write_in_progress_and_lets_reads_finish(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    db = DatabaseManager(str(path), read_pool_size=2)
+    db.authorize_user(1, "alice")
+    reading = db._readers.acquire()
+    closed = threading.Event()
+    closer = threading.Thread(target=lambda: (db.close(), closed.set()))
+
+    with db._lock:
+        # A write is in progress: the writer connection must outlive it
+        closer.start()
+        assert not closed.wait(0.1)
+        db._connection.execute("UPDATE users SET username = 'bob' WHERE user_id = 1")
+        db._connection.commit()
+    assert closed.wait(5)
+    closer.join()
+
+    # A read that started before close completes; its connection is closed on return
+    assert reading.execute("SELECT username FROM users").fetchone()[0] == "bob"
+    db._readers.release(reading)
+    with pytest.raises(sqlite3.ProgrammingError):
+        reading.execute("SELECT 1")
+    # Every connection is gone, so SQLite folded the WAL into the main file
+    assert not os.path.exists(f"{path}-wal")
+    reopened = DatabaseManager(str(path))
+    try:
+        assert reopened.get_users_page("active", 10)[0]["username"] == "bob"
+    finally:
+        reopened.close()
@@ -0,0 +1,136 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.services import retry_queue
+from src.services.database import DatabaseManager
+from src.services.retry_queue import ShortenRetryQueue
+
+
+BASE_URL = "https://www.gorbilet.com/actions/hamlet/"
+UTM_URL = f"{BASE_URL}?utm_source=vk&utm_medium=post&utm_campaign=spring"
+
+
+class ScriptedShortener:
+    """Answers with the given results in order, then keeps repeating the last one"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def shorten(self, long_url):
+        self.calls += 1
+        return self.results[min(self.calls, len(self.results)) - 1]
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append((chat_id, text))
+
+
+def _queue(storage, provider, max_attempts=3, base_delay=0.0, max_delay=0.0):
+    return ShortenRetryQueue(
+        storage, provider, base_delay=base_delay, max_delay=max_delay, max_attempts=max_attempts, poll_interval=0
+    )
+
+
+def _enqueue_due(storage, user_id=1):
+    storage.authorize_user(user_id, None)
+    due = (datetime.utcnow() - timedelta(seconds=1)).isoformat()
+    return storage.enqueue_shorten_job(user_id, 100 + user_id, BASE_URL, UTM_URL, due)
+
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(retry_queue.random, "uniform", lambda low, high: 1.0)
+    queue = _queue(None, None, base_delay=5, max_delay=60)
+    assert [queue.backoff(attempts) for attempts in range(6)] == [5, 10, 20, 40, 60, 60]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_backoff_jitter_stays_within_twenty_percent(monkeypatch, seed):
+    monkeypatch.setattr(retry_queue, "random", random.Random(seed))
+    queue = _queue(None, None, base_delay=5, max_delay=60)
+    for attempts in range(8):
+        nominal = min(60, 5 * 2 ** attempts)
+        delays = [queue.backoff(attempts) for _ in range(200)]
+        assert all(0.8 * nominal <= delay <= 1.2 * nominal for delay in delays)
+        assert max(delays) - min(delays) > 0.2 * nominal
+
+
+def test_failed_attempt_is_rescheduled_by_the_backoff(engine, monkeypatch):
+    monkeypatch.setattr(retry_queue.random, "uniform", lambda low, high: 1.0)
+    job_id = _enqueue_due(engine)
+    queue = _queue(engine, ScriptedShortener(None), base_delay=30, max_delay=600)
+
+    before = datetime.utcnow()
+    assert asyncio.run(queue.process_due(RecordingBot())) == 1
+
+    # Not due now, due once the second delay (2 * 30 s) has passed
+    assert engine.get_due_shorten_jobs(datetime.utcnow().isoformat(), 10) == []
+    later = engine.get_due_shorten_jobs((before + timedelta(seconds=61)).isoformat(), 10)
+    assert [(job["id"], job["attempts"]) for job in later] == [(job_id, 1)]
+    assert engine.get_due_shorten_jobs((before + timedelta(seconds=59)).isoformat(), 10) == []
+
+
+def test_job_is_dropped_after_max_attempts(engine):
+    _enqueue_due(engine)
+    provider = ScriptedShortener(None)
+    queue = _queue(engine, provider, max_attempts=3)
+    bot = RecordingBot()
+
+    for _ in range(5):
+        asyncio.run(queue.process_due(bot))
+
+    assert provider.calls == 3
+    assert engine.get_shorten_queue_stats()[0] == 0
+    assert engine.get_history(1) == []
+    [(chat_id, text)] = bot.sent
+    assert chat_id == 101
+    assert "Не удалось сократить" in text and UTM_URL in text
+
+
+def test_link_is_delivered_on_the_attempt_that_succeeds(engine):
+    _enqueue_due(engine)
+    provider = ScriptedShortener(None, "https://clc.li/ok")
+    queue = _queue(engine, provider, max_attempts=3)
+    bot = RecordingBot()
+
+    asyncio.run(queue.process_due(bot))
+    assert bot.sent == []
+    asyncio.run(queue.process_due(bot))
+
+    assert [short_url for _, _, short_url in engine.get_history(1)] == ["https://clc.li/ok"]
+    assert engine.get_shorten_queue_stats()[0] == 0
+    assert len(bot.sent) == 1 and "https://clc.li/ok" in bot.sent[0][1]
+
+
+def test_job_interrupted_after_saving_history_is_delivered_after_restart(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    db = DatabaseManager(path)
+    _enqueue_due(db)
+
+    def crash(job_id):
+        raise RuntimeError("process killed")
+
+    # The process dies between writing history and deleting the job
+    db.delete_shorten_job = crash
+    bot = RecordingBot()
+    with pytest.raises(RuntimeError):
+        asyncio.run(_queue(db, ScriptedShortener("https://clc.li/1")).process_due(bot))
+    db.close()
+    assert bot.sent == []
+
+    restarted = DatabaseManager(path)
+    try:
+        asyncio.run(_queue(restarted, ScriptedShortener("https://clc.li/2")).process_due(bot))
+        # At least once: the link arrives, and the history may hold it twice
+        assert len(bot.sent) == 1 and "https://clc.li/2" in bot.sent[0][1]
+        assert [short_url for _, _, short_url in restarted.get_history(1)] == ["https://clc.li/2", "https://clc.li/1"]
+        assert restarted.get_shorten_queue_stats()[0] == 0
+    finally:
+        restarted.close()
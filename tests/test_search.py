@@ -0,0 +1,38 @@
+def _add(engine, user_id, slug, source, short):
+    base_url = f"https://www.gorbilet.com/actions/{slug}/"
+    engine.add_history(user_id, base_url, f"{base_url}?utm_source={source}&utm_medium=post", short)
+
+
+def test_search_only_returns_the_callers_history(engine):
+    _add(engine, 1, "hamlet-spb", "vk", "https://s.ex/1")
+    _add(engine, 2, "hamlet-msk", "vk", "https://s.ex/2")
+    _add(engine, 2, "hamlet-spb", "tg", "https://s.ex/3")
+
+    assert [record["short_url"] for record in engine.search_history(1, "hamlet", 10)] == ["https://s.ex/1"]
+    assert {record["short_url"] for record in engine.search_history(2, "hamlet", 10)} == {
+        "https://s.ex/2",
+        "https://s.ex/3",
+    }
+    assert engine.search_history(3, "hamlet", 10) == []
+
+
+def test_search_candidates_are_counted_per_user(engine):
+    # Other users' newer matches must not push the caller's rows out of the ranked window
+    _add(engine, 1, "hamlet-old", "vk", "https://s.ex/mine")
+    for index in range(30):
+        _add(engine, 2, "hamlet-new", "vk", f"https://s.ex/other-{index}")
+
+    records = engine.search_history(1, "hamlet", 10)
+    assert [record["short_url"] for record in records] == ["https://s.ex/mine"]
+    assert all(record["user_id"] == 1 for record in records)
+
+
+def test_search_pages_within_the_users_matches(engine):
+    for index in range(5):
+        _add(engine, 7, f"gamlet-{index}", "vk", f"https://s.ex/{index}")
+    _add(engine, 8, "gamlet-x", "vk", "https://s.ex/x")
+
+    first = engine.search_history(7, "gamlet vk", 3)
+    second = engine.search_history(7, "gamlet vk", 3, offset=3)
+    assert len(first) == 3 and len(second) == 2
+    assert {record["short_url"] for record in first + second} == {f"https://s.ex/{index}" for index in range(5)}
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+
+from src.services.shorteners import HedgedShortener, ShortenerProvider
+
+
+class StubProvider(ShortenerProvider):
+    def __init__(self, name: str, latency: float, fail: bool = False) -> None:
+        super().__init__()
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def shorten(self, long_url: str) -> Optional[str]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        return f"https://{self.name}.example/{self.calls}"
+
+
+def test_primary_exception_falls_back_to_backup_before_hedge_delay():
+    primary = StubProvider("primary", 0.01, fail=True)
+    backup = StubProvider("backup", 0.01)
+    shortener = HedgedShortener(primary, backup, initial_hedge_delay=5.0)
+
+    result = asyncio.run(asyncio.wait_for(shortener.shorten("https://example.com/a"), 1.0))
+
+    assert result == "https://backup.example/1"
+    assert shortener.stats.winners == {"backup": 1}
+
+
+def test_primary_exception_after_hedge_waits_for_backup():
+    primary = StubProvider("primary", 0.2, fail=True)
+    backup = StubProvider("backup", 0.3)
+    shortener = HedgedShortener(primary, backup, initial_hedge_delay=0.05)
+
+    assert asyncio.run(shortener.shorten("https://example.com/b")) == "https://backup.example/1"
+
+
+def test_backup_exception_keeps_primary_result():
+    primary = StubProvider("primary", 0.2)
+    backup = StubProvider("backup", 0.01, fail=True)
+    shortener = HedgedShortener(primary, backup, initial_hedge_delay=0.05)
+
+    assert asyncio.run(shortener.shorten("https://example.com/c")) == "https://primary.example/1"
+
+
+def test_all_providers_failing_is_a_recorded_failure():
+    shortener = HedgedShortener(
+        StubProvider("primary", 0.01, fail=True), StubProvider("backup", 0.01, fail=True), initial_hedge_delay=1.0
+    )
+
+    assert asyncio.run(shortener.shorten("https://example.com/d")) is None
+    assert shortener.stats.failures == 1
+    assert shortener.stats.hedged == 1
+
+
+def test_exception_without_backup_is_a_failure():
+    shortener = HedgedShortener(StubProvider("primary", 0.01, fail=True), None, initial_hedge_delay=1.0)
+
+    assert asyncio.run(shortener.shorten("https://example.com/e")) is None
+    assert shortener.stats.failures == 1
@@ -0,0 +1,151 @@
+"""SingleFlight coalescing, error sharing and cancellation"""
+import asyncio
+
+import pytest
+
+from src.services.shorteners import HedgedShortener, ShortenerProvider
+from src.utils.single_flight import SingleFlight
+
+
+class Call:
+    """Factory that counts starts and cancellations and finishes when told to"""
+
+    def __init__(self, result="ok", error=None):
+        self.result = result
+        self.error = error
+        self.started = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class EchoProvider(ShortenerProvider):
+    name = "echo"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = []
+
+    async def shorten(self, long_url: str) -> str:
+        self.calls.append(long_url)
+        number = len(self.calls)
+        await asyncio.sleep(0.05)
+        return f"https://s.example/{number}"
+
+
+def test_concurrent_calls_with_one_key_share_one_call():
+    async def scenario():
+        flight, call, other = SingleFlight(), Call("a"), Call("b")
+        waiters = [asyncio.create_task(flight.do("a", call)) for _ in range(10)]
+        waiters.append(asyncio.create_task(flight.do("b", other)))
+        await asyncio.sleep(0)
+        assert len(flight) == 2
+        call.release.set()
+        other.release.set()
+        results = await asyncio.gather(*waiters)
+        return flight, call, other, results
+
+    flight, call, other, results = asyncio.run(scenario())
+    assert results == ["a"] * 10 + ["b"]
+    assert (call.started, other.started) == (1, 1)
+    assert (flight.started, flight.coalesced) == (2, 9)
+    assert len(flight) == 0
+
+
+def test_an_error_reaches_every_waiter_and_the_next_call_starts_afresh():
+    async def scenario():
+        flight, failing = SingleFlight(), Call(error=RuntimeError("provider down"))
+        waiters = [asyncio.create_task(flight.do("key", failing)) for _ in range(20)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(result is results[0] for result in results)
+        assert isinstance(results[0], RuntimeError) and failing.started == 1
+        assert len(flight) == 0
+
+        succeeding = Call("fresh")
+        succeeding.release.set()
+        assert await flight.do("key", succeeding) == "fresh"
+        assert succeeding.started == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_waiter_leaves_the_call_to_the_others():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        first = asyncio.create_task(flight.do("key", call))
+        second = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        call.release.set()
+        assert await second == "ok"
+        assert (call.started, call.cancelled) == (1, 0)
+
+    asyncio.run(scenario())
+
+
+def test_the_call_is_cancelled_when_every_waiter_is_gone():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(asyncio.gather(flight.do("key", call), flight.do("key", call)), 0.01)
+        await asyncio.sleep(0)
+        assert (call.started, call.cancelled) == (1, 1)
+        assert len(flight) == 0
+
+        # A finished call is never joined again
+        call.release.set()
+        assert await flight.do("key", call) == "ok"
+        assert call.started == 2
+
+    asyncio.run(scenario())
+
+
+def test_a_call_right_after_the_last_waiter_left_starts_afresh():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        waiter = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # One step: the waiter has cancelled the call, which is not done yet
+        await asyncio.sleep(0)
+        assert waiter.cancelled()
+
+        # Called directly, do() looks the key up before the cancelled call finishes
+        asyncio.get_running_loop().call_later(0.01, call.release.set)
+        assert await flight.do("key", call) == "ok"
+        assert (call.started, call.cancelled) == (2, 1)
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_shortener_coalesces_the_same_link_with_reordered_utm_params():
+    provider = EchoProvider()
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=1.0)
+    urls = [
+        "https://Ex.com/a?utm_source=vk&utm_medium=post",
+        "https://ex.com/a?utm_medium=post&utm_source=vk",
+        "https://ex.com/a?utm_source=vk&utm_medium=post",
+    ]
+
+    async def scenario():
+        return await asyncio.gather(*(shortener.shorten(url) for url in urls), shortener.shorten("https://ex.com/b"))
+
+    first, second, third, other = asyncio.run(scenario())
+    assert first == second == third != other
+    assert provider.calls == [urls[0], "https://ex.com/b"]
+    assert shortener.single_flight.coalesced == 2
@@ -0,0 +1,92 @@
+"""Per-host slug rules; the built-in rules must keep the old extract_action_slug output"""
+import json
+import os
+import random
+import re
+from urllib.parse import urlparse
+
+import pytest
+
+from src.utils.slug_rules import SlugRules, compile_rule
+
+
+_ACTION_PATTERN = re.compile(r"/actions/([^/]+)")
+TABLE = {
+    "example.ru": [{"path": r"/shows/(?P<slug>[^/]+)"}],
+    "kids.example.org": [{"query": "event"}, {"segment": 0}],
+    "*": [{"path": r"/actions/([^/]+)"}, {"segment": -1}],
+}
+
+
+def _old_extract_action_slug(url):
+    """extract_action_slug as it was before the rule table"""
+    parsed = urlparse(url)
+    match = _ACTION_PATTERN.search(parsed.path)
+    if match:
+        return match.group(1)
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    return segments[-1] if segments else "event"
+
+
+def _random_url(rng):
+    host = rng.choice(["gorbilet.com", "www.gorbilet.com", "SPB.Gorbilet.com", "example.ru:8080", "user@host.net", ""])
+    segments = [rng.choice(["actions", "shows", "event-1", "спектакль", "a%20b", ""]) for _ in range(rng.randint(0, 4))]
+    url = f"{rng.choice(['https', 'http'])}://{host}/" + "/".join(segments)
+    if rng.random() < 0.3:
+        url += "/"
+    if rng.random() < 0.4:
+        url += "?event=ev1&utm_source=vk"
+    if rng.random() < 0.2:
+        url += "#actions/x"
+    return url
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_default_rules_reproduce_the_old_slugs(seed):
+    rng = random.Random(seed)
+    rules = SlugRules()
+    for _ in range(200):
+        url = _random_url(rng)
+        assert rules.extract(url) == _old_extract_action_slug(url), url
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://teatr.example.ru/shows/hamlet/tickets", "hamlet"),
+        ("https://www.example.ru/actions/onegin/", "onegin"),
+        ("https://kids.example.org/page?event=elka", "elka"),
+        ("https://kids.example.org/page/sub", "page"),
+        ("https://other.example.org/page/sub", "sub"),
+        ("https://gorbilet.com/actions/swan-lake/", "swan-lake"),
+        ("https://gorbilet.com/", "event"),
+    ],
+)
+def test_host_rules_then_parents_then_default(url, expected):
+    assert SlugRules(TABLE).extract(url) == expected
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [{"path": "("}, {"query": ""}, {"segment": True}, {"segment": "1"}, {"regex": "x"}, {"path": "a", "query": "b"}],
+)
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        compile_rule(rule)
+
+
+def test_reload_swaps_rules_and_keeps_them_on_a_broken_file(tmp_path):
+    path = tmp_path / "slug_rules.json"
+    rules = SlugRules()
+    assert not rules.load(str(path))
+    assert rules.extract("https://example.ru/shows/hamlet/tickets") == "tickets"
+
+    path.write_text(json.dumps(TABLE), encoding="utf-8")
+    assert rules.load(str(path))
+    assert rules.extract("https://example.ru/shows/hamlet/tickets") == "hamlet"
+    assert not rules.reload_if_changed()
+
+    path.write_text(json.dumps({"*": [{"path": "("}]}), encoding="utf-8")
+    os.utime(path, ns=(1, 1))
+    assert not rules.reload_if_changed()
+    assert rules.extract("https://example.ru/shows/hamlet/tickets") == "hamlet"
@@ -0,0 +1,244 @@
+"""Conformance suite: SQLite and in-memory storage must behave the same"""
+import os
+
+import pytest
+
+from src.config import settings
+from src.services.migrations import LATEST_VERSION
+
+
+def _history(engine, user_id, slug, source="vk", short=None):
+    base_url = f"https://www.gorbilet.com/actions/{slug}/"
+    utm_url = f"{base_url}?utm_source={source}&utm_medium=post&utm_campaign=spring&utm_content={slug}"
+    engine.add_history(user_id, base_url, utm_url, short or f"https://s.ex/{user_id}-{slug}")
+    return base_url, utm_url
+
+
+# Users and bans
+
+
+def test_authorize_and_ban(engine):
+    assert not engine.is_user_authorized(1)
+    engine.authorize_user(1, "alice")
+    engine.authorize_user(1, "alice_renamed")
+    assert engine.is_user_authorized(1)
+    assert engine.count_users("active") == 1
+    assert [dict(row)["username"] for row in engine.iter_users("active")] == ["alice_renamed"]
+
+    engine.ban_user(2, "mallory", reason="invalid_password")
+    engine.ban_user(2, "mallory", reason="second reason is ignored")
+    assert engine.is_user_banned(2) and not engine.is_user_banned(1)
+    assert [(row["user_id"], row["reason"]) for row in engine.iter_users("banned")] == [(2, "invalid_password")]
+
+
+def test_users_page_keyset_navigation(engine):
+    for user_id in range(1, 8):
+        engine.authorize_user(user_id, f"user{user_id}")
+    newest_first = [row["user_id"] for row in engine.iter_users("active", batch_size=3)]
+    assert sorted(newest_first) == list(range(1, 8))
+
+    first = engine.get_users_page("active", 3)
+    assert [row["user_id"] for row in first] == newest_first[:3]
+    cursor = (first[-1]["authorized_at"], first[-1]["user_id"])
+    second = engine.get_users_page("active", 3, cursor)
+    assert [row["user_id"] for row in second] == newest_first[3:6]
+    back_cursor = (second[0]["authorized_at"], second[0]["user_id"])
+    assert [row["user_id"] for row in engine.get_users_page("active", 3, back_cursor, backwards=True)] == (
+        newest_first[:3]
+    )
+
+
+def test_delete_user_removes_everything(engine):
+    engine.authorize_user(1, "alice")
+    engine.increment_auth_attempts(1)
+    _history(engine, 1, "hamlet")
+    _history(engine, 2, "hamlet")
+
+    assert engine.delete_user(1)
+    assert not engine.is_user_authorized(1)
+    assert engine.get_auth_attempts(1) == 0
+    assert engine.get_history(1) == []
+    assert engine.search_history(1, "hamlet", 10) == []
+    assert len(engine.get_history(2)) == 1
+    assert not engine.delete_user(1)
+
+    engine.ban_user(3, "mallory")
+    assert engine.delete_user(3) and not engine.is_user_banned(3)
+
+
+# Attempts and settings
+
+
+def test_auth_attempts(engine):
+    assert engine.get_auth_attempts(5) == 0
+    assert [engine.increment_auth_attempts(5) for _ in range(3)] == [1, 2, 3]
+    engine.reset_auth_attempts(5)
+    assert engine.get_auth_attempts(5) == 0
+
+    engine.increment_auth_attempts(5)
+    engine.authorize_user(5, None)
+    assert engine.get_auth_attempts(5) == 0
+    engine.increment_auth_attempts(6)
+    engine.ban_user(6, None)
+    assert engine.get_auth_attempts(6) == 0
+
+
+def test_app_settings(engine):
+    assert engine.get_app_settings() == {"bot_password": settings.bot_access_password}
+    engine.set_app_setting("bot_password", "new")
+    engine.set_app_setting("broadcast_max_in_flight", "5")
+    engine.set_app_setting("broadcast_max_in_flight", "7")
+    assert engine.get_app_settings() == {"bot_password": "new", "broadcast_max_in_flight": "7"}
+
+
+# History and search
+
+
+def test_history_order_and_limit(engine):
+    for slug in ("one", "two", "three"):
+        _history(engine, 1, slug)
+    _history(engine, 2, "other")
+
+    assert [base for base, _, _ in engine.get_history(1, limit=2)] == [
+        "https://www.gorbilet.com/actions/three/",
+        "https://www.gorbilet.com/actions/two/",
+    ]
+    records = list(engine.iter_history_records(1, batch_size=2))
+    assert [record["short_url"] for record in records] == [
+        "https://s.ex/1-one",
+        "https://s.ex/1-two",
+        "https://s.ex/1-three",
+    ]
+    base_url, utm_url = "https://www.gorbilet.com/actions/one/", records[0]["utm_url"]
+    assert (records[0]["user_id"], records[0]["base_url"]) == (1, base_url)
+    assert utm_url.startswith(base_url + "?utm_source=vk")
+
+
+def test_expired_history_is_archived_and_deleted(engine):
+    _history(engine, 1, "old")
+    _history(engine, 2, "older")
+    _history(engine, 1, "kept")
+    cutoff = "9999"
+
+    expired = engine.get_history_before(cutoff, 2)
+    assert [record["short_url"] for record in expired] == ["https://s.ex/1-old", "https://s.ex/2-older"]
+    assert engine.get_history_before("0000", 10) == []
+    assert engine.delete_history_ids([record["id"] for record in expired]) == 2
+
+    assert [short for _, _, short in engine.get_history(1)] == ["https://s.ex/1-kept"]
+    assert engine.get_history(2) == []
+    assert engine.search_history(1, "old", 10) == []
+    assert [record["short_url"] for record in engine.search_history(1, "kept", 10)] == ["https://s.ex/1-kept"]
+
+
+@pytest.mark.parametrize(
+    "terms, expected",
+    [
+        ("hamlet", {"hamlet-spb", "hamlet-msk"}),
+        ("HAML", {"hamlet-spb", "hamlet-msk"}),
+        ("hamlet spb", {"hamlet-spb"}),
+        ("spring tg", {"hamlet-msk"}),
+        ("gorbilet", {"hamlet-spb", "hamlet-msk", "onegin"}),
+        ("onegin vk", {"onegin"}),
+        ("macbeth", set()),
+        ("?!", set()),
+    ],
+)
+def test_search_matches(engine, terms, expected):
+    _history(engine, 1, "hamlet-spb", source="vk")
+    _history(engine, 1, "hamlet-msk", source="tg")
+    _history(engine, 1, "onegin", source="vk")
+    records = engine.search_history(1, terms, 10)
+    assert {record["base_url"].rstrip("/").rsplit("/", 1)[1] for record in records} == expected
+
+
+# Broadcasts
+
+
+def test_broadcast_recipients_and_blocked_users(engine):
+    for user_id in (30, 10, 20, 40):
+        engine.authorize_user(user_id, None)
+
+    assert engine.get_broadcast_recipients(0, 3) == [10, 20, 30]
+    assert engine.get_broadcast_recipients(20, 10) == [30, 40]
+
+    broadcast_id = engine.create_broadcast("hello", created_by=10)
+    assert [row["id"] for row in engine.list_running_broadcasts()] == [broadcast_id]
+    engine.record_broadcast_batch(broadcast_id, 30, sent=2, failed=0, blocked_user_ids=[20])
+    engine.record_broadcast_batch(broadcast_id, 40, sent=0, failed=1, blocked_user_ids=[])
+    row = engine.get_broadcast(broadcast_id)
+    assert (row["text"], row["last_user_id"], row["sent"], row["failed"], row["blocked"]) == ("hello", 40, 2, 1, 1)
+
+    assert engine.get_broadcast_recipients(0, 10) == [10, 30, 40]
+    # A new /start clears the blocked mark
+    engine.authorize_user(20, None)
+    assert engine.get_broadcast_recipients(0, 10) == [10, 20, 30, 40]
+
+    engine.finish_broadcast(broadcast_id, "done")
+    assert engine.get_broadcast(broadcast_id)["status"] == "done"
+    assert engine.list_running_broadcasts() == []
+    assert engine.get_broadcast(broadcast_id + 1) is None
+
+
+# Retry queue
+
+
+def test_shorten_jobs(engine):
+    assert engine.get_shorten_queue_stats() == (0, None)
+    late = engine.enqueue_shorten_job(1, 100, "https://a/", "https://a/?utm_source=vk", "2030-01-01T00:00:00")
+    first = engine.enqueue_shorten_job(2, 200, "https://b/", "https://b/?utm_source=vk", "2020-01-02T00:00:00")
+    second = engine.enqueue_shorten_job(3, 300, "https://c/", "https://c/?utm_source=vk", "2020-01-01T00:00:00")
+
+    due = engine.get_due_shorten_jobs("2025-01-01T00:00:00", 10)
+    assert [job["id"] for job in due] == [second, first]
+    assert (due[1]["user_id"], due[1]["chat_id"], due[1]["attempts"]) == (2, 200, 0)
+    assert [job["id"] for job in engine.get_due_shorten_jobs("2025-01-01T00:00:00", 1)] == [second]
+
+    engine.reschedule_shorten_job(second, "2040-01-01T00:00:00", "timeout")
+    due = engine.get_due_shorten_jobs("2035-01-01T00:00:00", 10)
+    assert [job["id"] for job in due] == [first, late]
+    engine.delete_shorten_job(first)
+    depth, oldest = engine.get_shorten_queue_stats()
+    assert depth == 2 and oldest is not None
+    second_job = [job for job in engine.get_due_shorten_jobs("2050", 10) if job["id"] == second][0]
+    assert second_job["attempts"] == 1
+
+
+# Short links and clicks
+
+
+def test_short_links_and_clicks(engine):
+    block = engine.allocate_sequence("short_links", 3)
+    assert block == range(62 ** 3, 62 ** 3 + 3)
+    assert engine.allocate_sequence("short_links", 2) == range(62 ** 3 + 3, 62 ** 3 + 5)
+    with pytest.raises(KeyError):
+        engine.allocate_sequence("missing", 1)
+
+    first, second, unused = block
+    engine.add_short_link(first, "https://a/?utm_campaign=spring")
+    engine.add_short_link(second, "https://b/?utm_campaign=autumn")
+    assert engine.get_short_link_target(first) == "https://a/?utm_campaign=spring"
+    assert engine.get_short_link_target(unused) is None
+
+    engine.add_link_clicks({first: 2, second: 1}, "2025-01-01T00:00:00")
+    engine.add_link_clicks({first: 3}, "2025-01-02T00:00:00")
+    assert engine.get_link_clicks([first, second, unused]) == {first: 5, second: 1}
+    assert engine.get_link_clicks([]) == {}
+    assert sorted((row["link_id"], row["clicks"], row["target_url"]) for row in engine.list_clicked_links()) == [
+        (first, 5, "https://a/?utm_campaign=spring"),
+        (second, 1, "https://b/?utm_campaign=autumn"),
+    ]
+
+
+def test_ping_reports_the_latest_schema(engine):
+    assert engine.ping(1.0) == LATEST_VERSION
+
+
+def test_memory_backend_never_touches_the_sqlite_file():
+    import src.bot  # noqa: F401  (every module that used to build services at import time)
+    from src.services.container import build_services
+    from src.services.database import build_storage
+
+    services = build_services(build_storage("memory"))
+    assert not os.path.exists(settings.database_path)
+    services.storage.close()
@@ -0,0 +1,95 @@
+"""URL and UTM value interning in the SQLite history layout"""
+import sqlite3
+
+import pytest
+
+from conftest import LEGACY_HISTORY
+from src.services import database
+from src.services.database import DatabaseManager
+
+
+HAMLET = "https://www.gorbilet.com/actions/hamlet/"
+
+
+def _utm(base_url, source="vk", content="hamlet"):
+    return f"{base_url}?utm_source={source}&utm_medium=post&utm_campaign=spring&utm_content={content}"
+
+
+def _count(path, table):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "state.sqlite3"))
+    yield manager
+    manager.close()
+
+
+def test_repeated_urls_and_values_are_stored_once(db):
+    for user_id in (1, 2, 3):
+        db.add_history(user_id, HAMLET, _utm(HAMLET), f"https://s.ex/{user_id}")
+    db.add_history(1, HAMLET, _utm(HAMLET, source="tg"), "https://s.ex/4")
+
+    # One base URL and four short URLs; every UTM URL is rebuilt from its components
+    assert _count(db.db_path, "urls") == 5
+    # vk, tg, post, spring, hamlet; the slug reuses "hamlet"
+    assert _count(db.db_path, "utm_values") == 5
+    assert db.get_history(1) == [
+        (HAMLET, _utm(HAMLET, source="tg"), "https://s.ex/4"),
+        (HAMLET, _utm(HAMLET), "https://s.ex/1"),
+    ]
+
+
+def test_non_canonical_utm_url_is_kept_verbatim(db):
+    base_url = "https://www.gorbilet.com/actions/onegin/#top"
+    utm_url = base_url + "?utm_source=tg&utm_medium=post"
+    db.add_history(1, base_url, utm_url, "https://s.ex/1")
+    assert db.get_history(1) == [(base_url, utm_url, "https://s.ex/1")]
+
+
+def test_hash_collisions_store_both_urls(db, monkeypatch):
+    monkeypatch.setattr(database, "_url_hash", lambda url: 42)
+    db.add_history(1, HAMLET, _utm(HAMLET), "https://s.ex/1")
+    other = "https://www.gorbilet.com/actions/onegin/"
+    db.add_history(1, other, _utm(other, content="onegin"), "https://s.ex/2")
+    db.add_history(2, other, _utm(other, content="onegin"), "https://s.ex/2")
+
+    assert _count(db.db_path, "urls") == 4
+    assert db.get_history(1) == [
+        (other, _utm(other, content="onegin"), "https://s.ex/2"),
+        (HAMLET, _utm(HAMLET), "https://s.ex/1"),
+    ]
+    assert [record["short_url"] for record in db.search_history(2, "onegin", 10)] == ["https://s.ex/2"]
+
+
+def test_deleting_history_drops_orphaned_urls_only(db):
+    db.add_history(1, HAMLET, _utm(HAMLET), "https://s.ex/1")
+    db.add_history(2, HAMLET, _utm(HAMLET), "https://s.ex/2")
+    records = db.get_history_before("9999", 10)
+    assert db.delete_history_ids([records[0]["id"]]) == 1
+    # The shared base URL stays, the first short URL goes
+    assert _count(db.db_path, "urls") == 2
+    assert db.get_history(2) == [(HAMLET, _utm(HAMLET), "https://s.ex/2")]
+
+
+def test_legacy_history_is_migrated_with_ids_and_dates(legacy_db_path):
+    db = DatabaseManager(str(legacy_db_path))
+    try:
+        for legacy_id, user_id, base_url, utm_url, short_url, created_at in LEGACY_HISTORY:
+            record = [r for r in db.iter_history_records(user_id) if r["id"] == legacy_id][0]
+            assert (record["base_url"], record["utm_url"], record["short_url"]) == (base_url, utm_url, short_url)
+            assert record["created_at"] == created_at
+        assert [record["short_url"] for record in db.search_history(1, "onegin", 10)] == ["https://s.ex/b"]
+        # Both hamlet rows share the base URL; only the onegin UTM URL is stored whole
+        assert _count(legacy_db_path, "urls") == 2 + 3 + 1
+    finally:
+        db.close()
+    connection = sqlite3.connect(legacy_db_path)
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    connection.close()
+    assert "history_legacy" not in tables
@@ -0,0 +1,126 @@
+"""Session updates of one user: concurrent taps are neither serialized nor mixed"""
+import asyncio
+
+import pytest
+
+from src.handlers import utm_generation
+from src.services.shorteners import HedgedShortener, ShortenerProvider
+from src.state.user_state import session_locks, user_data
+
+
+USER_ID = 7
+
+
+class FakeMessage:
+    class Chat:
+        id = 42
+
+    chat = Chat()
+
+    def __init__(self) -> None:
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None):
+        self.answers.append(text)
+
+
+class FakeCallback:
+    class User:
+        id = USER_ID
+
+    from_user = User()
+
+    def __init__(self, data: str) -> None:
+        self.data = data
+        self.message = FakeMessage()
+
+    async def answer(self, *args, **kwargs):
+        # A Telegram round trip: other updates run meanwhile
+        await asyncio.sleep(0)
+
+
+class SlowProvider(ShortenerProvider):
+    name = "slow"
+
+    def __init__(self, latency: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.urls = []
+
+    async def shorten(self, long_url: str) -> str:
+        self.urls.append(long_url)
+        number = len(self.urls)
+        await asyncio.sleep(self.latency)
+        return f"https://s.example/{number}"
+
+
+class StubHistory:
+    def add_history(self, user_id, base_url, full_url, short_url):
+        pass
+
+
+class StubRetryQueue:
+    async def enqueue(self, user_id, chat_id, base_url, full_url):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def session(monkeypatch):
+    monkeypatch.setitem(
+        user_data,
+        USER_ID,
+        {
+            "base_url": "https://www.gorbilet.com/actions/hamlet/",
+            "utm_source": "vk",
+            "utm_medium": "post",
+            "utm_campaign": "spring",
+        },
+    )
+
+
+async def _tap_all(shortener, *callbacks):
+    await asyncio.gather(
+        *(
+            utm_generation.add_date_choice(callback, StubHistory(), shortener, StubRetryQueue())
+            for callback in callbacks
+        )
+    )
+
+
+def test_double_tap_shares_one_shortener_call():
+    provider = SlowProvider(0.05)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=5.0)
+    first, second = FakeCallback("adddate:today"), FakeCallback("adddate:today")
+
+    asyncio.run(_tap_all(shortener, first, second))
+    assert len(provider.urls) == 1
+    assert shortener.single_flight.coalesced == 1
+    assert "https://s.example/1" in first.message.answers[0] and first.message.answers == second.message.answers
+
+
+def test_other_updates_do_not_wait_for_a_slow_shortener():
+    provider = SlowProvider(1.0)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=5.0)
+    generating, manual = FakeCallback("adddate:none"), FakeCallback("adddate:manual")
+
+    async def scenario():
+        generation = asyncio.create_task(_tap_all(shortener, generating))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(_tap_all(shortener, manual), 0.2)
+        assert manual.message.answers and not generating.message.answers
+        generation.cancel()
+
+    asyncio.run(scenario())
+    assert user_data[USER_ID]["awaiting_date"] is True
+    assert len(session_locks) == 0
+
+
+def test_each_tap_builds_its_link_from_its_own_choice():
+    provider = SlowProvider(0.05)
+    shortener = HedgedShortener(provider, None, initial_hedge_delay=5.0)
+    today, tomorrow = FakeCallback("adddate:today"), FakeCallback("adddate:tomorrow")
+
+    asyncio.run(_tap_all(shortener, today, tomorrow))
+    suffixes = sorted(url.rsplit("utm_content=", 1)[1] for url in provider.urls)
+    assert len(set(suffixes)) == 2
+    assert today.message.answers[0] != tomorrow.message.answers[0]
@@ -0,0 +1,104 @@
+import asyncio
+import re
+
+from src.handlers import commands
+from src.handlers.commands import paginate_users, show_users
+
+
+class FakeMessage:
+    def __init__(self):
+        self.text = None
+        self.keyboard = None
+
+    async def answer(self, text, reply_markup=None):
+        self.text, self.keyboard = text, reply_markup
+
+    async def edit_text(self, text, reply_markup=None):
+        self.text, self.keyboard = text, reply_markup
+
+
+class FakeCallback:
+    def __init__(self, data, message):
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def _user_ids(message):
+    return [int(user_id) for user_id in re.findall(r"^• ID (\d+) \|", message.text, re.MULTILINE)]
+
+
+def _buttons(message):
+    return {
+        button.text: button.callback_data
+        for row in message.keyboard.inline_keyboard
+        for button in row
+        if button.callback_data
+    }
+
+
+def _press(storage, message, text):
+    asyncio.run(paginate_users(FakeCallback(_buttons(message)[text], message), storage))
+    return _user_ids(message)
+
+
+def test_cursor_fits_telegram_callback_data_limit(engine, monkeypatch):
+    monkeypatch.setattr(commands, "USERS_PAGE_SIZE", 1)
+    # Telegram user ids fit in 52 bits; timestamps carry microseconds
+    for user_id in (2 ** 52 - 1, 2 ** 52 - 2, 2 ** 52 - 3):
+        engine.authorize_user(user_id, "user")
+        engine.ban_user(user_id, "user", "invalid_password")
+    message = FakeMessage()
+    for kind in ("active", "banned"):
+        asyncio.run(paginate_users(FakeCallback(f"users:{kind}:n:", message), engine))
+        _press(engine, message, "Старее ➡️")
+        buttons = _buttons(message)
+        assert {"⬅️ Новее", "Старее ➡️"} <= buttons.keys()
+        for data in buttons.values():
+            assert len(data.encode("utf-8")) <= 64, data
+
+
+def test_paging_sees_every_user_once_while_new_users_arrive(engine, monkeypatch):
+    monkeypatch.setattr(commands, "USERS_PAGE_SIZE", 4)
+    initial = list(range(1, 12))
+    for user_id in initial:
+        engine.authorize_user(user_id, f"user{user_id}")
+
+    message = FakeMessage()
+    asyncio.run(show_users(FakeCallback("settings:view_users", message), engine))
+    pages = [_user_ids(message)]
+    new_user = 1000
+    while "Старее ➡️" in _buttons(message):
+        # Newer users sort before the cursor and must neither repeat nor push rows out
+        for _ in range(3):
+            engine.authorize_user(new_user, "late")
+            new_user += 1
+        pages.append(_press(engine, message, "Старее ➡️"))
+
+    seen = [user_id for page in pages for user_id in page]
+    assert sorted(seen) == initial
+    assert [len(page) for page in pages] == [4, 4, 3]
+
+    assert _press(engine, message, "⬅️ Новее") == pages[1]
+    assert _press(engine, message, "⬅️ Новее") == pages[0]
+
+
+def test_users_removed_between_pages_leave_no_gap(engine, monkeypatch):
+    monkeypatch.setattr(commands, "USERS_PAGE_SIZE", 3)
+    for user_id in range(1, 10):
+        engine.authorize_user(user_id, None)
+
+    message = FakeMessage()
+    asyncio.run(show_users(FakeCallback("settings:view_users", message), engine))
+    first = _user_ids(message)
+    # The last row of the page (the cursor itself) and an unseen row disappear
+    engine.delete_user(first[-1])
+    engine.delete_user(first[-1] - 2)
+    second = _press(engine, message, "Старее ➡️")
+    third = _press(engine, message, "Старее ➡️")
+
+    remaining = sorted(set(range(1, 10)) - {first[-1], first[-1] - 2})
+    assert sorted(first[:-1] + second + third) == remaining
+    assert "Старее ➡️" not in _buttons(message)
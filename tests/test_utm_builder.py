@@ -0,0 +1,144 @@
+"""Round-trip properties of the UTM builder over seeded random URLs and values"""
+import random
+from urllib.parse import quote
+
+import pytest
+
+from src.services.utm_builder import (
+    UTM_KEYS,
+    build_utm_url,
+    build_utm_urls,
+    canonical_url,
+    extract_utm_params,
+    parse_url,
+    remove_utm_params,
+)
+
+
+SEEDS = range(200)
+# Characters that break a query if left unencoded, plus Cyrillic and an emoji
+_VALUE_ALPHABET = "abcXYZ019 -_.~&=#?+%/:;@!'()*,абвЖЯ🎭"
+_WORD_ALPHABET = "abcdefxyz0123456789-_"
+
+
+def _word(rng, low=1, high=8):
+    return "".join(rng.choice(_WORD_ALPHABET) for _ in range(rng.randint(low, high)))
+
+
+def _value(rng):
+    return "".join(rng.choice(_VALUE_ALPHABET) for _ in range(rng.randint(1, 12)))
+
+
+def _random_url(rng):
+    """Base URL with mixed-case host, repeated plain params, stale UTM params and maybe a fragment"""
+    scheme = rng.choice(["http", "https", "HTTPS"])
+    host = rng.choice(["Example.COM", "www.gorbilet.com", "SPB.gorbilet.com", "user@Host.ru:8080"])
+    path = "/" + "/".join(_word(rng) for _ in range(rng.randint(0, 3)))
+    plain_keys = [_word(rng, 1, 4) for _ in range(rng.randint(0, 3))]
+    pairs = []
+    for _ in range(rng.randint(0, 6)):
+        if plain_keys and rng.random() < 0.7:
+            # Reuse a key so that repeated parameters appear
+            pairs.append(f"{rng.choice(plain_keys)}={quote(_value(rng), safe='')}")
+        else:
+            pairs.append(f"{rng.choice(UTM_KEYS)}={quote(_value(rng), safe='')}")
+    rng.shuffle(pairs)
+    url = f"{scheme}://{host}{path}"
+    if pairs:
+        url += "?" + "&".join(pairs)
+    if rng.random() < 0.5:
+        url += "#" + rng.choice(["top", "tickets/2", "a=b&c", "section-" + _word(rng)])
+    return url
+
+
+def _plain_pairs(url):
+    return list(parse_url(url).query)
+
+
+def _utm_values(rng):
+    values = {key: _value(rng) for key in ("utm_source", "utm_medium", "utm_campaign")}
+    values["utm_content"] = rng.choice([None, "", _value(rng)])
+    return values
+
+
+def _build(base_url, values):
+    return build_utm_url(
+        base_url, values["utm_source"], values["utm_medium"], values["utm_campaign"], values["utm_content"]
+    )
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_fragment_stays_at_the_end(seed):
+    rng = random.Random(seed)
+    base_url = _random_url(rng)
+    result = _build(base_url, _utm_values(rng))
+
+    _, hash_sign, fragment = base_url.partition("#")
+    if hash_sign:
+        assert result.endswith("#" + fragment)
+        assert result.index("utm_source=") < result.rindex("#")
+    else:
+        assert "#" not in result
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_plain_params_are_kept_with_repeats_and_order(seed):
+    rng = random.Random(seed)
+    base_url = _random_url(rng)
+    result = _build(base_url, _utm_values(rng))
+    assert _plain_pairs(result) == _plain_pairs(base_url)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_utm_keys_are_replaced_not_duplicated(seed):
+    rng = random.Random(seed)
+    values = _utm_values(rng)
+    result = _build(_random_url(rng), values)
+
+    utm_pairs = parse_url(result).utm
+    assert len(utm_pairs) == len({key for key, _ in utm_pairs})
+    expected = {key: value for key, value in values.items() if value}
+    assert extract_utm_params(result) == expected
+    # UTM parameters follow the plain ones in the fixed UTM_KEYS order
+    assert [key for key, _ in utm_pairs] == [key for key in UTM_KEYS if key in expected]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_values_are_percent_encoded(seed):
+    rng = random.Random(seed)
+    values = _utm_values(rng)
+    result = _build(_random_url(rng), values)
+
+    query = result.partition("?")[2].partition("#")[0]
+    for pair in query.split("&"):
+        key, _, raw_value = pair.partition("=")
+        if key in UTM_KEYS:
+            assert raw_value.isascii()
+            assert not set(raw_value) & set(" &=#?+")
+    assert extract_utm_params(result) == {key: value for key, value in values.items() if value}
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_canonical_url_is_idempotent(seed):
+    rng = random.Random(seed)
+    url = _random_url(rng)
+    canonical = canonical_url(url)
+    assert canonical_url(canonical) == canonical
+
+    built = _build(url, _utm_values(rng))
+    assert canonical_url(built) == built
+    assert canonical_url(remove_utm_params(url)) == remove_utm_params(url)
+
+
+def test_canonical_url_ignores_utm_order_and_host_case():
+    first = canonical_url("https://Ex.com/a?x=1&utm_source=vk&utm_medium=post#f")
+    second = canonical_url("HTTPS://ex.com/a?utm_medium=post&x=1&utm_source=vk#f")
+    assert first == second == "https://ex.com/a?x=1&utm_source=vk&utm_medium=post#f"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_build_matches_single_builds(seed):
+    rng = random.Random(seed)
+    base_url = _random_url(rng)
+    batch = [_utm_values(rng) for _ in range(10)]
+    assert build_utm_urls(base_url, batch) == [_build(base_url, values) for values in batch]